@@ -0,0 +1,89 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from chat.models import Conversation, Message
+
+
+LAZY_MIDDLEWARE = 'shetrip.middleware.LazySessionRefreshMiddleware'
+
+MODES = {
+    # The previous configuration: DB sessions saved on every request
+    'save-every-request': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'SESSION_SAVE_EVERY_REQUEST': True,
+        'MIDDLEWARE': [m for m in settings.MIDDLEWARE if m != LAZY_MIDDLEWARE],
+    },
+    # Current configuration: cached_db sessions refreshed lazily
+    'lazy-refresh': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+        'SESSION_SAVE_EVERY_REQUEST': False,
+        'MIDDLEWARE': settings.MIDDLEWARE,
+    },
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measure chat seen-status polling throughput with per-request vs lazy session saves (data is rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Polls per mode (default: 500)')
+        parser.add_argument('--messages', type=int, default=20, help='Messages in the polled conversation (default: 20)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                conversation, user = self._fixture(options['messages'])
+                url = reverse('chat:check_seen_status', args=[conversation.id])
+                for mode, overrides in MODES.items():
+                    self._run(mode, overrides, user, url, options['requests'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _fixture(self, message_count):
+        sender = User.objects.create_user('bench_poll_sender', password='x')
+        recipient = User.objects.create_user('bench_poll_recipient', password='x')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(sender, recipient)
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender=sender, recipient=recipient, content=f'message {i}')
+            for i in range(message_count)
+        ])
+        return conversation, sender
+
+    def _run(self, mode, overrides, user, url, request_count):
+        with override_settings(ALLOWED_HOSTS=['testserver'], SECURE_SSL_REDIRECT=False, **overrides):
+            client = Client()
+            client.force_login(user)
+            client.get(url)  # Warm up: load the session and URL resolver
+
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for _ in range(request_count):
+                    response = client.get(url)
+                elapsed = time.perf_counter() - started
+
+        if response.status_code != 200:
+            self.stderr.write(self.style.ERROR(f'{mode}: poll returned HTTP {response.status_code}'))
+            return
+
+        session_writes = sum(
+            1 for query in queries.captured_queries
+            if 'django_session' in query['sql'] and not query['sql'].lstrip().upper().startswith('SELECT')
+        )
+        self.stdout.write(
+            f'{mode:>20}: {request_count / elapsed:8.1f} req/s, '
+            f'{len(queries) / request_count:.2f} queries/request, '
+            f'{session_writes} session writes'
+        )
@@ -0,0 +1,115 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_summaries(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    ConversationParticipant = apps.get_model('chat', 'ConversationParticipant')
+    Message = apps.get_model('chat', 'Message')
+
+    # Messages sent through the AJAX endpoint were saved without a conversation
+    members = {}
+    for conversation_id, user_id in ConversationParticipant.objects.values_list('conversation_id', 'user_id'):
+        members.setdefault(conversation_id, set()).add(user_id)
+    by_pair = {frozenset(users): conversation_id for conversation_id, users in members.items() if len(users) == 2}
+
+    orphans = {}
+    for message_id, sender_id, recipient_id in Message.objects.filter(
+        conversation__isnull=True
+    ).values_list('id', 'sender_id', 'recipient_id').iterator():
+        conversation_id = by_pair.get(frozenset((sender_id, recipient_id)))
+        if conversation_id:
+            orphans.setdefault(conversation_id, []).append(message_id)
+    for conversation_id, message_ids in orphans.items():
+        Message.objects.filter(id__in=message_ids).update(conversation_id=conversation_id)
+
+    for conversation in Conversation.objects.iterator():
+        last = Message.objects.filter(conversation=conversation).order_by('-timestamp', '-id').first()
+        if last:
+            Conversation.objects.filter(pk=conversation.pk).update(
+                last_message=last,
+                last_message_snippet=(last.content or '')[:120],
+                last_message_type=last.message_type,
+                last_message_at=last.timestamp,
+                last_message_sender_id=last.sender_id,
+            )
+
+    unread = Message.objects.filter(
+        is_read=False, conversation__isnull=False
+    ).values('conversation_id', 'recipient_id').annotate(count=Count('id'))
+    for row in unread:
+        ConversationParticipant.objects.filter(
+            conversation_id=row['conversation_id'], user_id=row['recipient_id']
+        ).update(unread_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_conversation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Adopt the auto-created participants table as an explicit through model
+        # without touching the database, then add columns to it normally.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ConversationParticipant',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='chat.conversation')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'chat_conversation_participants',
+                        'unique_together': {('conversation', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='participants',
+                    field=models.ManyToManyField(related_name='conversations', through='chat.ConversationParticipant', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_snippet',
+            field=models.CharField(blank=True, max_length=120),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_type',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['-updated_at', '-id'], name='chat_conv_updated_idx'),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:12
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_last_seen(apps, schema_editor):
+    ConversationParticipant = apps.get_model('chat', 'ConversationParticipant')
+    Message = apps.get_model('chat', 'Message')
+    seen = Message.objects.filter(
+        is_read=True, conversation__isnull=False
+    ).values('conversation_id', 'recipient_id').annotate(newest=Max('id'))
+    for row in seen:
+        ConversationParticipant.objects.filter(
+            conversation_id=row['conversation_id'], user_id=row['recipient_id']
+        ).update(last_seen_message_id=row['newest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_seen_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_last_seen, migrations.RunPython.noop),
+    ]
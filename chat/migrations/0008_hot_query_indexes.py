@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_participant_last_seen_message'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient'], name='chat_msg_unread_idx'),
+        ),
+    ]
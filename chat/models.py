@@ -1,15 +1,29 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from users import counters
+
 
 class Conversation(models.Model):
-    participants = models.ManyToManyField(User, related_name='conversations')
+    participants = models.ManyToManyField(User, related_name='conversations', through='ConversationParticipant')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized summary of the newest message, kept current by chat.signals
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_snippet = models.CharField(max_length=120, blank=True)
+    last_message_type = models.CharField(max_length=10, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['-updated_at', '-id'], name='chat_conv_updated_idx'),
+        ]
 
     def str(self):
         return f"Conversation {self.id}"
@@ -17,6 +31,47 @@ class Conversation(models.Model):
     def get_other_participant(self, user):
         return self.participants.exclude(pk=user.pk).first()
 
+    def mark_read(self, user):
+        """
+        Mark every message ``user`` has received here as seen in one UPDATE,
+        reset their unread count and advance their read receipt.
+        Returns the id of the newest message they have now seen, or None.
+        """
+        unread = Message.objects.filter(conversation=self, recipient=user, is_read=False)
+        newest = unread.aggregate(newest=Max('id'))['newest']
+        if newest is None:
+            return ConversationParticipant.objects.filter(
+                conversation=self, user=user
+            ).values_list('last_seen_message_id', flat=True).first()
+
+        with transaction.atomic():
+            # Bounded by id so messages arriving mid-update stay unread
+            marked = unread.filter(id__lte=newest).update(is_read=True, seen_at=timezone.now())
+            ConversationParticipant.objects.filter(conversation=self, user=user).update(
+                unread_count=Greatest(F('unread_count') - marked, 0),
+                last_seen_message_id=Greatest(Coalesce('last_seen_message_id', 0), newest),
+            )
+        counters.adjust(user.pk, 'unread_messages_count', -marked)
+        return newest
+
+
+class ConversationParticipant(models.Model):
+    """A user's membership in a conversation, with their unread message count"""
+    # Matches the auto-created M2M table this model took over
+    id = models.AutoField(primary_key=True)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_memberships')
+    unread_count = models.PositiveIntegerField(default=0)
+    # Newest message this user has seen; the other side's read receipt
+    last_seen_message_id = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'chat_conversation_participants'
+        unique_together = ('conversation', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} in conversation {self.conversation_id}"
+
 
 class Message(models.Model):
     MESSAGE_TYPES = [
@@ -50,9 +105,22 @@ class Message(models.Model):
             self.is_read = True
             self.seen_at = timezone.now()
             self.save()
+            if self.conversation_id:
+                ConversationParticipant.objects.filter(
+                    conversation_id=self.conversation_id, user_id=self.recipient_id
+                ).update(
+                    unread_count=Greatest(F('unread_count') - 1, 0),
+                    last_seen_message_id=Greatest(Coalesce('last_seen_message_id', 0), self.id),
+                )
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination of a conversation's history
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_msg_history_idx'),
+            # Unread badge counts (partial: see users.Notification)
+            models.Index(fields=['recipient'], condition=models.Q(is_read=False), name='chat_msg_unread_idx'),
+        ]
 
     def str(self):
         return f"{self.sender.username} -> {self.recipient.username}: {self.content[:50] if self.content else self.message_type}"
\ No newline at end of file
@@ -0,0 +1,299 @@
+"""Real-time chat delivery over raw ASGI WebSockets.
+
+``shetrip.asgi`` routes ``/ws/chat/<conversation_id>/`` here. Each socket
+subscribes to its conversation's channel on the configured broker; Django
+code publishes new messages, read receipts and typing events to that
+channel from any thread.
+
+The ``InProcessBroker`` only reaches sockets served by the same process.
+``RedisBroker`` relays every event through Redis pub/sub so sockets on any
+worker receive it; settings select it whenever ``REDIS_URL`` is set.
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http.request import split_domain_port, validate_host
+from django.utils.http import is_same_domain
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER = 'chat.realtime.InProcessBroker'
+
+PATH_PATTERN = re.compile(r'^/ws/chat/(?P<conversation_id>\d+)/$')
+
+# Close codes in the 4000-4999 application range
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+
+
+def conversation_channel(conversation_id):
+    return f'conversation.{conversation_id}'
+
+
+class Subscription:
+    """One socket's inbox: events are handed to its event loop thread-safely"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            pass  # Loop already closed; the socket is gone
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class BaseBroker:
+    """Fan-out of events to the sockets subscribed to a channel"""
+
+    def subscribe(self, channel):
+        """Return a Subscription for ``channel``; called from the socket's event loop"""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, channel, event):
+        """Send ``event`` (a JSON-serializable dict) to every subscriber; safe from any thread"""
+        raise NotImplementedError
+
+
+class InProcessBroker(BaseBroker):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscriptions.pop(subscription.channel, None)
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+class RedisBroker(InProcessBroker):
+    """Publishes through Redis; one listener thread per process hands events to its local sockets"""
+
+    RECONNECT_DELAY = 2  # Seconds between attempts to resubscribe after losing Redis
+
+    def __init__(self, url=None):
+        import redis
+
+        super().__init__()
+        self._errors = (redis.RedisError, OSError)
+        self._redis = redis.Redis.from_url(url or settings.REDIS_URL)
+        self._listener = None
+
+    def subscribe(self, channel):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='chat-redis-listener', daemon=True)
+                self._listener.start()
+        return super().subscribe(channel)
+
+    def publish(self, channel, event):
+        try:
+            self._redis.publish(channel, json.dumps(event))
+        except self._errors:
+            # Clients still poll for receipts, and messages show up on the next page load
+            logger.warning('Could not publish %s to Redis', channel, exc_info=True)
+
+    def dispatch(self, message):
+        """Hand one pub/sub message from Redis to this process's subscribers"""
+        if message['type'] == 'pmessage':
+            super().publish(message['channel'].decode(), json.loads(message['data']))
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(conversation_channel('*'))
+                for message in pubsub.listen():
+                    self.dispatch(message)
+            except self._errors:
+                logger.warning('Lost the Redis chat subscription; reconnecting', exc_info=True)
+                time.sleep(self.RECONNECT_DELAY)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'CHAT_REALTIME_BROKER', DEFAULT_BROKER))()
+    return _broker
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'CHAT_REALTIME_BROKER':
+        _broker = None
+
+
+def publish(conversation_id, event):
+    get_broker().publish(conversation_channel(conversation_id), event)
+
+
+def message_event(message):
+    return {
+        'type': 'message',
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'content': message.content,
+        'image': message.image.url if message.image else None,
+        'message_type': message.message_type,
+        'timestamp': message.timestamp.strftime('%b %d, %H:%M'),
+    }
+
+
+def read_event(user_id, seen_up_to):
+    return {'type': 'read', 'user_id': user_id, 'seen_up_to': seen_up_to}
+
+
+# --- ASGI application -------------------------------------------------------
+
+def _origin_allowed(headers):
+    """Whether the handshake comes from this site or a CSRF_TRUSTED_ORIGINS origin.
+
+    Browsers send the session cookie on cross-site WebSocket handshakes too,
+    so the Origin is checked as Django's CSRF middleware checks it for POSTs.
+    """
+    values = {name: value.decode('latin-1') for name, value in headers if name in (b'origin', b'host')}
+    origin = values.get(b'origin')
+    if not origin:
+        return False
+
+    host = values.get(b'host', '')
+    if urlsplit(origin).netloc == host and validate_host(split_domain_port(host)[0], settings.ALLOWED_HOSTS):
+        return True
+
+    for trusted in settings.CSRF_TRUSTED_ORIGINS:
+        if '*' not in trusted:
+            if origin == trusted:
+                return True
+            continue
+        trusted, parsed = urlsplit(trusted), urlsplit(origin)
+        if parsed.scheme == trusted.scheme and is_same_domain(
+            parsed.netloc, trusted.netloc[trusted.netloc.index('*') + 1:],
+        ):
+            return True
+    return False
+
+
+def _session_user(headers):
+    """The logged-in user for a handshake's session cookie, or None"""
+    from django.contrib.auth import get_user
+
+    cookies = SimpleCookie()
+    for name, value in headers:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = get_user(SimpleNamespace(session=session))
+    return user if user.is_authenticated else None
+
+
+def _is_participant(conversation_id, user):
+    from .models import ConversationParticipant
+    return ConversationParticipant.objects.filter(conversation_id=conversation_id, user=user).exists()
+
+
+def _mark_read(conversation_id, user):
+    from .models import Conversation
+    conversation = Conversation.objects.filter(pk=conversation_id).first()
+    return conversation.mark_read(user) if conversation else None
+
+
+async def _handle_client_event(conversation_id, user, text):
+    try:
+        event = json.loads(text)
+    except ValueError:
+        return
+    if not isinstance(event, dict):
+        return
+
+    if event.get('type') == 'typing':
+        publish(conversation_id, {'type': 'typing', 'user_id': user.pk})
+    elif event.get('type') == 'read':
+        seen_up_to = await sync_to_async(_mark_read)(conversation_id, user)
+        if seen_up_to:
+            publish(conversation_id, read_event(user.pk, seen_up_to))
+
+
+async def websocket_application(scope, receive, send):
+    """Serve one chat socket: push channel events out, accept typing/read events in"""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+
+    match = PATH_PATTERN.match(scope['path'])
+    if not match:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    conversation_id = int(match['conversation_id'])
+
+    if not _origin_allowed(scope.get('headers', [])):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    user = await sync_to_async(_session_user)(scope.get('headers', []))
+    if user is None or not await sync_to_async(_is_participant)(conversation_id, user):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    await send({'type': 'websocket.accept'})
+    broker = get_broker()
+    subscription = broker.subscribe(conversation_channel(conversation_id))
+
+    async def forward():
+        while True:
+            event = await subscription.get()
+            await send({'type': 'websocket.send', 'text': json.dumps(event)})
+
+    forwarder = asyncio.ensure_future(forward())
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message['type'] == 'websocket.receive' and message.get('text'):
+                await _handle_client_event(conversation_id, user, message['text'])
+    finally:
+        forwarder.cancel()
+        broker.unsubscribe(subscription)
@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from users import counters
+
+from . import realtime
+from .models import Conversation, ConversationParticipant, Message
+
+
+@receiver(post_save, sender=Message)
+def update_conversation_summary(sender, instance, created, **kwargs):
+    """Record a new message as its conversation's latest and bump the recipient's unread count"""
+    if not created or not instance.conversation_id:
+        return
+    with transaction.atomic():
+        Conversation.objects.filter(pk=instance.conversation_id).update(
+            last_message=instance,
+            last_message_snippet=(instance.content or '')[:120],
+            last_message_type=instance.message_type,
+            last_message_at=instance.timestamp,
+            last_message_sender_id=instance.sender_id,
+            updated_at=instance.timestamp,
+        )
+        if not instance.is_read:
+            ConversationParticipant.objects.filter(
+                conversation_id=instance.conversation_id, user_id=instance.recipient_id
+            ).update(unread_count=F('unread_count') + 1)
+
+    event = realtime.message_event(instance)
+    transaction.on_commit(lambda: realtime.publish(instance.conversation_id, event))
+
+
+@receiver(post_save, sender=Message)
+def count_unread_message(sender, instance, created, **kwargs):
+    """Keep the recipient's cached unread message badge in step"""
+    if created and not instance.is_read:
+        counters.adjust(instance.recipient_id, 'unread_messages_count', 1)
+    elif not created:
+        counters.invalidate(instance.recipient_id, 'unread_messages_count')
+
+
+@receiver(post_delete, sender=Message)
+def uncount_message(sender, instance, **kwargs):
+    counters.invalidate(instance.recipient_id, 'unread_messages_count')
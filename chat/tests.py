@@ -1,3 +1,406 @@
-from django.test import TestCase
+import asyncio
+import json
+import queue
+import threading
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users import counters
+
+from . import realtime, views
+from .models import Conversation, ConversationParticipant, Message
+
+
+class RecordingBroker(realtime.BaseBroker):
+    """Stand-in broker that records what Django code publishes"""
+    published = []
+
+    def subscribe(self, channel):
+        return realtime.Subscription(channel)
+
+    def unsubscribe(self, subscription):
+        pass
+
+    def publish(self, channel, event):
+        self.published.append((channel, event))
+
+
+class InProcessBrokerTests(SimpleTestCase):
+
+    def test_event_published_from_another_thread_reaches_subscriber(self):
+        async def scenario():
+            broker = realtime.InProcessBroker()
+            subscription = broker.subscribe('conversation.1')
+            thread = threading.Thread(target=broker.publish, args=('conversation.1', {'type': 'typing'}))
+            thread.start()
+            thread.join()
+            return await asyncio.wait_for(subscription.get(), 1)
+
+        self.assertEqual(asyncio.run(scenario()), {'type': 'typing'})
+
+    def test_events_stay_on_their_channel(self):
+        async def scenario():
+            broker = realtime.InProcessBroker()
+            subscription = broker.subscribe('conversation.1')
+            broker.publish('conversation.2', {'type': 'typing'})
+            await asyncio.sleep(0)
+            return subscription.queue.empty()
+
+        self.assertTrue(asyncio.run(scenario()))
+
+    def test_unsubscribed_socket_receives_nothing(self):
+        async def scenario():
+            broker = realtime.InProcessBroker()
+            subscription = broker.subscribe('conversation.1')
+            broker.unsubscribe(subscription)
+            broker.publish('conversation.1', {'type': 'typing'})
+            await asyncio.sleep(0)
+            return subscription.queue.empty()
+
+        self.assertTrue(asyncio.run(scenario()))
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for RedisBrokers in one process to reach each other"""
+
+    def __init__(self):
+        self.subscribers = []
+
+    def publish(self, channel, data):
+        for inbox in self.subscribers:
+            inbox.put({'type': 'pmessage', 'pattern': b'conversation.*', 'channel': channel.encode(), 'data': data})
+
+    def pubsub(self, **kwargs):
+        inbox = queue.Queue()
+        return mock.Mock(psubscribe=lambda pattern: self.subscribers.append(inbox), listen=lambda: iter(inbox.get, None))
+
+
+class RedisBrokerTests(SimpleTestCase):
+
+    def _broker(self, client):
+        with mock.patch('redis.Redis.from_url', return_value=client):
+            return realtime.RedisBroker('redis://cache:6379')
+
+    def test_event_published_by_one_worker_reaches_a_socket_on_another(self):
+        client = FakeRedis()
+        publisher, listener = self._broker(client), self._broker(client)
+
+        async def scenario():
+            subscription = listener.subscribe('conversation.1')
+            while not client.subscribers:
+                await asyncio.sleep(0.01)
+            publisher.publish('conversation.2', {'type': 'typing', 'user_id': 2})
+            publisher.publish('conversation.1', {'type': 'typing', 'user_id': 1})
+            return await asyncio.wait_for(subscription.get(), 1), subscription.queue.empty()
+
+        self.assertEqual(asyncio.run(scenario()), ({'type': 'typing', 'user_id': 1}, True))
+        self.assertEqual(len(client.subscribers), 1)  # Publishing alone starts no listener
+
+    def test_unreachable_redis_does_not_fail_the_request(self):
+        import redis
+
+        client = mock.Mock()
+        client.publish.side_effect = redis.ConnectionError('down')
+        broker = self._broker(client)
+
+        with self.assertLogs('chat.realtime', 'WARNING'):
+            broker.publish('conversation.1', {'type': 'typing'})
+
+
+def _conversation_between(*users):
+    conversation = Conversation.objects.create()
+    conversation.participants.add(*users)
+    return conversation
+
+
+@override_settings(CHAT_REALTIME_BROKER='chat.tests.RecordingBroker')
+class PublishingTests(TestCase):
+
+    def setUp(self):
+        RecordingBroker.published = []
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.conversation = _conversation_between(self.alice, self.bob)
+
+    def test_new_message_is_published_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(
+                conversation=self.conversation, sender=self.alice, recipient=self.bob, content='hi'
+            )
+
+        channel, event = RecordingBroker.published[-1]
+        self.assertEqual(channel, realtime.conversation_channel(self.conversation.id))
+        self.assertEqual(event['type'], 'message')
+        self.assertEqual(event['id'], message.id)
+        self.assertEqual(event['content'], 'hi')
+
+    def test_opening_conversation_publishes_read_receipt(self):
+        message = Message.objects.create(
+            conversation=self.conversation, sender=self.alice, recipient=self.bob, content='hi'
+        )
+        self.client.force_login(self.bob)
+        self.client.get(f'/chat/conversation/{self.conversation.id}/')
+
+        self.assertIn(
+            (realtime.conversation_channel(self.conversation.id), realtime.read_event(self.bob.id, message.id)),
+            RecordingBroker.published,
+        )
+
+
+@override_settings(CHAT_REALTIME_BROKER=realtime.DEFAULT_BROKER)
+class WebSocketTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.conversation = _conversation_between(self.alice, self.bob)
+
+    def _scope(self, user=None, origin='http://testserver'):
+        headers = [(b'host', b'testserver'), (b'origin', origin.encode())]
+        if user is not None:
+            self.client.force_login(user)
+            session_id = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_id}'.encode()))
+        return {'type': 'websocket', 'path': f'/ws/chat/{self.conversation.id}/', 'headers': headers}
+
+    def _run(self, scope, client_events, after_accept=None):
+        """Connect, send ``client_events``, and collect what the server sent until disconnect"""
+        async def scenario():
+            inbox, outbox = asyncio.Queue(), asyncio.Queue()
+            await inbox.put({'type': 'websocket.connect'})
+            app = asyncio.ensure_future(realtime.websocket_application(scope, inbox.get, outbox.put))
+
+            sent = [await asyncio.wait_for(outbox.get(), 2)]
+            if sent[0]['type'] == 'websocket.accept':
+                if after_accept:
+                    after_accept()
+                for event in client_events:
+                    await inbox.put({'type': 'websocket.receive', 'text': json.dumps(event)})
+                sent.append(await asyncio.wait_for(outbox.get(), 2))
+                await inbox.put({'type': 'websocket.disconnect'})
+            await asyncio.wait_for(app, 2)
+            return sent
+
+        return async_to_sync(scenario)()
+
+    def test_anonymous_socket_is_rejected(self):
+        sent = self._run(self._scope(), [])
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': realtime.CLOSE_FORBIDDEN}])
+
+    def test_non_participant_is_rejected(self):
+        outsider = User.objects.create_user('carol', password='x')
+        sent = self._run(self._scope(outsider), [])
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': realtime.CLOSE_FORBIDDEN}])
+
+    def test_cross_site_socket_is_rejected(self):
+        for origin in ('https://evil.example', 'http://testserver.evil.example', ''):
+            with self.subTest(origin=origin):
+                sent = self._run(self._scope(self.alice, origin=origin), [])
+                self.assertEqual(sent, [{'type': 'websocket.close', 'code': realtime.CLOSE_FORBIDDEN}])
+
+    @override_settings(CSRF_TRUSTED_ORIGINS=['https://*.shetrip.app'])
+    def test_trusted_origin_is_accepted(self):
+        sent = self._run(self._scope(self.alice, origin='https://www.shetrip.app'), [{'type': 'typing'}])
+        self.assertEqual(sent[0], {'type': 'websocket.accept'})
+
+    def test_published_events_are_pushed_to_participants(self):
+        event = {'type': 'message', 'id': 1}
+        sent = self._run(
+            self._scope(self.alice), [],
+            after_accept=lambda: realtime.publish(self.conversation.id, event),
+        )
+        self.assertEqual(sent[0], {'type': 'websocket.accept'})
+        self.assertEqual(json.loads(sent[1]['text']), event)
+
+    def test_typing_event_is_broadcast_to_the_conversation(self):
+        sent = self._run(self._scope(self.alice), [{'type': 'typing'}])
+        self.assertEqual(json.loads(sent[1]['text']), {'type': 'typing', 'user_id': self.alice.id})
+
+
+def _send(conversation, sender, recipient, content='hi', **fields):
+    return Message.objects.create(conversation=conversation, sender=sender, recipient=recipient, content=content, **fields)
+
+
+class InboxTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.friends = [User.objects.create_user(f'friend{i}') for i in range(5)]
+        self.conversations = [_conversation_between(self.alice, friend) for friend in self.friends]
+
+    def _membership(self, conversation, user):
+        return ConversationParticipant.objects.get(conversation=conversation, user=user)
+
+    def _inbox(self, **params):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('chat:messages'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def test_new_message_updates_the_summary_and_unread_count(self):
+        conversation, bob = self.conversations[0], self.friends[0]
+        _send(conversation, bob, self.alice, 'first')
+        latest = _send(conversation, bob, self.alice, 'x' * 200)
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message, latest)
+        self.assertEqual(conversation.last_message_snippet, 'x' * 120)
+        self.assertEqual((conversation.last_message_type, conversation.last_message_sender), ('text', bob))
+        self.assertEqual(conversation.updated_at, latest.timestamp)
+        self.assertEqual(self._membership(conversation, self.alice).unread_count, 2)
+        self.assertEqual(self._membership(conversation, bob).unread_count, 0)
+
+    def test_inbox_lists_conversations_by_latest_message(self):
+        for conversation, friend in zip(self.conversations, self.friends):
+            _send(conversation, friend, self.alice)
+        _send(self.conversations[2], self.alice, self.friends[2], 'reply')
+
+        entries = self._inbox()['conversations']
+
+        self.assertEqual([entry['other_user'] for entry in entries][:2], [self.friends[2], self.friends[4]])
+        self.assertEqual([entry['unread_count'] for entry in entries], [1] * 5)
+        self.assertEqual(entries[0]['conversation'].last_message_snippet, 'reply')
+
+    def test_inbox_query_count_does_not_grow_with_conversations(self):
+        self._inbox()  # Warms the sidebar counters
+        with CaptureQueriesContext(connection) as few:
+            self._inbox()
+        for i in range(5):
+            friend = User.objects.create_user(f'more{i}')
+            _send(_conversation_between(self.alice, friend), friend, self.alice)
+        self._inbox()
+        with CaptureQueriesContext(connection) as many:
+            self._inbox()
+
+        self.assertEqual(len(many), len(few))
+
+    def test_inbox_pages_cover_every_conversation_once(self):
+        Conversation.objects.update(updated_at=timezone.now())  # Ties are broken by id
+
+        seen, params = [], {}
+        with mock.patch.object(views, 'INBOX_PAGE_SIZE', 2):
+            while params is not None:
+                context = self._inbox(**params)
+                seen += [entry['conversation'].id for entry in context['conversations']]
+                params = context['next_cursor']
+
+        self.assertEqual(seen, sorted((c.id for c in self.conversations), reverse=True))
+
+
+class HistoryPaginationTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.conversation = _conversation_between(self.alice, self.bob)
+        self.messages = [_send(self.conversation, self.alice, self.bob, f'm{i}') for i in range(7)]
+        # Shared timestamps, so the id tie-breaker decides the order
+        Message.objects.filter(id__in=[m.id for m in self.messages[2:5]]).update(timestamp=self.messages[2].timestamp)
+
+    def test_pages_walk_back_through_history_without_gaps(self):
+        page, cursor = views._history_page(self.conversation, limit=3)
+        pages = [page]
+        while cursor:
+            page, cursor = views._history_page(self.conversation, parse_datetime(cursor['before']), cursor['before_id'], 3)
+            pages.append(page)
+
+        self.assertEqual([[m.content for m in page] for page in pages], [['m4', 'm5', 'm6'], ['m1', 'm2', 'm3'], ['m0']])
+
+    def test_history_endpoint_returns_the_page_before_the_cursor(self):
+        self.client.force_login(self.bob)
+        newest = Message.objects.get(pk=self.messages[4].pk)
+
+        response = self.client.get(reverse('chat:conversation_history', args=[self.conversation.id]), {
+            'before': newest.timestamp.isoformat(), 'before_id': newest.id, 'limit': 2,
+        })
+
+        data = response.json()
+        self.assertEqual([m['content'] for m in data['messages']], ['m2', 'm3'])
+        self.assertFalse(data['messages'][0]['is_mine'])
+        self.assertEqual(data['older_cursor']['before_id'], self.messages[2].id)
+
+    def test_history_endpoint_requires_a_cursor_and_membership(self):
+        url = reverse('chat:conversation_history', args=[self.conversation.id])
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+        self.client.force_login(User.objects.create_user('carol'))
+        self.assertEqual(self.client.get(url, {'before': timezone.now().isoformat(), 'before_id': 1}).status_code, 404)
+
+    def test_conversation_page_renders_the_newest_page(self):
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('chat:conversation_detail', args=[self.conversation.id]))
+
+        self.assertEqual([m.content for m in response.context['messages']], [f'm{i}' for i in range(7)])
+        self.assertIsNone(response.context['older_cursor'])
+
+
+class ReadReceiptTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.conversation = _conversation_between(self.alice, self.bob)
+        cache.clear()
+
+    def _membership(self, user):
+        return ConversationParticipant.objects.get(conversation=self.conversation, user=user)
+
+    def test_mark_read_updates_every_unread_message_at_once(self):
+        received = [_send(self.conversation, self.alice, self.bob) for _ in range(4)]
+        sent = _send(self.conversation, self.bob, self.alice)
+
+        with CaptureQueriesContext(connection) as queries:
+            seen_up_to = self.conversation.mark_read(self.bob)
+
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "chat_message"')]
+        self.assertEqual(len(updates), 1)
+
+        self.assertEqual(seen_up_to, received[-1].id)
+        self.assertFalse(Message.objects.filter(recipient=self.bob, is_read=False).exists())
+        self.assertFalse(Message.objects.filter(recipient=self.bob, seen_at__isnull=True).exists())
+        self.assertFalse(Message.objects.get(pk=sent.pk).is_read)
+        membership = self._membership(self.bob)
+        self.assertEqual((membership.unread_count, membership.last_seen_message_id), (0, received[-1].id))
+
+    def test_mark_read_with_nothing_new_keeps_the_receipt(self):
+        first = _send(self.conversation, self.alice, self.bob)
+        self.conversation.mark_read(self.bob)
+        _send(self.conversation, self.bob, self.alice)
+
+        self.assertEqual(self.conversation.mark_read(self.bob), first.id)
+        self.assertEqual(self._membership(self.bob).last_seen_message_id, first.id)
+
+    def test_mark_read_lowers_the_cached_unread_badge(self):
+        for _ in range(3):
+            _send(self.conversation, self.alice, self.bob)
+        self.assertEqual(counters.get_counters(self.bob.pk)['unread_messages_count'], 3)
+
+        self.conversation.mark_read(self.bob)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.get_counters(self.bob.pk)['unread_messages_count'], 0)
+
+    def test_check_seen_status_reports_the_other_sides_receipt(self):
+        message = _send(self.conversation, self.alice, self.bob)
+        url = reverse('chat:check_seen_status', args=[self.conversation.id])
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(url).json(), {'seen_up_to': None})
+
+        self.client.force_login(self.bob)
+        self.client.get(reverse('chat:conversation_detail', args=[self.conversation.id]))
+
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(url).json(), {'seen_up_to': message.id})
+        self.client.force_login(User.objects.create_user('carol'))
+        self.assertEqual(self.client.get(url).status_code, 404)
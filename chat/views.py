@@ -2,14 +2,18 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Q
+from django.db.models import Q, OuterRef, Subquery
 from django.http import JsonResponse
-from django.utils import timezone
-from .models import Message, Conversation
+from django.utils.dateparse import parse_datetime
+from . import realtime
+from .models import Message, Conversation, ConversationParticipant
 from users.models import UserConnection
 from django.views.decorators.http import require_http_methods
 
 
+INBOX_PAGE_SIZE = 30
+
+
 @login_required
 def messages_view(request):
 
@@ -21,43 +25,79 @@ def messages_view(request):
     except:
         profile = None
 
-    conversations = Conversation.objects.filter(
-        participants=user
-    ).select_related().prefetch_related('participants', 'participants__userprofile').order_by('-updated_at')
-
-
-    conversations_with_users = []
-    for conversation in conversations:
-        other_user = conversation.get_other_participant(user)
-        if other_user:
-
-            last_message = Message.objects.filter(
-                Q(sender=user, recipient=other_user) |
-                Q(sender=other_user, recipient=user)
-            ).order_by('-timestamp').first()
+    # One query: the other participant's membership row per conversation, with
+    # the conversation summary and that user's profile joined in, and this
+    # user's unread count from their own membership row as a subquery.
+    my_unread = ConversationParticipant.objects.filter(
+        conversation_id=OuterRef('conversation_id'), user=user
+    ).values('unread_count')[:1]
+
+    memberships = ConversationParticipant.objects.filter(
+        conversation__participants=user
+    ).exclude(user=user).select_related(
+        'conversation', 'user', 'user__userprofile'
+    ).annotate(my_unread=Subquery(my_unread)).order_by('-conversation__updated_at', '-conversation_id')
+
+    # Keyset pagination on (updated_at, id): ?before=<updated_at>&before_id=<id>
+    before = parse_datetime(request.GET.get('before', ''))
+    before_id = request.GET.get('before_id', '')
+    if before and before_id.isdigit():
+        memberships = memberships.filter(
+            Q(conversation__updated_at__lt=before) |
+            Q(conversation__updated_at=before, conversation_id__lt=int(before_id))
+        )
 
+    page = list(memberships[:INBOX_PAGE_SIZE + 1])
+    has_more = len(page) > INBOX_PAGE_SIZE
+    page = page[:INBOX_PAGE_SIZE]
 
-            unread_count = Message.objects.filter(
-                sender=other_user,
-                recipient=user,
-                is_read=False
-            ).count()
+    conversations_with_users = [
+        {
+            'conversation': membership.conversation,
+            'other_user': membership.user,
+            'unread_count': membership.my_unread or 0,
+        }
+        for membership in page
+    ]
 
-            conversations_with_users.append({
-                'conversation': conversation,
-                'other_user': other_user,
-                'last_message': last_message,
-                'unread_count': unread_count,
-            })
+    next_cursor = None
+    if has_more:
+        last = page[-1].conversation
+        next_cursor = {'before': last.updated_at.isoformat(), 'before_id': last.id}
 
     context = {
         'conversations': conversations_with_users,
+        'next_cursor': next_cursor,
         'user': user,
         'profile': profile,
     }
     return render(request, 'chat/messages.html', context)
 
 
+HISTORY_PAGE_SIZE = 50
+
+
+def _history_page(conversation, before=None, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Newest ``limit`` messages of a conversation older than the (before, before_id)
+    cursor, in chronological order, plus the cursor for the page before them.
+    """
+    history = Message.objects.filter(conversation=conversation)
+    if before and before_id is not None:
+        history = history.filter(
+            Q(timestamp__lt=before) | Q(timestamp=before, id__lt=before_id)
+        )
+    page = list(history.order_by('-timestamp', '-id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+
+    older_cursor = None
+    if has_more:
+        older_cursor = {'before': page[0].timestamp.isoformat(), 'before_id': page[0].id}
+    return page, older_cursor
+
+
 @login_required
 def conversation_detail(request, conversation_id):
 
@@ -66,21 +106,6 @@ def conversation_detail(request, conversation_id):
     conversation = get_object_or_404(Conversation, id=conversation_id, participants=user)
     other_user = conversation.get_other_participant(user)
 
-
-    message_list = Message.objects.filter(
-        Q(sender=user, recipient=other_user) |
-        Q(sender=other_user, recipient=user)
-    ).order_by('timestamp')
-
-
-    unread_messages = Message.objects.filter(
-        recipient=user,
-        sender=other_user,
-        is_read=False
-    )
-    for msg in unread_messages:
-        msg.mark_as_seen()
-
     if request.method == 'POST':
         content = request.POST.get('content', '').strip()
         image = request.FILES.get('image')
@@ -111,16 +136,60 @@ def conversation_detail(request, conversation_id):
                 message_type='file'
             )
 
-        conversation.updated_at = timezone.now()
-        conversation.save()
         return redirect('chat:conversation_detail', conversation_id=conversation_id)
 
+
+    seen_up_to = conversation.mark_read(user)
+    if seen_up_to:
+        realtime.publish(conversation.id, realtime.read_event(user.id, seen_up_to))
+
+    message_list, older_cursor = _history_page(conversation)
+
     context = {
         'conversation': conversation,
         'other_user': other_user,
         'messages': message_list,
+        'older_cursor': older_cursor,
     }
     return render(request, 'chat/conversation_detail.html', context)
+
+
+@login_required
+@require_http_methods(["GET"])
+def conversation_history(request, conversation_id):
+    """Older messages for infinite scroll: ?before=<timestamp>&before_id=<id>"""
+    user = request.user
+    conversation = get_object_or_404(Conversation, id=conversation_id, participants=user)
+
+    before = parse_datetime(request.GET.get('before', ''))
+    before_id = request.GET.get('before_id', '')
+    if not before or not before_id.isdigit():
+        return JsonResponse({'error': 'before and before_id are required'}, status=400)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_PAGE_SIZE)
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+
+    page, older_cursor = _history_page(conversation, before, int(before_id), limit)
+
+    return JsonResponse({
+        'messages': [
+            {
+                'id': message.id,
+                'is_mine': message.sender_id == user.id,
+                'content': message.content,
+                'image': message.image.url if message.image else None,
+                'message_type': message.message_type,
+                'is_read': message.is_read,
+                'timestamp': message.timestamp.strftime('%b %d, %H:%M'),
+            }
+            for message in page
+        ],
+        'older_cursor': older_cursor,
+    })
+
+
 @login_required
 def start_conversation(request, user_id):
 
@@ -168,6 +237,7 @@ def send_message_ajax(request, conversation_id):
         message_type = 'image' if image else 'text'
 
         message = Message.objects.create(
+            conversation=conversation,
             sender=user,
             recipient=other_user,
             content=content if content else None,
@@ -175,9 +245,6 @@ def send_message_ajax(request, conversation_id):
             message_type=message_type
         )
 
-        conversation.updated_at = timezone.now()
-        conversation.save()
-
         return JsonResponse({
             'success': True,
             'message': {
@@ -199,16 +266,8 @@ def send_message_ajax(request, conversation_id):
 @require_http_methods(["GET"])
 def get_unread_count(request, conversation_id):
 
-    user = request.user
-    conversation = get_object_or_404(Conversation, id=conversation_id, participants=user)
-    other_user = conversation.get_other_participant(user)
-
-
-    unread_count = Message.objects.filter(
-        sender=other_user,
-        recipient=user,
-        is_read=False
-    ).count()
+    membership = get_object_or_404(ConversationParticipant, conversation_id=conversation_id, user=request.user)
+    unread_count = membership.unread_count
 
     return JsonResponse({
         'conversation_id': conversation_id,
@@ -220,23 +279,12 @@ def get_unread_count(request, conversation_id):
 @login_required
 @require_http_methods(["GET"])
 def check_seen_status(request, conversation_id):
-
+    """Read receipt: the newest message the other participant has seen"""
     user = request.user
-    conversation = get_object_or_404(Conversation, id=conversation_id, participants=user)
-    other_user = conversation.get_other_participant(user)
+    get_object_or_404(ConversationParticipant, conversation_id=conversation_id, user=user)
 
+    seen_up_to = ConversationParticipant.objects.filter(
+        conversation_id=conversation_id
+    ).exclude(user=user).values_list('last_seen_message_id', flat=True).first()
 
-    my_messages = Message.objects.filter(
-        sender=user,
-        recipient=other_user,
-        conversation=conversation
-    ).values('id', 'is_read', 'seen_at')
-
-    seen_data = {}
-    for msg in my_messages:
-        seen_data[msg['id']] = {
-            'is_read': msg['is_read'],
-            'seen_at': msg['seen_at'].isoformat() if msg['seen_at'] else None
-        }
-
-    return JsonResponse({'messages': seen_data})
\ No newline at end of file
+    return JsonResponse({'seen_up_to': seen_up_to})
@@ -0,0 +1,163 @@
+"""Idempotent completion of SSLCommerz payments.
+
+The browser's success redirect and the gateway's IPN carry the same
+``tran_id`` and often arrive together. Both go through ``complete_payment``:
+the first callback claims the payment by moving it from pending (or failed)
+to processing with a conditional UPDATE, validates it once with the
+gateway, and completes it under row locks. Any other callback for that
+``tran_id`` sees the claim or the completed row and returns without a
+gateway round trip. Successful validations are also cached per ``val_id``.
+
+A payment can complete after the participant's seat hold was released, for
+example when a callback arrives after reconciliation gave up on it. The
+payer then gets a seat back if one is free; otherwise the payment is
+flagged ``needs_refund`` and the outcome is ``SEAT_LOST``.
+"""
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import transaction
+
+from trips import seats
+from trips.models import OrganizedTrip, Payment, TripParticipant
+from .sslcommerz import SSLCommerzPayment
+
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_CACHE_TIMEOUT = 60 * 60 * 24
+
+COMPLETED = 'completed'
+ALREADY_COMPLETED = 'already_completed'
+IN_PROGRESS = 'in_progress'
+INVALID = 'invalid'
+UNAVAILABLE = 'unavailable'
+NOT_FOUND = 'not_found'
+SEAT_LOST = 'seat_lost'
+
+VALID_STATUSES = ('VALID', 'VALIDATED')
+
+
+def validate(val_id, tran_id):
+    """Gateway validation for ``val_id``; VALID results are cached, so each val_id is validated once"""
+    key = f'sslcommerz:validation:{val_id}'
+    result = cache.get(key)
+    if result is None:
+        result = SSLCommerzPayment().validate_transaction(val_id, tran_id)
+        if result.get('status') in VALID_STATUSES:
+            cache.set(key, result, VALIDATION_CACHE_TIMEOUT)
+    return result
+
+
+def matches_payment(payment, validation):
+    """True if a VALID gateway record is for this payment's tran_id and full amount"""
+    if validation.get('status') not in VALID_STATUSES or validation.get('tran_id') != payment.transaction_id:
+        return False
+    try:
+        return Decimal(str(validation.get('amount'))) == payment.total_amount
+    except (InvalidOperation, TypeError):
+        return False
+
+
+def complete_payment(tran_id, val_id, card_type=None):
+    """
+    Complete the payment for ``tran_id`` at most once.
+
+    Returns ``(payment, outcome)``; payment is None when ``tran_id`` is unknown.
+    A gateway failure puts the payment back to pending so a later callback
+    (or ``reconcile_payments``) can retry it.
+    """
+    payment = Payment.objects.filter(transaction_id=tran_id).first()
+    if payment is None:
+        return None, NOT_FOUND
+    if payment.payment_status in ('completed', 'refunded'):
+        return payment, ALREADY_COMPLETED
+
+    claimed = Payment.objects.filter(
+        pk=payment.pk, payment_status__in=('pending', 'failed')
+    ).update(payment_status='processing')
+    if not claimed:
+        # The other callback holds the claim or has already finished
+        payment.refresh_from_db(fields=['payment_status'])
+        outcome = ALREADY_COMPLETED if payment.payment_status in ('completed', 'refunded') else IN_PROGRESS
+        return payment, outcome
+
+    validation = validate(val_id, tran_id)
+    if validation.get('status') == 'FAILED':
+        Payment.objects.filter(pk=payment.pk, payment_status='processing').update(payment_status='pending')
+        logger.warning('Payment %s left pending, validation unavailable: %s', tran_id, validation.get('failedreason'))
+        return payment, UNAVAILABLE
+    if not matches_payment(payment, validation):
+        Payment.objects.filter(pk=payment.pk, payment_status='processing').update(payment_status='failed')
+        logger.warning(
+            'Payment %s rejected: gateway status %s, amount %s',
+            tran_id, validation.get('status'), validation.get('amount'),
+        )
+        payment.payment_status = 'failed'
+        return payment, INVALID
+
+    payment_method = (card_type or validation.get('card_type') or 'sslcommerz')[:20]
+    if not mark_completed(payment, payment_method):
+        return payment, SEAT_LOST
+    return payment, COMPLETED
+
+
+def seat_late_payments(payments):
+    """
+    Give completed ``payments`` that lost their participant a seat again,
+    flagging the ones whose trip has filled up for refund; returns those.
+    Call inside a transaction holding the trips' row locks.
+    """
+    lost = [
+        payment for payment in payments
+        if seats.seat_paid(payment.trip_id, payment.user_id, payment.total_amount) is None
+    ]
+    if lost:
+        Payment.objects.filter(pk__in=[payment.pk for payment in lost]).update(needs_refund=True)
+        for payment in lost:
+            payment.needs_refund = True
+            logger.error('Payment %s completed after trip %s filled up; flagged for refund',
+                         payment.transaction_id, payment.trip_id)
+    return lost
+
+
+def mark_completed(payment, payment_method):
+    """
+    Record a validated payment: the payment, the participant and the trip, under row locks.
+    Returns False when the payer has no seat and none was left to give back.
+    """
+    with transaction.atomic():
+        # Completions for one trip run one at a time, so the paid count below is exact
+        trip = OrganizedTrip.objects.select_for_update().get(pk=payment.trip_id)
+        Payment.objects.filter(pk=payment.pk).update(payment_status='completed', payment_method=payment_method)
+        # A refunded participant gave up their seat; it has to be taken again
+        participant = TripParticipant.objects.select_for_update().filter(
+            trip_id=payment.trip_id, user_id=payment.user_id
+        ).exclude(payment_status='refunded').first()
+        if participant is not None:
+            participant.payment_status = 'paid'
+            participant.amount_paid = payment.total_amount
+            participant.hold_expires_at = None
+            participant.save(update_fields=['payment_status', 'amount_paid', 'hold_expires_at'])
+            seated = True
+        else:
+            # The hold expired and was released before the payment completed
+            seated = not seat_late_payments([payment])
+        _recalculate_trip_status(trip)
+    payment.payment_status = 'completed'
+    payment.payment_method = payment_method
+    return seated
+
+
+def _recalculate_trip_status(trip: OrganizedTrip) -> None:
+    """Recalculate trip status when payment received"""
+    paid_count = TripParticipant.objects.filter(
+        trip=trip,
+        payment_status='paid'
+    ).count()
+
+    if paid_count >= 2 and trip.trip_status in ['open', 'planning']:
+        # Only the status: the seat count in memory may be stale
+        trip.trip_status = 'confirmed'
+        trip.save(update_fields=['trip_status'])
@@ -0,0 +1,334 @@
+"""Local stand-in for the SSLCommerz gateway.
+
+Implements the endpoints ``payments.sslcommerz`` calls: session creation,
+validation, transaction query and refund. It can add latency and random
+server errors, and it can deliver the success and IPN callbacks in any
+order, including at the same moment. Run it with ``manage.py
+run_fake_sslcommerz`` and point ``SSLCOMMERZ_BASE_URL`` at it, or start it
+in-process from tests::
+
+    with FakeSSLCommerz(callback_order='concurrent') as gateway:
+        with override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            ...
+            gateway.pay(tran_id)
+
+Responses follow the shapes of the real sandbox. Transaction queries list
+their matches under ``element``.
+"""
+import html
+import json
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import requests
+
+
+CALLBACK_ORDERS = ('success-first', 'ipn-first', 'concurrent')
+
+SESSION_PATH = '/gwprocess/v4/api.php'
+PAY_PATH = '/gwprocess/v4/pay.php'
+VALIDATION_PATH = '/validator/api/validationserverAPI.php'
+MERCHANT_PATH = '/validator/api/merchantTransIDvalidationAPI.php'
+
+
+class FakeSSLCommerz(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, error_rate=0.0,
+                 callback_order='success-first', callback_delay_ms=0, seed=None):
+        if callback_order not in CALLBACK_ORDERS:
+            raise ValueError(f'callback_order must be one of {CALLBACK_ORDERS}')
+        super().__init__((host, port), FakeSSLCommerzHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.callback_order = callback_order
+        self.callback_delay_ms = callback_delay_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.transactions = {}  # tran_id -> transaction dict
+        self.by_val_id = {}
+        self.by_bank_tran_id = {}
+        self.requests = {}  # path -> request count
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # --- simulated behaviour ---------------------------------------------
+
+    def simulate_latency(self):
+        delay = self.latency_ms + (self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def create_session(self, form):
+        tran_id = form['tran_id']
+        session_key = uuid.uuid4().hex.upper()
+        transaction = {
+            'tran_id': tran_id,
+            'sessionkey': session_key,
+            'amount': form.get('total_amount', '0'),
+            'currency': form.get('currency', 'BDT'),
+            'status': 'PENDING',
+            'val_id': None,
+            'bank_tran_id': None,
+            'card_type': None,
+            'tran_date': None,
+            'refunded': False,
+            'urls': {name: form.get(f'{name}_url', '') for name in ('success', 'fail', 'cancel', 'ipn')},
+        }
+        with self.lock:
+            self.transactions[tran_id] = transaction
+        return transaction
+
+    def settle(self, tran_id, outcome='success'):
+        """Record the customer's outcome at the gateway; returns the callback POST data"""
+        with self.lock:
+            transaction = self.transactions[tran_id]
+            if outcome == 'success':
+                transaction.update(
+                    status='VALID',
+                    val_id=transaction['val_id'] or uuid.uuid4().hex[:16].upper(),
+                    bank_tran_id=transaction['bank_tran_id'] or uuid.uuid4().hex[:12].upper(),
+                    card_type='VISA-Dutch Bangla',
+                    tran_date=time.strftime('%Y-%m-%d %H:%M:%S'),
+                )
+                self.by_val_id[transaction['val_id']] = transaction
+                self.by_bank_tran_id[transaction['bank_tran_id']] = transaction
+            else:
+                transaction['status'] = 'FAILED' if outcome == 'fail' else 'CANCELLED'
+            return _callback_data(transaction)
+
+    def pay(self, tran_id, outcome='success'):
+        """
+        Complete a payment as a customer would and deliver the callbacks in
+        ``callback_order``. Returns ``{'success': status, 'ipn': status}``
+        with the HTTP status each callback got (fail/cancel send no IPN).
+        """
+        data = self.settle(tran_id, outcome)
+        urls = self.transactions[tran_id]['urls']
+        browser_url = urls['success' if outcome == 'success' else outcome]
+        results = {}
+
+        def post(name, url):
+            results[name] = requests.post(url, data=data, allow_redirects=False, timeout=30).status_code
+
+        if outcome != 'success' or not urls['ipn']:
+            post(outcome, browser_url)
+            return results
+
+        delay = self.callback_delay_ms / 1000
+        if self.callback_order == 'concurrent':
+            threads = [threading.Thread(target=post, args=args)
+                       for args in (('success', browser_url), ('ipn', urls['ipn']))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            first, second = (('success', browser_url), ('ipn', urls['ipn']))
+            if self.callback_order == 'ipn-first':
+                first, second = second, first
+            post(*first)
+            time.sleep(delay)
+            post(*second)
+        return results
+
+    def send_ipn_later(self, tran_id, data):
+        """IPN for a browser-driven payment, timed relative to the browser's success POST"""
+        url = self.transactions[tran_id]['urls']['ipn']
+        if not url:
+            return
+
+        def deliver():
+            if self.callback_order == 'success-first':
+                time.sleep(max(self.callback_delay_ms / 1000, 0.5))
+            try:
+                requests.post(url, data=data, allow_redirects=False, timeout=30)
+            except requests.exceptions.RequestException:
+                pass
+
+        if self.callback_order == 'ipn-first':
+            deliver()
+        else:
+            threading.Thread(target=deliver, daemon=True).start()
+
+    def query(self, tran_id):
+        with self.lock:
+            transaction = self.transactions.get(tran_id)
+            if transaction is None:
+                return {'APIConnect': 'DONE', 'no_of_trans_found': 0, 'element': []}
+            return {
+                'APIConnect': 'DONE',
+                'no_of_trans_found': 1,
+                'element': [_element(transaction)],
+            }
+
+    def validate(self, val_id):
+        with self.lock:
+            transaction = self.by_val_id.get(val_id)
+            if transaction is None:
+                return {'status': 'INVALID_TRANSACTION'}
+            return _element(transaction)
+
+    def refund(self, bank_tran_id, refund_amount):
+        with self.lock:
+            transaction = self.by_bank_tran_id.get(bank_tran_id)
+            if transaction is None or transaction['status'] != 'VALID' or transaction['refunded']:
+                return {'APIConnect': 'DONE', 'status': 'failed', 'errorReason': 'Invalid or already refunded transaction'}
+            if Decimal(str(refund_amount)) > Decimal(str(transaction['amount'])):
+                return {'APIConnect': 'DONE', 'status': 'failed', 'errorReason': 'Refund amount exceeds paid amount'}
+            transaction['refunded'] = True
+            return {
+                'APIConnect': 'DONE',
+                'bank_tran_id': bank_tran_id,
+                'trans_id': transaction['tran_id'],
+                'refund_ref_id': uuid.uuid4().hex[:12].upper(),
+                'status': 'success',
+                'errorReason': '',
+            }
+
+
+def _element(transaction):
+    return {
+        'status': transaction['status'],
+        'tran_id': transaction['tran_id'],
+        'val_id': transaction['val_id'],
+        'amount': transaction['amount'],
+        'currency': transaction['currency'],
+        'bank_tran_id': transaction['bank_tran_id'],
+        'card_type': transaction['card_type'],
+        'tran_date': transaction['tran_date'],
+    }
+
+
+def _callback_data(transaction):
+    return {
+        'tran_id': transaction['tran_id'],
+        'val_id': transaction['val_id'] or '',
+        'amount': transaction['amount'],
+        'currency': transaction['currency'],
+        'card_type': transaction['card_type'] or '',
+        'bank_tran_id': transaction['bank_tran_id'] or '',
+        'status': transaction['status'],
+        'tran_date': transaction['tran_date'] or '',
+    }
+
+
+class FakeSSLCommerzHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeSSLCommerz/1.0'
+
+    def log_message(self, format, *args):
+        pass  # Keep test and benchmark output clean
+
+    def _json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _html(self, markup):
+        body = markup.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self):
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        if self.command == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            form = parse_qs(self.rfile.read(length).decode())
+            params.update({key: values[-1] for key, values in form.items()})
+        return parsed.path, params
+
+    def _handle(self):
+        gateway = self.server
+        path, params = self._params()
+        gateway.count(path)
+        gateway.simulate_latency()
+
+        if path != PAY_PATH and gateway.should_fail():
+            self._json({'status': 'FAILED', 'failedreason': 'Simulated gateway error'}, status=500)
+            return
+
+        if path == SESSION_PATH and self.command == 'POST':
+            transaction = gateway.create_session(params)
+            self._json({
+                'status': 'SUCCESS',
+                'sessionkey': transaction['sessionkey'],
+                'GatewayPageURL': f"{gateway.base_url}{PAY_PATH}?{urlencode({'tran_id': transaction['tran_id']})}",
+            })
+        elif path == PAY_PATH:
+            self._pay_page(gateway, params)
+        elif path == VALIDATION_PATH:
+            self._json(gateway.validate(params.get('val_id', '')))
+        elif path == MERCHANT_PATH and 'bank_tran_id' in params:
+            self._json(gateway.refund(params['bank_tran_id'], params.get('refund_amount', '0')))
+        elif path == MERCHANT_PATH:
+            self._json(gateway.query(params.get('tran_id', '')))
+        else:
+            self._json({'status': 'FAILED', 'failedreason': 'Unknown endpoint'}, status=404)
+
+    def _pay_page(self, gateway, params):
+        """The hosted payment page: settles the payment and posts the browser back to the shop"""
+        tran_id = params.get('tran_id', '')
+        if tran_id not in gateway.transactions:
+            self._json({'status': 'FAILED', 'failedreason': 'Unknown transaction'}, status=404)
+            return
+        outcome = params.get('outcome', 'success')
+        if outcome not in ('success', 'fail', 'cancel'):
+            self._json({'status': 'FAILED', 'failedreason': 'Unknown outcome'}, status=400)
+            return
+        data = gateway.settle(tran_id, outcome)
+        if outcome == 'success':
+            gateway.send_ipn_later(tran_id, data)
+
+        target = gateway.transactions[tran_id]['urls'][outcome]
+        fields = ''.join(
+            f'<input type="hidden" name="{html.escape(key)}" value="{html.escape(str(value))}">'
+            for key, value in data.items()
+        )
+        self._html(
+            f'<!DOCTYPE html><html><body onload="document.forms[0].submit()">'
+            f'<form method="POST" action="{html.escape(target)}">{fields}'
+            f'<noscript><button type="submit">Continue</button></noscript></form></body></html>'
+        )
+
+    do_GET = _handle
+    do_POST = _handle
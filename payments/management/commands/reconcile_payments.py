@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payments import reconcile
+
+
+class Command(BaseCommand):
+    help = "Query SSLCommerz for stale pending/processing payments and apply the results in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=int(reconcile.STALE_AFTER.total_seconds() // 60),
+                            help='Minutes since payment start before it counts as stale (default: 30)')
+        parser.add_argument('--limit', type=int, default=reconcile.BATCH_LIMIT,
+                            help=f'Payments per run (default: {reconcile.BATCH_LIMIT})')
+        parser.add_argument('--workers', type=int, default=reconcile.WORKERS,
+                            help=f'Concurrent gateway queries (default: {reconcile.WORKERS})')
+
+    def handle(self, *args, **options):
+        report = reconcile.reconcile(
+            older_than=timedelta(minutes=options['older_than']),
+            limit=options['limit'],
+            workers=options['workers'],
+        )
+
+        checked = report['checked']
+        if not checked:
+            self.stdout.write(self.style.SUCCESS('✓ No stale payments'))
+            return
+
+        outcomes = report['outcomes']
+        fixed = report['completed'] + report['failed']
+        throughput = checked / report['query_seconds'] if report['query_seconds'] else 0
+        self.stdout.write(
+            f"Checked {checked} payment(s) in {report['total_seconds']:.2f}s "
+            f"({throughput:.1f} gateway queries/s with {options['workers']} workers)"
+        )
+        self.stdout.write(
+            f"Gateway: {outcomes['paid']} paid, {outcomes['failed']} unpaid, "
+            f"{outcomes['pending']} still pending, {outcomes['error']} errors"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Fixed {fixed}/{checked} ({fixed / checked:.0%}): {report['completed']} completed, "
+            f"{report['failed']} failed, {report['confirmed_trips']} trip(s) confirmed"
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from payments.fake_gateway import CALLBACK_ORDERS, FakeSSLCommerz
+
+
+class Command(BaseCommand):
+    help = "Run a local SSLCommerz stand-in for payment load tests (set SSLCOMMERZ_BASE_URL to its address)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8600)
+        parser.add_argument('--latency-ms', type=float, default=0,
+                            help='Delay added to every gateway response (default: 0)')
+        parser.add_argument('--jitter-ms', type=float, default=0,
+                            help='Random +/- variation on the latency (default: 0)')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Fraction of API calls answered with HTTP 500 (default: 0)')
+        parser.add_argument('--callback-order', choices=CALLBACK_ORDERS, default='success-first',
+                            help='Order of the browser success POST and the IPN (default: success-first)')
+        parser.add_argument('--callback-delay-ms', type=float, default=0,
+                            help='Gap between the two callbacks (default: 0)')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible error injection')
+
+    def handle(self, *args, **options):
+        gateway = FakeSSLCommerz(
+            host=options['host'],
+            port=options['port'],
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            error_rate=options['error_rate'],
+            callback_order=options['callback_order'],
+            callback_delay_ms=options['callback_delay_ms'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'✓ Fake SSLCommerz listening on {gateway.base_url}'))
+        self.stdout.write(f'  Start the site with SSLCOMMERZ_BASE_URL={gateway.base_url}')
+        try:
+            gateway.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.server_close()
+
+        total = sum(gateway.requests.values())
+        self.stdout.write(f'Served {total} request(s) for {len(gateway.transactions)} transaction(s)')
@@ -0,0 +1,173 @@
+"""Reconciliation of payments whose callbacks never arrived.
+
+A payment stays pending when the customer abandons the gateway page or
+both callbacks are lost, and stays processing when the process that
+claimed it dies mid-completion. ``reconcile`` asks the gateway about every
+such payment older than a cutoff, through a bounded thread pool (the
+workers only do HTTP; the database is touched from the calling thread).
+It then applies the answers in bulk: paid payments are completed together
+with their participants and trips, and abandoned ones are failed. Paid
+payments whose participant's hold was released meanwhile are reseated or
+flagged for refund, as in ``completion``.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from trips.models import LifecycleDeadline, OrganizedTrip, Payment, TripParticipant
+from .completion import matches_payment, seat_late_payments
+from .sslcommerz import SSLCommerzPayment, valid_element
+
+
+logger = logging.getLogger(__name__)
+
+STALE_AFTER = timedelta(minutes=30)
+BATCH_LIMIT = 500
+WORKERS = 8  # Stays below the sslcommerz connection pool size
+
+OPEN_STATUSES = ('pending', 'processing')
+GATEWAY_FAILED = ('FAILED', 'CANCELLED', 'UNATTEMPTED', 'EXPIRED')
+
+
+def stale_payments(now, older_than=STALE_AFTER, limit=BATCH_LIMIT):
+    return list(
+        Payment.objects.filter(
+            payment_status__in=OPEN_STATUSES,
+            payment_date__lt=now - older_than,
+            transaction_id__isnull=False,
+        ).order_by('payment_date')[:limit]
+    )
+
+
+def classify(payment, response):
+    """Map a ``query_transaction`` response to ``'paid'``, ``'failed'``, ``'pending'`` or ``'error'``"""
+    if response.get('APIConnect') != 'DONE':
+        return 'error'  # Gateway or network failure; try again next run
+    paid = valid_element(response)
+    if paid is not None:
+        if matches_payment(payment, paid):
+            return 'paid'
+        logger.error('Payment %s paid at the gateway with a different amount: %s', payment.transaction_id, paid)
+        return 'failed'
+    elements = response.get('element') or []
+    if not elements or all(element.get('status') in GATEWAY_FAILED for element in elements):
+        return 'failed'  # Never paid: abandoned before or on the gateway page
+    return 'pending'
+
+
+def query_all(payments, workers=WORKERS):
+    """Query the gateway for each payment in parallel; returns ``{payment_id: response}``"""
+    client = SSLCommerzPayment()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile') as executor:
+        responses = executor.map(lambda payment: client.query_transaction(payment.transaction_id), payments)
+        return {payment.pk: response for payment, response in zip(payments, responses)}
+
+
+def apply(paid, failed):
+    """
+    Complete ``paid`` (``(payment, card_type)`` pairs) and fail ``failed``
+    payments in bulk. Only rows still pending or processing are changed, so a
+    callback that won meanwhile is left alone. Returns ``(completed, failed, confirmed_trips)``.
+    """
+    with transaction.atomic():
+        locked = {
+            payment.pk: payment
+            for payment in Payment.objects.select_for_update().filter(
+                pk__in=[payment.pk for payment, _ in paid], payment_status__in=OPEN_STATUSES
+            )
+        }
+        completed = []
+        for payment, card_type in paid:
+            if payment.pk in locked:
+                payment.payment_status = 'completed'
+                payment.payment_method = (card_type or 'sslcommerz')[:20]
+                completed.append(payment)
+        Payment.objects.bulk_update(completed, ['payment_status', 'payment_method'])
+
+        paid_by = {(payment.trip_id, payment.user_id): payment for payment in completed}
+        participants = [
+            participant
+            for participant in TripParticipant.objects.select_for_update().filter(
+                trip_id__in={trip_id for trip_id, _ in paid_by}, user_id__in={user_id for _, user_id in paid_by}
+            ).exclude(payment_status='refunded')
+            if (participant.trip_id, participant.user_id) in paid_by
+        ]
+        for participant in participants:
+            participant.payment_status = 'paid'
+            participant.amount_paid = paid_by[(participant.trip_id, participant.user_id)].total_amount
+            participant.hold_expires_at = None
+        TripParticipant.objects.bulk_update(participants, ['payment_status', 'amount_paid', 'hold_expires_at'])
+
+        seated = {(participant.trip_id, participant.user_id) for participant in participants}
+        unseated = [payment for key, payment in paid_by.items() if key not in seated]
+        if unseated:
+            # Lock the trips first, as mark_completed does, so reseating can't race a join
+            list(OrganizedTrip.objects.select_for_update().filter(pk__in={p.trip_id for p in unseated}))
+            seat_late_payments(unseated)
+
+        confirmed_trips = _confirm_trips({trip_id for trip_id, _ in paid_by})
+
+        failed_count = Payment.objects.filter(
+            pk__in=[payment.pk for payment in failed], payment_status__in=OPEN_STATUSES
+        ).update(payment_status='failed')
+
+    return len(completed), failed_count, confirmed_trips
+
+
+def _confirm_trips(trip_ids):
+    """Confirm open/planning trips that now have at least two paid participants"""
+    trips = list(
+        OrganizedTrip.objects.select_for_update()
+        .filter(pk__in=trip_ids, trip_status__in=['open', 'planning'])
+        .annotate(paid_count=Count('participants', filter=Q(participants__payment_status='paid')))
+        .filter(paid_count__gte=2)
+    )
+    if not trips:
+        return 0
+    OrganizedTrip.objects.filter(pk__in=[trip.pk for trip in trips]).update(trip_status='confirmed')
+    # The bulk update skips post_save, so hand the new deadlines to the scheduler here
+    LifecycleDeadline.record_upcoming(
+        [('departure', trip.trip_id, trip.departure_time) for trip in trips]
+        + [('return', trip.trip_id, trip.return_time) for trip in trips]
+    )
+    return len(trips)
+
+
+def reconcile(older_than=STALE_AFTER, limit=BATCH_LIMIT, workers=WORKERS):
+    """Reconcile one batch of stale payments; returns a summary of what was checked and fixed"""
+    started = time.perf_counter()
+    payments = stale_payments(timezone.now(), older_than, limit)
+    responses = query_all(payments, workers) if payments else {}
+    queried_at = time.perf_counter()
+
+    paid, failed, released = [], [], []
+    outcomes = {'paid': 0, 'failed': 0, 'pending': 0, 'error': 0}
+    for payment in payments:
+        response = responses[payment.pk]
+        outcome = classify(payment, response)
+        outcomes[outcome] += 1
+        if outcome == 'paid':
+            paid.append((payment, valid_element(response).get('card_type')))
+        elif outcome == 'failed':
+            failed.append(payment)
+        elif outcome == 'pending' and payment.payment_status == 'processing':
+            released.append(payment.pk)
+
+    completed, failed_count, confirmed_trips = apply(paid, failed) if paid or failed else (0, 0, 0)
+    # A claim abandoned mid-completion; let the next callback claim it again
+    Payment.objects.filter(pk__in=released, payment_status='processing').update(payment_status='pending')
+    finished = time.perf_counter()
+    return {
+        'checked': len(payments),
+        'outcomes': outcomes,
+        'completed': completed,
+        'failed': failed_count,
+        'confirmed_trips': confirmed_trips,
+        'query_seconds': queried_at - started,
+        'total_seconds': finished - started,
+    }
@@ -1,11 +1,174 @@
+"""SSLCommerz payment gateway client.
+
+All calls share one pooled keep-alive ``requests.Session``. Each endpoint
+has its own (connect, read) timeout, and read-only queries (validation,
+transaction lookup) are retried a bounded number of times. A circuit
+breaker fails calls fast while the gateway is degraded, and every call is
+timed into a per-endpoint latency histogram (see ``metrics_snapshot``).
+"""
+import bisect
+import logging
+import threading
+import time
 
 import requests
-import hashlib
+from requests.adapters import HTTPAdapter
 from decimal import Decimal
 from typing import Dict, Optional
 from django.conf import settings
 
 
+logger = logging.getLogger(__name__)
+
+# (connect, read) seconds per endpoint
+DEFAULT_TIMEOUTS = {
+    'create_session': (3.05, 10),
+    'validate_transaction': (3.05, 8),
+    'query_transaction': (3.05, 8),
+    'initiate_refund': (3.05, 15),
+}
+
+# Only idempotent lookups are retried; session creation and refunds are not
+RETRIES = {
+    'validate_transaction': 2,
+    'query_transaction': 2,
+}
+RETRY_BACKOFF = 0.25
+RETRY_STATUSES = {502, 503, 504}
+
+POOL_SIZE = 20
+
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_session = _build_session()
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and rejects calls
+    for ``reset_timeout`` seconds; then lets one trial call through (half-open)."""
+
+    TRIAL = 'trial'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return 'closed'
+        if now - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """False to reject the call; ``TRIAL`` (truthy) when it is the half-open trial"""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return self.TRIAL
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Let another trial through; for a trial that ended without a recorded outcome"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning('SSLCommerz circuit opened after %s consecutive failures', self._failures)
+                self._opened_at = time.monotonic()
+
+
+class LatencyHistogram:
+    """Non-cumulative bucket counts of call durations in milliseconds"""
+
+    BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def observe(self, elapsed_ms, ok=True):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BUCKETS_MS, elapsed_ms)] += 1
+            self.total_ms += elapsed_ms
+            self.calls += 1
+            if not ok:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f'<={bound}ms' for bound in self.BUCKETS_MS] + [f'>{self.BUCKETS_MS[-1]}ms']
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'mean_ms': round(self.total_ms / self.calls, 1) if self.calls else None,
+                'buckets': dict(zip(labels, self.counts)),
+            }
+
+
+breaker = CircuitBreaker(
+    failure_threshold=getattr(settings, 'SSLCOMMERZ_BREAKER_THRESHOLD', 5),
+    reset_timeout=getattr(settings, 'SSLCOMMERZ_BREAKER_RESET', 30),
+)
+histograms = {endpoint: LatencyHistogram() for endpoint in DEFAULT_TIMEOUTS}
+
+
+def metrics_snapshot():
+    """Per-endpoint latency histograms plus the circuit breaker state for this process"""
+    return {
+        'circuit': breaker.state,
+        'endpoints': {endpoint: histogram.snapshot() for endpoint, histogram in histograms.items()},
+    }
+
+
+class GatewayUnavailable(requests.exceptions.RequestException):
+    """Raised instead of calling the gateway while the circuit is open"""
+
+
+def valid_element(query_response: Dict) -> Optional[Dict]:
+    """The VALID transaction from a ``query_transaction`` response; matches are listed under ``element``"""
+    for element in query_response.get('element') or []:
+        if element.get('status') in ('VALID', 'VALIDATED'):
+            return element
+    return None
+
+
 class SSLCommerzPayment:
     """SSLCommerz payment gateway handler"""
     
@@ -14,11 +177,65 @@ class SSLCommerzPayment:
         self.store_password = getattr(settings, 'SSLCOMMERZ_STORE_PASSWORD', '')
         self.is_sandbox = getattr(settings, 'SSLCOMMERZ_IS_SANDBOX', True)
         
-        # API endpoints
-        if self.is_sandbox:
+        # API endpoints; SSLCOMMERZ_BASE_URL points the client at a stand-in (see fake_gateway)
+        if getattr(settings, 'SSLCOMMERZ_BASE_URL', ''):
+            self.base_url = settings.SSLCOMMERZ_BASE_URL.rstrip('/')
+        elif self.is_sandbox:
             self.base_url = "https://sandbox.sslcommerz.com"
         else:
             self.base_url = "https://securepay.sslcommerz.com"
+
+        self.timeouts = {**DEFAULT_TIMEOUTS, **getattr(settings, 'SSLCOMMERZ_TIMEOUTS', {})}
+
+    def _call(self, endpoint: str, method: str, url: str, **kwargs) -> Dict:
+        """
+        Call the gateway through the shared session and breaker, timing the call.
+        Raises ``requests.exceptions.RequestException`` on failure.
+        """
+        admitted = breaker.allow()
+        if not admitted:
+            histograms[endpoint].observe(0, ok=False)
+            raise GatewayUnavailable('Payment gateway temporarily unavailable, please try again shortly')
+
+        attempts = RETRIES.get(endpoint, 0) + 1
+        started = time.perf_counter()
+        try:
+            for attempt in range(attempts):
+                try:
+                    response = _session.request(method, url, timeout=self.timeouts[endpoint], **kwargs)
+                    if response.status_code in RETRY_STATUSES and attempt + 1 < attempts:
+                        time.sleep(RETRY_BACKOFF * (2 ** attempt))
+                        continue
+                    response.raise_for_status()
+                    result = response.json()
+                    break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if attempt + 1 >= attempts:
+                        raise
+                    time.sleep(RETRY_BACKOFF * (2 ** attempt))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            histograms[endpoint].observe(elapsed_ms, ok=False)
+            # A 4xx means the gateway answered; only timeouts, connection and server errors trip the breaker
+            response = getattr(e, 'response', None)
+            if response is not None and response.status_code < 500:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            logger.warning('SSLCommerz %s failed after %.0f ms: %s', endpoint, elapsed_ms, e)
+            if isinstance(e, ValueError):
+                raise requests.exceptions.RequestException(f'Invalid gateway response: {e}')
+            raise
+        except BaseException:
+            # No outcome to record; as the trial, it would otherwise leave the breaker half-open forever
+            if admitted == CircuitBreaker.TRIAL:
+                breaker.release_trial()
+            raise
+        else:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            histograms[endpoint].observe(elapsed_ms)
+            breaker.record_success()
+            return result
     
     def create_session(self, payment_data: Dict) -> Dict:
         """
@@ -75,9 +292,7 @@ class SSLCommerzPayment:
         }
         
         try:
-            response = requests.post(url, data=payload, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._call('create_session', 'POST', url, data=payload)
         except requests.exceptions.RequestException as e:
             return {
                 'status': 'FAILED',
@@ -102,9 +317,7 @@ class SSLCommerzPayment:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._call('validate_transaction', 'GET', url, params=params)
         except requests.exceptions.RequestException as e:
             return {
                 'status': 'FAILED',
@@ -132,9 +345,7 @@ class SSLCommerzPayment:
         }
         
         try:
-            response = requests.get(url, params=payload, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._call('initiate_refund', 'GET', url, params=payload)
         except requests.exceptions.RequestException as e:
             return {
                 'status': 'FAILED',
@@ -158,9 +369,7 @@ class SSLCommerzPayment:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._call('query_transaction', 'GET', url, params=params)
         except requests.exceptions.RequestException as e:
             return {
                 'status': 'FAILED',
@@ -1,3 +1,405 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from trips.models import OrganizedTrip, Payment, TripParticipant
+from . import completion, reconcile, sslcommerz
+from .fake_gateway import VALIDATION_PATH, FakeSSLCommerz
+from .sslcommerz import SSLCommerzPayment, valid_element
+
+
+def _session_data(tran_id):
+    return {
+        'total_amount': Decimal('1500.00'),
+        'tran_id': tran_id,
+        'success_url': 'http://shop.test/success/',
+        'fail_url': 'http://shop.test/fail/',
+        'cancel_url': 'http://shop.test/cancel/',
+        'cus_name': 'Test User',
+        'cus_email': 'test@example.com',
+        'cus_phone': '01700000000',
+        'product_name': 'Trip',
+        'product_category': 'Travel',
+    }
+
+
+class FakeGatewayTests(SimpleTestCase):
+
+    def setUp(self):
+        sslcommerz.breaker.record_success()
+
+    def test_session_validation_query_and_refund_round_trip(self):
+        with FakeSSLCommerz() as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            client = SSLCommerzPayment()
+            session = client.create_session(_session_data('TXN-1'))
+            self.assertEqual(session['status'], 'SUCCESS')
+            self.assertTrue(session['GatewayPageURL'].startswith(gateway.base_url))
+
+            self.assertIsNone(valid_element(client.query_transaction('TXN-1')))
+            callback = gateway.settle('TXN-1')
+
+            validation = client.validate_transaction(callback['val_id'], 'TXN-1')
+            self.assertEqual((validation['status'], validation['tran_id']), ('VALID', 'TXN-1'))
+            paid = valid_element(client.query_transaction('TXN-1'))
+            self.assertEqual(paid['bank_tran_id'], callback['bank_tran_id'])
+
+            refund = client.initiate_refund(paid['bank_tran_id'], Decimal('1500.00'))
+            self.assertEqual(refund['status'], 'success')
+            # A second refund of the same transaction is refused
+            self.assertEqual(client.initiate_refund(paid['bank_tran_id'], Decimal('1500.00'))['status'], 'failed')
+
+    def test_unknown_val_id_is_invalid(self):
+        with FakeSSLCommerz() as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            self.assertEqual(SSLCommerzPayment().validate_transaction('NOPE', 'TXN-1')['status'], 'INVALID_TRANSACTION')
+
+    def test_injected_errors_are_reported_as_failures(self):
+        with FakeSSLCommerz(error_rate=1.0) as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            session = SSLCommerzPayment().create_session(_session_data('TXN-2'))
+
+        self.assertEqual(session['status'], 'FAILED')
+        self.assertEqual(gateway.requests['/gwprocess/v4/api.php'], 1)  # Session creation is never retried
+        sslcommerz.breaker.record_success()
+
+
+def _response(status, body):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body).encode()
+    return response
+
+
+class GatewayClientTests(SimpleTestCase):
+    """Session reuse, retries, the circuit breaker and latency metrics, without a gateway"""
+
+    def setUp(self):
+        self.breaker = sslcommerz.CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        self.histograms = {endpoint: sslcommerz.LatencyHistogram() for endpoint in sslcommerz.DEFAULT_TIMEOUTS}
+        self.now = 1000.0
+        for patcher in (
+            mock.patch.object(sslcommerz, 'breaker', self.breaker),
+            mock.patch.object(sslcommerz, 'histograms', self.histograms),
+            mock.patch.object(sslcommerz, 'RETRY_BACKOFF', 0),
+            mock.patch.object(sslcommerz.time, 'monotonic', lambda: self.now),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _gateway(self, *responses):
+        return mock.patch.object(sslcommerz._session, 'request', side_effect=responses)
+
+    def test_every_client_uses_the_shared_pooled_session(self):
+        adapter = sslcommerz._session.get_adapter('https://sandbox.sslcommerz.com')
+        self.assertEqual(adapter._pool_maxsize, sslcommerz.POOL_SIZE)
+
+        with self._gateway(_response(200, {'status': 'VALID'}), _response(200, {'status': 'VALID'})) as request:
+            SSLCommerzPayment().validate_transaction('VAL-1', 'TXN-1')
+            SSLCommerzPayment().query_transaction('TXN-1')
+
+        self.assertEqual(
+            [call.kwargs['timeout'] for call in request.call_args_list],
+            [sslcommerz.DEFAULT_TIMEOUTS['validate_transaction'], sslcommerz.DEFAULT_TIMEOUTS['query_transaction']],
+        )
+
+    def test_lookups_are_retried_on_connection_and_gateway_errors(self):
+        with self._gateway(
+            requests.exceptions.ConnectionError('reset'), _response(503, {}), _response(200, {'status': 'VALID'}),
+        ) as request:
+            result = SSLCommerzPayment().validate_transaction('VAL-1', 'TXN-1')
+
+        self.assertEqual(result['status'], 'VALID')
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_session_creation_is_never_retried(self):
+        with self._gateway(requests.exceptions.Timeout('slow'), _response(200, {})) as request, \
+                self.assertLogs('payments.sslcommerz', 'WARNING'):
+            result = SSLCommerzPayment().create_session(_session_data('TXN-1'))
+
+        self.assertEqual(result['status'], 'FAILED')
+        self.assertEqual(request.call_count, 1)
+
+    def test_breaker_fails_fast_while_open_then_lets_one_trial_through(self):
+        client = SSLCommerzPayment()
+        with self._gateway(_response(500, {}), _response(500, {})), self.assertLogs('payments.sslcommerz', 'WARNING'):
+            client.create_session(_session_data('TXN-1'))
+            client.create_session(_session_data('TXN-2'))
+        self.assertEqual(self.breaker.state, 'open')
+
+        with self._gateway() as request:
+            self.assertEqual(client.create_session(_session_data('TXN-3'))['status'], 'FAILED')
+        request.assert_not_called()
+
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())  # Only one trial at a time
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_trial_ending_in_an_unexpected_error_does_not_wedge_the_breaker(self):
+        with self.assertLogs('payments.sslcommerz', 'WARNING'):
+            for _ in range(2):
+                self.breaker.record_failure()
+        self.now += 30
+
+        with self._gateway(RuntimeError('bug')), self.assertRaises(RuntimeError):
+            SSLCommerzPayment().query_transaction('TXN-1')
+
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertEqual(self.breaker.allow(), sslcommerz.CircuitBreaker.TRIAL)
+
+    def test_straggler_from_before_the_circuit_opened_leaves_the_trial_alone(self):
+        def open_circuit_then_fail(*args, **kwargs):
+            # While this call hangs, the circuit opens and another call becomes the trial
+            with self.assertLogs('payments.sslcommerz', 'WARNING'):
+                for _ in range(2):
+                    self.breaker.record_failure()
+            self.now += 30
+            self.assertEqual(self.breaker.allow(), sslcommerz.CircuitBreaker.TRIAL)
+            raise RuntimeError('bug')
+
+        with mock.patch.object(sslcommerz._session, 'request', side_effect=open_circuit_then_fail), \
+                self.assertRaises(RuntimeError):
+            SSLCommerzPayment().query_transaction('TXN-1')
+
+        self.assertFalse(self.breaker.allow())  # The trial is still in flight
+
+    def test_calls_are_timed_into_their_endpoint_histogram(self):
+        with self._gateway(_response(200, {'status': 'VALID'}), _response(500, {})), \
+                self.assertLogs('payments.sslcommerz', 'WARNING'):
+            SSLCommerzPayment().query_transaction('TXN-1')
+            SSLCommerzPayment().query_transaction('TXN-2')
+
+        snapshot = sslcommerz.metrics_snapshot()
+        self.assertEqual(snapshot['circuit'], 'closed')
+        query = snapshot['endpoints']['query_transaction']
+        self.assertEqual((query['calls'], query['errors'], sum(query['buckets'].values())), (2, 1, 2))
+        self.assertEqual(snapshot['endpoints']['create_session']['calls'], 0)
+
+    def test_histogram_buckets_are_bounded_above(self):
+        histogram = sslcommerz.LatencyHistogram()
+        for elapsed_ms in (10, 25, 26, 20000):
+            histogram.observe(elapsed_ms)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(
+            (snapshot['buckets']['<=25ms'], snapshot['buckets']['<=50ms'], snapshot['buckets']['>10000ms']), (2, 1, 1),
+        )
+        self.assertEqual(snapshot['mean_ms'], round((10 + 25 + 26 + 20000) / 4, 1))
+
+
+def _trip(amount=Decimal('1500.00')):
+    return OrganizedTrip.objects.create(
+        trip_name='Sylhet', base_cost=amount, platform_commission=0, final_cost_per_person=amount,
+        transportation_details='Bus', accommodation_details='Hotel', meal_arrangements='Included',
+        profit_margin=0, departure_time=timezone.now() + timedelta(days=7),
+        return_time=timezone.now() + timedelta(days=9), destination='Sylhet',
+    )
+
+
+def _trip_with_pending_payment(username, tran_id, amount=Decimal('1500.00'), trip=None):
+    user = User.objects.create_user(username, password='x')
+    trip = trip or _trip(amount)
+    TripParticipant.objects.create(trip=trip, user=user)
+    return Payment.objects.create(
+        trip=trip, user=user, total_amount=amount, platform_commission=0,
+        payment_method='sslcommerz', transaction_id=tran_id,
+    )
+
+
+class PaymentCallbackTests(LiveServerTestCase):
+    """Success redirect and IPN delivered by the fake gateway to a live server"""
+
+    def setUp(self):
+        sslcommerz.breaker.record_success()
+
+    def _open_session(self, gateway, payment):
+        data = _session_data(payment.transaction_id)
+        data.update(
+            total_amount=payment.total_amount,
+            success_url=self.live_server_url + reverse('payment_success'),
+            ipn_url=self.live_server_url + reverse('payment_ipn'),
+        )
+        with override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            self.assertEqual(SSLCommerzPayment().create_session(data)['status'], 'SUCCESS')
+
+    def test_both_callbacks_complete_once_with_one_validation(self):
+        for order in ('success-first', 'ipn-first'):
+            with self.subTest(order=order), FakeSSLCommerz(callback_order=order) as gateway:
+                payment = _trip_with_pending_payment(f'payer-{order}', f'TXN-{order}')
+                self._open_session(gateway, payment)
+
+                with override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+                    results = gateway.pay(payment.transaction_id)
+
+                self.assertEqual(results, {'success': 302, 'ipn': 200})
+                self.assertEqual(gateway.requests[VALIDATION_PATH], 1)
+                payment.refresh_from_db()
+                self.assertEqual(payment.payment_status, 'completed')
+                participant = TripParticipant.objects.get(trip=payment.trip, user=payment.user)
+                self.assertEqual((participant.payment_status, participant.amount_paid), ('paid', payment.total_amount))
+
+
+class CompletePaymentTests(TestCase):
+
+    def setUp(self):
+        sslcommerz.breaker.record_success()
+
+    def test_claimed_payment_is_left_to_the_other_callback(self):
+        payment = _trip_with_pending_payment('payer', 'TXN-CLAIMED')
+        Payment.objects.filter(pk=payment.pk).update(payment_status='processing')
+
+        with FakeSSLCommerz() as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            _, outcome = completion.complete_payment('TXN-CLAIMED', 'VAL-1')
+
+        self.assertEqual(outcome, completion.IN_PROGRESS)
+        self.assertEqual(gateway.requests, {})
+
+    def test_amount_mismatch_fails_the_payment(self):
+        payment = _trip_with_pending_payment('payer', 'TXN-SHORT')
+        with FakeSSLCommerz() as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            gateway.create_session({'tran_id': 'TXN-SHORT', 'total_amount': '10.00'})
+            callback = gateway.settle('TXN-SHORT')
+            _, outcome = completion.complete_payment('TXN-SHORT', callback['val_id'])
+
+        payment.refresh_from_db()
+        self.assertEqual((outcome, payment.payment_status), (completion.INVALID, 'failed'))
+
+    def test_unreachable_gateway_leaves_payment_pending(self):
+        payment = _trip_with_pending_payment('payer', 'TXN-DOWN')
+        with FakeSSLCommerz(error_rate=1.0) as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            _, outcome = completion.complete_payment('TXN-DOWN', 'VAL-DOWN')
+        sslcommerz.breaker.record_success()
+
+        payment.refresh_from_db()
+        self.assertEqual((outcome, payment.payment_status), (completion.UNAVAILABLE, 'pending'))
+
+
+class RefundTests(TestCase):
+
+    def setUp(self):
+        sslcommerz.breaker.record_success()
+        self.user = User.objects.create_user('refunder', is_staff=True)
+        self.trip = _trip()
+        self.participant = TripParticipant.objects.create(
+            trip=self.trip, user=self.user, payment_status='paid', amount_paid=Decimal('1500.00'),
+        )
+        OrganizedTrip.objects.filter(pk=self.trip.pk).update(total_participants=1)
+        self.payment = Payment.objects.create(
+            trip=self.trip, user=self.user, total_amount=Decimal('1500.00'), platform_commission=0,
+            payment_method='visa', payment_status='completed', transaction_id='TXN-REFUND',
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('trip_cancel_payment', args=[self.trip.pk])
+
+    def _paid_gateway(self):
+        gateway = FakeSSLCommerz()
+        gateway.create_session({'tran_id': 'TXN-REFUND', 'total_amount': '1500.00'})
+        gateway.settle('TXN-REFUND')
+        return gateway
+
+    def test_refund_removes_the_participant_and_frees_the_seat_once(self):
+        with self._paid_gateway() as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            self.client.post(self.url)
+            self.client.post(self.url)
+
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.payment.refund_status), ('refunded', True))
+        self.assertFalse(TripParticipant.objects.filter(pk=self.participant.pk).exists())
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.total_participants, 0)
+
+    def test_concurrent_refund_requests_refund_and_free_the_seat_once(self):
+        OrganizedTrip.objects.filter(pk=self.trip.pk).update(total_participants=2)  # Another traveller's seat
+        refunds = []
+
+        def refund(**kwargs):
+            refunds.append(kwargs)
+            if len(refunds) == 1:
+                self.client.post(self.url)  # The second request arrives while the gateway is busy
+            return {'status': 'success'}
+
+        paid = {'APIConnect': 'DONE', 'element': [{'status': 'VALID', 'bank_tran_id': 'BANK-1'}]}
+        with mock.patch.object(SSLCommerzPayment, 'query_transaction', return_value=paid), \
+                mock.patch.object(SSLCommerzPayment, 'initiate_refund', side_effect=refund):
+            self.client.post(self.url)
+
+        self.assertEqual(len(refunds), 1)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.total_participants, 1)
+
+    def test_failed_refund_releases_the_claim(self):
+        with mock.patch.object(SSLCommerzPayment, 'query_transaction', return_value={'APIConnect': 'DONE'}):
+            self.client.post(self.url)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, 'completed')
+        self.assertTrue(TripParticipant.objects.filter(pk=self.participant.pk).exists())
+
+    def test_refunded_participant_cannot_pay_without_a_seat(self):
+        TripParticipant.objects.filter(pk=self.participant.pk).update(payment_status='refunded')
+
+        response = self.client.post(reverse('trip_payment', args=[self.trip.pk]))
+
+        self.assertRedirects(
+            response, reverse('organized_trip_detail', args=[self.trip.pk]), fetch_redirect_response=False
+        )
+        self.assertEqual(Payment.objects.count(), 1)
+
+
+class ReconcileTests(TestCase):
+
+    def setUp(self):
+        sslcommerz.breaker.record_success()
+
+    def test_stale_payments_are_settled_from_the_gateway(self):
+        trip = _trip()
+        payments = {
+            name: _trip_with_pending_payment(name, f'TXN-{name}', trip=trip)
+            for name in ('paid1', 'paid2', 'cancelled', 'unpaid', 'unknown', 'fresh')
+        }
+        Payment.objects.exclude(pk=payments['fresh'].pk).update(payment_date=timezone.now() - timedelta(hours=1))
+        Payment.objects.filter(pk=payments['paid2'].pk).update(payment_status='processing')  # Abandoned claim
+
+        with FakeSSLCommerz(latency_ms=20) as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            for name in ('paid1', 'paid2', 'cancelled', 'unpaid', 'fresh'):
+                gateway.create_session({'tran_id': f'TXN-{name}', 'total_amount': '1500.00'})
+            gateway.settle('TXN-paid1')
+            gateway.settle('TXN-paid2')
+            gateway.settle('TXN-cancelled', 'cancel')
+
+            report = reconcile.reconcile(workers=4)
+
+        self.assertEqual(report['checked'], 5)
+        self.assertEqual(report['outcomes'], {'paid': 2, 'failed': 2, 'pending': 1, 'error': 0})
+        self.assertEqual((report['completed'], report['failed'], report['confirmed_trips']), (2, 2, 1))
+
+        statuses = dict(Payment.objects.values_list('transaction_id', 'payment_status'))
+        self.assertEqual(statuses, {
+            'TXN-paid1': 'completed', 'TXN-paid2': 'completed', 'TXN-cancelled': 'failed',
+            'TXN-unpaid': 'pending', 'TXN-unknown': 'failed', 'TXN-fresh': 'pending',
+        })
+        self.assertEqual(
+            set(TripParticipant.objects.filter(payment_status='paid').values_list('user__username', flat=True)),
+            {'paid1', 'paid2'},
+        )
+        trip.refresh_from_db()
+        self.assertEqual(trip.trip_status, 'confirmed')
+
+    def test_gateway_errors_leave_payments_for_the_next_run(self):
+        payment = _trip_with_pending_payment('payer', 'TXN-ERR')
+        Payment.objects.filter(pk=payment.pk).update(payment_date=timezone.now() - timedelta(hours=1))
+
+        with FakeSSLCommerz(error_rate=1.0) as gateway, override_settings(SSLCOMMERZ_BASE_URL=gateway.base_url):
+            report = reconcile.reconcile()
+        sslcommerz.breaker.record_success()
+
+        self.assertEqual(report['outcomes']['error'], 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.payment_status, 'pending')
@@ -16,4 +16,7 @@ urlpatterns = [
     path('fail/', views.payment_fail_view, name='payment_fail'),
     path('cancel/', views.payment_cancel_view, name='payment_cancel'),
     path('ipn/', views.payment_ipn_view, name='payment_ipn'),
+
+    # Gateway client metrics (staff only)
+    path('gateway/metrics/', views.gateway_metrics_view, name='payments_gateway_metrics'),
 ]
\ No newline at end of file
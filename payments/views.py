@@ -4,13 +4,18 @@ from django.contrib import messages
 from django.utils import timezone
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from datetime import timedelta
 import uuid
 
+from trips import seats
 from trips.models import OrganizedTrip, TripParticipant, Payment
 from users.decorators import verification_required
-from .sslcommerz import SSLCommerzPayment
+from .completion import (
+    ALREADY_COMPLETED, COMPLETED, IN_PROGRESS, NOT_FOUND, SEAT_LOST, UNAVAILABLE, complete_payment,
+)
+from .sslcommerz import SSLCommerzPayment, metrics_snapshot, valid_element
 
 
 @login_required
@@ -35,6 +40,11 @@ def trip_payment_view(request, trip_id):
     if participant.payment_status == 'paid':
         messages.info(request, 'You have already paid for this trip.')
         return redirect('organized_trip_detail', trip_id=trip_id)
+
+    # A refund gave the seat back; paying again needs a seat again
+    if participant.payment_status == 'refunded':
+        messages.error(request, 'Your seat was released with your refund. Join the trip again to pay.')
+        return redirect('organized_trip_detail', trip_id=trip_id)
     
     if request.method == 'POST':
         # Generate unique transaction ID
@@ -79,14 +89,14 @@ def trip_payment_view(request, trip_id):
             'product_profile': 'travel-goods',
         }
         
+        # Keep the seat held while the user is on the gateway page
+        seats.extend_hold(participant)
+
         # Create payment session
         response = sslcz.create_session(payment_data)
         
         if response.get('status') == 'SUCCESS':
-            # Store session key in payment
-            payment.transaction_id = response.get('sessionkey', tran_id)
-            payment.save()
-            
+            # Keep tran_id as transaction_id: callbacks and queries look the payment up by it
             # Redirect to SSLCommerz payment page
             gateway_url = response.get('GatewayPageURL')
             return redirect(gateway_url)
@@ -113,43 +123,30 @@ def payment_success_view(request):
     # Get transaction data from POST
     val_id = request.POST.get('val_id')
     tran_id = request.POST.get('tran_id')
-    amount = request.POST.get('amount')
     card_type = request.POST.get('card_type')
-    bank_tran_id = request.POST.get('bank_tran_id')
     
     if not val_id or not tran_id:
         messages.error(request, 'Invalid payment response.')
         return redirect('organized_trips')
     
-    # Validate transaction with SSLCommerz
-    sslcz = SSLCommerzPayment()
-    validation_response = sslcz.validate_transaction(val_id, tran_id)
+    # Shared with the IPN; whichever arrives second completes without a gateway call
+    payment, outcome = complete_payment(tran_id, val_id, card_type)
     
-    if validation_response.get('status') == 'VALID':
-        # Find payment record
-        try:
-            payment = Payment.objects.get(transaction_id=tran_id)
-            
-            # Update payment status
-            payment.payment_status = 'completed'
-            payment.payment_method = card_type or 'sslcommerz'
-            payment.save()
-            
-            # Update participant
-            participant = TripParticipant.objects.get(trip=payment.trip, user=payment.user)
-            participant.payment_status = 'paid'
-            participant.amount_paid = payment.total_amount
-            participant.save()
-            
-            # Recalculate trip status
-            _recalculate_trip_status(payment.trip)
-            
-            messages.success(request, 'Payment successful! You have 5 minutes to request a refund if needed.')
-            return redirect('organized_trip_detail', trip_id=payment.trip.trip_id)
-            
-        except Payment.DoesNotExist:
-            messages.error(request, 'Payment record not found.')
-            return redirect('organized_trips')
+    if outcome in (COMPLETED, ALREADY_COMPLETED):
+        messages.success(request, 'Payment successful! You have 5 minutes to request a refund if needed.')
+        return redirect('organized_trip_detail', trip_id=payment.trip_id)
+    elif outcome in (IN_PROGRESS, UNAVAILABLE):
+        messages.info(request, 'Your payment is being confirmed. This page will show it as paid shortly.')
+        return redirect('organized_trip_detail', trip_id=payment.trip_id)
+    elif outcome == SEAT_LOST:
+        messages.warning(
+            request, 'Your seat hold expired and the trip filled up before your payment arrived. '
+                     'Your payment will be refunded.'
+        )
+        return redirect('organized_trip_detail', trip_id=payment.trip_id)
+    elif outcome == NOT_FOUND:
+        messages.error(request, 'Payment record not found.')
+        return redirect('organized_trips')
     else:
         messages.error(request, 'Payment validation failed.')
         return redirect('organized_trips')
@@ -161,12 +158,8 @@ def payment_fail_view(request):
     tran_id = request.POST.get('tran_id')
     
     if tran_id:
-        try:
-            payment = Payment.objects.get(transaction_id=tran_id)
-            payment.payment_status = 'failed'
-            payment.save()
-        except Payment.DoesNotExist:
-            pass
+        # Conditional, so a late callback can't undo a payment the IPN already completed
+        Payment.objects.filter(transaction_id=tran_id, payment_status='pending').update(payment_status='failed')
     
     messages.error(request, 'Payment failed. Please try again.')
     return redirect('organized_trips')
@@ -178,12 +171,8 @@ def payment_cancel_view(request):
     tran_id = request.POST.get('tran_id')
     
     if tran_id:
-        try:
-            payment = Payment.objects.get(transaction_id=tran_id)
-            payment.payment_status = 'failed'
-            payment.save()
-        except Payment.DoesNotExist:
-            pass
+        # Conditional, so a late callback can't undo a payment the IPN already completed
+        Payment.objects.filter(transaction_id=tran_id, payment_status='pending').update(payment_status='failed')
     
     messages.warning(request, 'Payment cancelled.')
     return redirect('organized_trips')
@@ -199,24 +188,7 @@ def payment_ipn_view(request):
     tran_id = request.POST.get('tran_id')
     
     if val_id and tran_id:
-        sslcz = SSLCommerzPayment()
-        validation_response = sslcz.validate_transaction(val_id, tran_id)
-        
-        if validation_response.get('status') == 'VALID':
-            try:
-                payment = Payment.objects.get(transaction_id=tran_id)
-                if payment.payment_status != 'completed':
-                    payment.payment_status = 'completed'
-                    payment.save()
-                    
-                    participant = TripParticipant.objects.get(trip=payment.trip, user=payment.user)
-                    participant.payment_status = 'paid'
-                    participant.amount_paid = payment.total_amount
-                    participant.save()
-                    
-                    _recalculate_trip_status(payment.trip)
-            except Payment.DoesNotExist:
-                pass
+        complete_payment(tran_id, val_id, request.POST.get('card_type'))
     
     return HttpResponse('IPN received', status=200)
 
@@ -252,39 +224,47 @@ def trip_cancel_payment_view(request, trip_id):
         return redirect('organized_trip_detail', trip_id=trip_id)
 
     if request.method == 'POST':
-        # Initiate refund with SSLCommerz
-        sslcz = SSLCommerzPayment()
-        
-        # Query transaction to get bank_tran_id
-        query_response = sslcz.query_transaction(payment.transaction_id)
-        
-        if query_response.get('status') == 'VALID':
-            bank_tran_id = query_response.get('bank_tran_id')
-            
-            # Initiate refund
-            refund_response = sslcz.initiate_refund(
-                bank_tran_id=bank_tran_id,
-                refund_amount=payment.total_amount,
-                refund_remarks='Customer requested refund within 5-minute window'
-            )
-            
-            if refund_response.get('status') == 'success':
-                payment.payment_status = 'refunded'
-                payment.refund_status = True
-                payment.save()
-
-                participant.payment_status = 'refunded'
-                participant.save()
-
-                trip.total_participants -= 1
-                trip.save()
+        # Claim the payment, so a second request can't refund it and free the seat twice
+        claimed = Payment.objects.filter(pk=payment.pk, payment_status='completed').update(payment_status='refunding')
+        if not claimed:
+            messages.info(request, 'This payment is already being refunded.')
+            return redirect('organized_trip_detail', trip_id=trip_id)
 
-                messages.success(request, 'Refund initiated successfully. Amount will be credited within 7-10 business days.')
-                return redirect('organized_trips')
+        refunded = False
+        try:
+            # Initiate refund with SSLCommerz
+            sslcz = SSLCommerzPayment()
+
+            # Query transaction to get bank_tran_id
+            query_response = sslcz.query_transaction(payment.transaction_id)
+            paid = valid_element(query_response)
+
+            if paid:
+                bank_tran_id = paid.get('bank_tran_id')
+
+                # Initiate refund
+                refund_response = sslcz.initiate_refund(
+                    bank_tran_id=bank_tran_id,
+                    refund_amount=payment.total_amount,
+                    refund_remarks='Customer requested refund within 5-minute window'
+                )
+                refunded = refund_response.get('status') == 'success'
+                if not refunded:
+                    messages.error(request, f"Refund failed: {refund_response.get('errorReason', 'Unknown error')}")
             else:
-                messages.error(request, f"Refund failed: {refund_response.get('errorReason', 'Unknown error')}")
-        else:
-            messages.error(request, 'Unable to process refund. Please contact support.')
+                messages.error(request, 'Unable to process refund. Please contact support.')
+        finally:
+            claim = Payment.objects.filter(pk=payment.pk, payment_status='refunding')
+            if refunded:
+                claim.update(payment_status='refunded', refund_status=True)
+            else:
+                claim.update(payment_status='completed')  # Release the claim for another try
+
+        if refunded:
+            # The participant goes and the seat is handed to the waitlist, as when leaving
+            seats.leave(participant)
+            messages.success(request, 'Refund initiated successfully. Amount will be credited within 7-10 business days.')
+            return redirect('organized_trips')
 
     can_refund = timezone.now() < refund_deadline
 
@@ -299,18 +279,6 @@ def trip_cancel_payment_view(request, trip_id):
     return render(request, 'payments/trip_cancel_payment_confirm.html', context)
 
 
-def _recalculate_trip_status(trip: OrganizedTrip) -> None:
-    """Recalculate trip status when payment received"""
-    paid_count = TripParticipant.objects.filter(
-        trip=trip, 
-        payment_status='paid'
-    ).count()
-    
-    if paid_count >= 2 and trip.trip_status in ['open', 'planning']:
-        trip.trip_status = 'confirmed'
-        trip.save()
-
-
 @login_required
 @verification_required
 def checkout_view(request, trip_id):
@@ -352,4 +320,10 @@ def payments_history_view(request):
         'user': request.user,
         'grouped_payments': grouped,
     }
-    return render(request, 'payments/history.html', context)
\ No newline at end of file
+    return render(request, 'payments/history.html', context)
+
+
+@staff_member_required
+def gateway_metrics_view(request):
+    """Latency histograms and circuit state of the SSLCommerz client in this worker"""
+    return JsonResponse(metrics_snapshot())
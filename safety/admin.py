@@ -1,7 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from django.core.mail import send_mail
-from django.conf import settings
+from users import outbox
 from .models import SafetyReport, SafetyGuideline, EmergencyContact, SOSAlert
 
 
@@ -111,7 +110,8 @@ class SOSAlertAdmin(admin.ModelAdmin):
     list_display = ['user', 'alert_type', 'status_badge', 'location_display', 'timestamp', 'contacts_notified']
     list_filter = ['status', 'alert_type', 'contacts_notified', 'timestamp']
     search_fields = ['user__username', 'description', 'location_address']
-    readonly_fields = ['timestamp', 'resolved_at', 'notification_sent_at']
+    readonly_fields = ['timestamp', 'resolved_at', 'notification_sent_at',
+                       'contacts_delivered', 'admins_notified', 'dispatch_latency_ms']
     date_hierarchy = 'timestamp'
 
     fieldsets = (
@@ -125,7 +125,8 @@ class SOSAlertAdmin(admin.ModelAdmin):
             'fields': ('status', 'resolved_by', 'admin_notes')
         }),
         ('Notifications', {
-            'fields': ('contacts_notified', 'notification_sent_at')
+            'fields': ('contacts_notified', 'notification_sent_at', 'contacts_delivered',
+                       'admins_notified', 'dispatch_latency_ms')
         }),
         ('Timestamps', {
             'fields': ('timestamp', 'resolved_at'),
@@ -193,13 +194,5 @@ Stay safe and keep your phone charged.
 
 SheTrip Safety Team
             """
-            try:
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [obj.user.email],
-                    fail_silently=True
-                )
-            except Exception as e:
-                pass
+            if obj.user.email:
+                outbox.enqueue(subject, message, [obj.user.email], dedup_key=f'sos-responding:{obj.pk}')
@@ -0,0 +1,285 @@
+"""Out-of-band delivery of SOS alert notifications.
+
+Views save the alert and hand its id to ``dispatch_alert`` once the
+transaction commits, so the user gets a response without waiting on SMTP.
+A dedicated thread pool, used for nothing but SOS mail, sends the contact
+and admin emails in parallel. Each worker thread keeps one SMTP connection
+open across sends and reconnects when the server drops it. Failed sends
+are retried with backoff.
+
+When every send has finished, the alert records how many contacts were
+reached, whether admins were, and the dispatch latency. ``contacts_notified``
+and ``notification_sent_at`` are set only when a contact email is delivered.
+
+The pool lives in the web process, so views also stamp the alert with
+``dispatch_pending_since`` in the transaction that saves it, and recording
+the outcome clears it. If the process dies first, the ``dispatch_pending_sos``
+cron picks up alerts that stayed pending for ``SWEEP_AFTER`` and sends again.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection
+from django.utils import timezone
+
+from .models import EmergencyContact, SOSAlert
+
+
+logger = logging.getLogger(__name__)
+
+WORKERS = getattr(settings, 'SOS_DISPATCH_WORKERS', 4)
+RETRY_DELAYS = getattr(settings, 'SOS_DISPATCH_RETRY_DELAYS', (0.5, 2, 5))
+# Seconds an SMTP operation may block, so a hung server fails the attempt instead of the sweep resending
+SEND_TIMEOUT = getattr(settings, 'SOS_DISPATCH_SEND_TIMEOUT', 10)
+# Comfortably longer than a dispatch with every retry timing out takes
+SWEEP_AFTER = getattr(settings, 'SOS_DISPATCH_SWEEP_AFTER', timedelta(minutes=2))
+
+
+def _location_url(alert):
+    if alert.location_latitude and alert.location_longitude:
+        return f'https://www.google.com/maps?q={alert.location_latitude},{alert.location_longitude}'
+    return ''
+
+
+def contact_email(alert, contact):
+    """Emergency notification for one of the user's emergency contacts"""
+    location_url = _location_url(alert)
+    subject = f'🚨 EMERGENCY ALERT from {alert.user.get_full_name()}'
+    message = f"""
+EMERGENCY SOS ALERT
+
+{alert.user.get_full_name()} has triggered an emergency SOS alert!
+
+Emergency Type: {alert.get_alert_type_display()}
+Time: {alert.timestamp.strftime('%B %d, %Y at %I:%M %p')}
+Location: {alert.location_address or 'Not specified'}
+
+{'View Location on Map: ' + location_url if location_url else ''}
+
+Description: {alert.description or 'No additional details provided'}
+
+This is an automated emergency notification from SheTrip.
+If you cannot reach {alert.user.first_name}, please contact local authorities immediately.
+
+Emergency Hotline: 999 (Bangladesh)
+
+SheTrip Safety Team
+Phone: +880 1XXX-XXXXXX
+Email: safety@shetrip.com
+            """
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [contact.email])
+
+
+def admin_email(alert, contacts, admin_emails):
+    """Alert for the admin team, listing the user's emergency contacts"""
+    location_url = _location_url(alert)
+    subject = f'🚨 URGENT: SOS Alert from {alert.user.get_full_name()}'
+
+    # Get user profile info
+    user_phone = 'Not provided'
+    if hasattr(alert.user, 'profile') and alert.user.profile:
+        user_phone = alert.user.profile.phone or 'Not provided'
+
+    message = f"""
+========================================
+   URGENT SOS ALERT - IMMEDIATE ACTION REQUIRED
+========================================
+
+USER INFORMATION:
+- Name: {alert.user.get_full_name()}
+- Email: {alert.user.email}
+- Phone: {user_phone}
+
+ALERT DETAILS:
+- Emergency Type: {alert.get_alert_type_display()}
+- Time: {alert.timestamp.strftime('%B %d, %Y at %I:%M %p')}
+- Status: {alert.get_status_display()}
+
+LOCATION:
+- Address: {alert.location_address or 'Not specified'}
+{'- GPS Map: ' + location_url if location_url else '- GPS: Not available'}
+
+DESCRIPTION:
+{alert.description or 'No additional details provided'}
+
+EMERGENCY CONTACTS NOTIFIED:
+"""
+
+    if contacts:
+        for contact in contacts:
+            primary = " [PRIMARY]" if contact.is_primary else ""
+            message += f"- {contact.contact_name} ({contact.get_relationship_display()}){primary}\n"
+            message += f"  Phone: {contact.phone_number}\n"
+            if contact.email:
+                message += f"  Email: {contact.email}\n"
+    else:
+        message += "⚠️ NO EMERGENCY CONTACTS SET UP\n"
+
+    message += f"""
+
+ADMIN ACTIONS:
+- View in Admin Panel: {settings.SITE_URL}/admin/safety/sosalert/{alert.pk}/change/
+- Update Status to "Responding" once help is dispatched
+- Mark as "Resolved" once situation is handled
+
+⚠️ IMMEDIATE RESPONSE REQUIRED ⚠️
+
+SheTrip Safety System
+    """
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, admin_emails)
+
+
+class _AlertDispatch:
+    """Tracks one alert's in-flight sends and records the outcome when the last finishes"""
+
+    def __init__(self, alert, pending):
+        self.alert = alert
+        self.pending = pending
+        self.contacts_delivered = 0
+        self.first_contact_delivery = None
+        self.admins_notified = False
+        self._lock = threading.Lock()
+
+    def done(self, kind, delivered):
+        """Count one finished send; called on the pool thread that made it"""
+        with self._lock:
+            if delivered and kind == 'contact':
+                self.contacts_delivered += 1
+                self.first_contact_delivery = self.first_contact_delivery or timezone.now()
+            elif delivered and kind == 'admin':
+                self.admins_notified = True
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            try:
+                self.record()
+            finally:
+                db_connection.close()  # Worker threads don't go through request_finished
+
+    def record(self):
+        finished_at = timezone.now()
+        fields = {
+            'contacts_delivered': self.contacts_delivered,
+            'admins_notified': self.admins_notified,
+            'dispatch_latency_ms': int((finished_at - self.alert.timestamp).total_seconds() * 1000),
+            'dispatch_pending_since': None,
+        }
+        if self.contacts_delivered:
+            fields.update(contacts_notified=True, notification_sent_at=self.first_contact_delivery)
+        SOSAlert.objects.filter(pk=self.alert.pk).update(**fields)
+        logger.info(
+            'SOS alert %s dispatched in %s ms: %s contact(s), admins=%s',
+            self.alert.pk, fields['dispatch_latency_ms'], self.contacts_delivered, self.admins_notified,
+        )
+
+
+class SOSDispatcher:
+    """Dedicated pool delivering SOS emails in parallel over per-thread SMTP connections"""
+
+    def __init__(self, workers=WORKERS, retry_delays=RETRY_DELAYS, timeout=SEND_TIMEOUT):
+        self.retry_delays = retry_delays
+        self.timeout = timeout
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sos-dispatch')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = get_connection(fail_silently=False, timeout=self.timeout)
+            connection.open()
+            self._local.connection = connection
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def send(self, message):
+        """Deliver one message, reconnecting and retrying on failure; returns True if sent"""
+        for attempt, delay in enumerate((0,) + tuple(self.retry_delays)):
+            if delay:
+                time.sleep(delay)
+            try:
+                message.connection = self._connection()
+                return message.send() > 0
+            except Exception as exc:
+                # A dropped or broken connection is replaced on the next attempt
+                self._drop_connection()
+                logger.warning('SOS email to %s failed (attempt %s): %s', message.to, attempt + 1, exc)
+        return False
+
+    def _deliver(self, tracker, kind, message):
+        delivered = False
+        try:
+            delivered = self.send(message)
+        finally:
+            tracker.done(kind, delivered)
+
+    def submit(self, alert, messages):
+        """Send ``(kind, message)`` pairs in parallel; the alert is updated once all finish"""
+        if not messages:
+            # Nothing to send: record right here, on the caller's connection
+            _AlertDispatch(alert, 0).record()
+            return
+        tracker = _AlertDispatch(alert, len(messages))
+        for kind, message in messages:
+            self._executor.submit(self._deliver, tracker, kind, message)
+
+    def shutdown(self):
+        """Wait for every queued send to finish; for short-lived processes such as the sweep"""
+        self._executor.shutdown(wait=True)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = SOSDispatcher()
+    return _dispatcher
+
+
+def dispatch_alert(alert):
+    """Queue the contact and admin notifications for a saved alert"""
+    contacts = list(EmergencyContact.objects.filter(user=alert.user))
+    admin_emails = list(
+        get_user_model().objects.filter(is_staff=True, is_active=True)
+        .exclude(email='').values_list('email', flat=True)
+    )
+
+    messages = [('contact', contact_email(alert, contact)) for contact in contacts if contact.email]
+    if admin_emails:
+        messages.append(('admin', admin_email(alert, contacts, admin_emails)))
+
+    get_dispatcher().submit(alert, messages)
+
+
+def dispatch_stale_alerts(now):
+    """Dispatch alerts left pending for ``SWEEP_AFTER``; returns how many were claimed.
+
+    Each alert is claimed by moving its ``dispatch_pending_since`` to ``now``
+    with a conditional UPDATE, so overlapping sweeps send it only once.
+    """
+    claimed = 0
+    for alert in SOSAlert.objects.filter(dispatch_pending_since__lt=now - SWEEP_AFTER).select_related('user'):
+        if SOSAlert.objects.filter(
+            pk=alert.pk, dispatch_pending_since=alert.dispatch_pending_since
+        ).update(dispatch_pending_since=now):
+            logger.warning('SOS alert %s was never dispatched; sending now', alert.pk)
+            dispatch_alert(alert)
+            claimed += 1
+    return claimed
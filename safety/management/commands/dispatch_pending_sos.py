@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from safety.dispatch import dispatch_stale_alerts, get_dispatcher
+
+
+class Command(BaseCommand):
+    help = "Send the notifications of SOS alerts whose dispatch was lost, e.g. to a web worker restart."
+
+    def handle(self, *args, **options):
+        claimed = dispatch_stale_alerts(timezone.now())
+        get_dispatcher().shutdown()
+        self.stdout.write(self.style.SUCCESS(f'✓ {claimed} pending SOS alerts dispatched'))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('safety', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sosalert',
+            name='admins_notified',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='contacts_delivered',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='dispatch_latency_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
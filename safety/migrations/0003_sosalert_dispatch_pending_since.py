@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('safety', '0002_sosalert_dispatch_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sosalert',
+            name='dispatch_pending_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
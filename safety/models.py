@@ -203,10 +203,18 @@ class SOSAlert(models.Model):
     )
     admin_notes = models.TextField(blank=True)
 
-    # Emergency contacts notified
+    # Emergency contacts notified (set only once an email was actually delivered)
     contacts_notified = models.BooleanField(default=False)
     notification_sent_at = models.DateTimeField(null=True, blank=True)
 
+    # Dispatch outcome, recorded by safety.dispatch when all sends finish
+    contacts_delivered = models.PositiveSmallIntegerField(default=0)
+    admins_notified = models.BooleanField(default=False)
+    dispatch_latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    # Set when the alert is raised and cleared once the outcome is recorded; a
+    # stale value means the sends were lost and dispatch_pending_sos retries them
+    dispatch_pending_since = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         ordering = ['-timestamp']
         verbose_name = "SOS Alert"
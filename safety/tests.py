@@ -1,3 +1,114 @@
-from django.test import TestCase
+from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from . import dispatch
+from .models import EmergencyContact, SOSAlert
+
+
+class DispatchTests(TransactionTestCase):
+    """Sends run on pool threads with their own connections, so the rows must be committed"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('traveller', email='traveller@example.com', first_name='Tina')
+        self.dispatcher = dispatch.SOSDispatcher(workers=3, retry_delays=(0, 0))
+        patcher = mock.patch.object(dispatch, '_dispatcher', self.dispatcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _contact(self, name, email):
+        return EmergencyContact.objects.create(
+            user=self.user, contact_name=name, relationship='friend', phone_number='01700000000', email=email,
+        )
+
+    def _alert(self, pending_since=None):
+        return SOSAlert.objects.create(
+            user=self.user, description='Lost near the station',
+            dispatch_pending_since=pending_since or timezone.now(),
+        )
+
+    def _dispatch(self, alert):
+        dispatch.dispatch_alert(alert)
+        self.dispatcher.shutdown()
+        return SOSAlert.objects.get(pk=alert.pk)
+
+    def test_contacts_and_admins_are_emailed_and_the_outcome_recorded(self):
+        self._contact('Mina', 'mina@example.com')
+        self._contact('Rafi', 'rafi@example.com')
+        self._contact('No email', '')
+        User.objects.create_user('admin', email='admin@example.com', is_staff=True)
+
+        alert = self._dispatch(self._alert())
+
+        self.assertCountEqual(
+            [message.to for message in mail.outbox],
+            [['mina@example.com'], ['rafi@example.com'], ['admin@example.com']],
+        )
+        self.assertEqual(alert.contacts_delivered, 2)
+        self.assertTrue(alert.admins_notified)
+        self.assertTrue(alert.contacts_notified)
+        self.assertIsNotNone(alert.notification_sent_at)
+        self.assertIsNotNone(alert.dispatch_latency_ms)
+        self.assertIsNone(alert.dispatch_pending_since)
+
+    def test_failed_send_is_retried_on_a_new_connection(self):
+        self._contact('Mina', 'mina@example.com')
+
+        with mock.patch.object(EmailMessage, 'send', side_effect=[SMTPServerDisconnected('gone'), 1]) as send, \
+                self.assertLogs('safety.dispatch', 'WARNING'):
+            alert = self._dispatch(self._alert())
+
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(alert.contacts_delivered, 1)
+
+    def test_send_that_never_succeeds_is_recorded_as_undelivered(self):
+        self._contact('Mina', 'mina@example.com')
+
+        with mock.patch.object(EmailMessage, 'send', side_effect=SMTPServerDisconnected('gone')) as send, \
+                self.assertLogs('safety.dispatch', 'WARNING'):
+            alert = self._dispatch(self._alert())
+
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(alert.contacts_delivered, 0)
+        self.assertFalse(alert.contacts_notified)
+        self.assertIsNone(alert.dispatch_pending_since)
+
+    def test_hung_smtp_server_times_out_before_the_sweep_resends(self):
+        with mock.patch.object(dispatch, 'get_connection') as get_connection:
+            get_connection.return_value.send_messages.return_value = 1
+            self.dispatcher.send(EmailMessage('SOS', 'Help', to=['mina@example.com']))
+
+        get_connection.assert_called_once_with(fail_silently=False, timeout=dispatch.SEND_TIMEOUT)
+        attempts = len(dispatch.RETRY_DELAYS) + 1
+        longest = attempts * dispatch.SEND_TIMEOUT + sum(dispatch.RETRY_DELAYS)
+        self.assertLess(longest, dispatch.SWEEP_AFTER.total_seconds())
+
+    def test_alert_without_recipients_is_recorded_on_the_callers_connection(self):
+        with mock.patch.object(dispatch.db_connection, 'close') as close:
+            alert = self._dispatch(self._alert())
+
+        close.assert_not_called()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual((alert.contacts_delivered, alert.admins_notified), (0, False))
+        self.assertIsNotNone(alert.dispatch_latency_ms)
+        self.assertIsNone(alert.dispatch_pending_since)
+
+    def test_sweep_sends_alerts_left_pending_once(self):
+        self._contact('Mina', 'mina@example.com')
+        now = timezone.now()
+        lost = self._alert(pending_since=now - dispatch.SWEEP_AFTER - timedelta(seconds=1))
+        in_flight = self._alert(pending_since=now)
+
+        with mock.patch.object(dispatch, 'dispatch_alert') as send, self.assertLogs('safety.dispatch', 'WARNING'):
+            self.assertEqual(dispatch.dispatch_stale_alerts(now), 1)
+            self.assertEqual(dispatch.dispatch_stale_alerts(now + dispatch.SWEEP_AFTER / 2), 0)
+
+        send.assert_called_once()
+        self.assertEqual(send.call_args.args[0].pk, lost.pk)
+        self.assertEqual(SOSAlert.objects.get(pk=in_flight.pk).dispatch_pending_since, now)
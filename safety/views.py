@@ -2,154 +2,15 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db.models import Q, Count
+from django.db import transaction
 from django.utils import timezone
-from django.core.mail import send_mail
-from django.conf import settings
-from django.contrib.auth import get_user_model
 
 from .models import SafetyReport, SafetyGuideline, EmergencyContact, SOSAlert
 from .forms import SafetyReportForm, EmergencyContactForm, SOSAlertForm, QuickSOSForm
+from .dispatch import dispatch_alert
 
 
 
-def notify_emergency_contacts(alert):
-    """Send Email to user's emergency contacts"""
-    contacts = EmergencyContact.objects.filter(user=alert.user)
-
-    if not contacts.exists():
-        return
-
-    # Mark as notified
-    alert.contacts_notified = True
-    alert.notification_sent_at = timezone.now()
-    alert.save()
-
-    for contact in contacts:
-        # Email notification
-        if contact.email:
-            subject = f'🚨 EMERGENCY ALERT from {alert.user.get_full_name()}'
-
-            location_url = ''
-            if alert.location_latitude and alert.location_longitude:
-                location_url = f'https://www.google.com/maps?q={alert.location_latitude},{alert.location_longitude}'
-
-            message = f"""
-EMERGENCY SOS ALERT
-
-{alert.user.get_full_name()} has triggered an emergency SOS alert!
-
-Emergency Type: {alert.get_alert_type_display()}
-Time: {alert.timestamp.strftime('%B %d, %Y at %I:%M %p')}
-Location: {alert.location_address or 'Not specified'}
-
-{'View Location on Map: ' + location_url if location_url else ''}
-
-Description: {alert.description or 'No additional details provided'}
-
-This is an automated emergency notification from SheTrip.
-If you cannot reach {alert.user.first_name}, please contact local authorities immediately.
-
-Emergency Hotline: 999 (Bangladesh)
-
-SheTrip Safety Team
-Phone: +880 1XXX-XXXXXX
-Email: safety@shetrip.com
-            """
-
-            try:
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [contact.email],
-                    fail_silently=True,
-                )
-            except Exception as e:
-                print(f"Failed to send email to {contact.email}: {str(e)}")
-
-
-def notify_admin_team(alert):
-    """Notify admin team about SOS alert"""
-    User = get_user_model()
-    admins = User.objects.filter(is_staff=True, is_active=True)
-
-    if not admins.exists():
-        return
-
-    subject = f'🚨 URGENT: SOS Alert from {alert.user.get_full_name()}'
-
-    location_url = ''
-    if alert.location_latitude and alert.location_longitude:
-        location_url = f'https://www.google.com/maps?q={alert.location_latitude},{alert.location_longitude}'
-
-    # Get user profile info
-    user_phone = 'Not provided'
-    if hasattr(alert.user, 'profile') and alert.user.profile:
-        user_phone = alert.user.profile.phone or 'Not provided'
-
-    message = f"""
-========================================
-   URGENT SOS ALERT - IMMEDIATE ACTION REQUIRED
-========================================
-
-USER INFORMATION:
-- Name: {alert.user.get_full_name()}
-- Email: {alert.user.email}
-- Phone: {user_phone}
-
-ALERT DETAILS:
-- Emergency Type: {alert.get_alert_type_display()}
-- Time: {alert.timestamp.strftime('%B %d, %Y at %I:%M %p')}
-- Status: {alert.get_status_display()}
-
-LOCATION:
-- Address: {alert.location_address or 'Not specified'}
-{'- GPS Map: ' + location_url if location_url else '- GPS: Not available'}
-
-DESCRIPTION:
-{alert.description or 'No additional details provided'}
-
-EMERGENCY CONTACTS NOTIFIED:
-"""
-
-    contacts = EmergencyContact.objects.filter(user=alert.user)
-    if contacts.exists():
-        for contact in contacts:
-            primary = " [PRIMARY]" if contact.is_primary else ""
-            message += f"- {contact.contact_name} ({contact.get_relationship_display()}){primary}\n"
-            message += f"  Phone: {contact.phone_number}\n"
-            if contact.email:
-                message += f"  Email: {contact.email}\n"
-    else:
-        message += "⚠️ NO EMERGENCY CONTACTS SET UP\n"
-
-    message += f"""
-
-ADMIN ACTIONS:
-- View in Admin Panel: {settings.SITE_URL}/admin/safety/sosalert/{alert.pk}/change/
-- Update Status to "Responding" once help is dispatched
-- Mark as "Resolved" once situation is handled
-
-⚠️ IMMEDIATE RESPONSE REQUIRED ⚠️
-
-SheTrip Safety System
-    """
-
-    admin_emails = [admin.email for admin in admins if admin.email]
-
-    if admin_emails:
-        try:
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                admin_emails,
-                fail_silently=True,
-            )
-        except Exception as e:
-            print(f"Failed to send admin notification: {str(e)}")
-
-
 # ==================== SAFETY CENTER ====================
 @login_required
 def safety_center(request):
@@ -432,11 +293,11 @@ def create_sos_alert(request):
                 except (ValueError, TypeError):
                     pass
 
+            alert.dispatch_pending_since = timezone.now()
             alert.save()
 
-            # Send notifications
-            notify_emergency_contacts(alert)
-            notify_admin_team(alert)
+            # Notify contacts and admins in the background once the alert is committed
+            transaction.on_commit(lambda: dispatch_alert(alert))
 
             messages.success(request, '🚨 SOS Alert sent! Help is on the way. Stay safe!')
             return redirect('safety:sos_alert_detail', alert_id=alert.pk)
@@ -474,7 +335,7 @@ def quick_sos(request):
         longitude = request.POST.get('longitude')
 
         # Create SOS alert
-        alert = SOSAlert.objects.create(
+        alert = SOSAlert(
             user=request.user,
             alert_type=alert_type,
             location_address=location,
@@ -486,13 +347,14 @@ def quick_sos(request):
             try:
                 alert.location_latitude = float(latitude)
                 alert.location_longitude = float(longitude)
-                alert.save()
             except (ValueError, TypeError):
                 pass
 
-        # Send notifications
-        notify_emergency_contacts(alert)
-        notify_admin_team(alert)
+        alert.dispatch_pending_since = timezone.now()
+        alert.save()
+
+        # Notify contacts and admins in the background once the alert is committed
+        transaction.on_commit(lambda: dispatch_alert(alert))
 
         messages.success(request, '🚨 Emergency alert sent! Help is coming!')
         return redirect('safety:sos_alert_detail', alert_id=alert.pk)
@@ -0,0 +1,93 @@
+"""End-to-end timings of the key pages, for comparison across releases.
+
+``run`` logs in as one user and requests each view through the test
+client, after a few warm-up requests that fill the per-user caches. For
+every view it records the SQL query count and the p50/p95 latency. Pair it
+with ``shetrip.scale`` to benchmark against production-sized tables.
+"""
+import math
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.models import Message
+from trips.models import OrganizedTrip, Payment, TravelPlan, TripParticipant
+from users.models import Notification, UserConnection
+
+
+VIEWS = ['find_buddies', 'my_trips', 'chat:messages', 'community', 'payments_history', 'safety:safety_center']
+
+TABLES = {
+    'users': User,
+    'travel_plans': TravelPlan,
+    'organized_trips': OrganizedTrip,
+    'trip_participants': TripParticipant,
+    'payments': Payment,
+    'messages': Message,
+    'notifications': Notification,
+    'connections': UserConnection,
+}
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples``"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def busiest_user():
+    """The verified user with the most trips, so pages render with real content"""
+    row = (
+        TripParticipant.objects.filter(user__userprofile__verification_status='verified')
+        .values('user').annotate(trips=Count('pk')).order_by('-trips').first()
+    )
+    if row:
+        return User.objects.get(pk=row['user'])
+    return User.objects.filter(userprofile__verification_status='verified').order_by('id').first()
+
+
+def measure(client, url, repeat, warmup):
+    for _ in range(warmup):
+        client.get(url)
+    timings, queries, status = [], [], None
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+        status = response.status_code
+    return {
+        'url': url,
+        'status': status,
+        'queries': statistics.median_low(queries),
+        'queries_max': max(queries),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'max_ms': round(max(timings), 2),
+    }
+
+
+def run(user, views=VIEWS, repeat=20, warmup=2, label=''):
+    """Benchmark ``views`` (URL names) as ``user``; returns a JSON-serializable report"""
+    client = Client()
+    client.force_login(user)
+    return {
+        'label': label,
+        'generated_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'user': user.username,
+        'repeat': repeat,
+        'rows': {
+            name: model.objects.count()
+            for name, model in TABLES.items()
+        },
+        'views': {name: measure(client, reverse(name), repeat, warmup) for name in views},
+    }
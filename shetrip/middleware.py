@@ -1,3 +1,6 @@
+import time
+
+from django.conf import settings
 from django.utils.cache import add_never_cache_headers
 
 class NoCacheMiddleware:
@@ -17,4 +20,38 @@ class NoCacheMiddleware:
             response['Pragma'] = 'no-cache'
             response['Expires'] = '0'
         
-        return response
\ No newline at end of file
+        return response
+
+class LazySessionRefreshMiddleware:
+    """
+    Extend session expiry only when it is close to running out.
+
+    Replaces SESSION_SAVE_EVERY_REQUEST: the session is marked modified (so
+    SessionMiddleware saves it and re-sends the cookie) only once less than
+    SESSION_REFRESH_THRESHOLD seconds of its lifetime remain. Must be listed
+    after SessionMiddleware.
+    """
+    TIMESTAMP_KEY = '_refreshed_at'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lifetime = settings.SESSION_COOKIE_AGE
+        self.threshold = getattr(settings, 'SESSION_REFRESH_THRESHOLD', self.lifetime // 2)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        session = getattr(request, 'session', None)
+        if session is None or session.is_empty():
+            return response
+
+        now = int(time.time())
+        if session.modified:
+            # Being saved anyway; restart the lifetime clock for free
+            session[self.TIMESTAMP_KEY] = now
+        else:
+            refreshed_at = session.get(self.TIMESTAMP_KEY, 0)
+            if self.lifetime - (now - refreshed_at) < self.threshold:
+                session[self.TIMESTAMP_KEY] = now
+
+        return response
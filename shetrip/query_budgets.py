@@ -0,0 +1,92 @@
+"""Per-view query and time budgets, and the recorder that checks them.
+
+``BUDGETS`` maps URL names to the most SQL queries and milliseconds one
+warm request may take. The numbers are fixed, so a page that starts issuing
+a query per row (an N+1) goes over budget as soon as the seeded data has more
+rows than the budget allows. ``shetrip.tests.QueryBudgetTests`` renders
+every entry against seeded data; raise a budget only together with the
+change that needs it.
+
+``QueryRecorder`` records every statement with the project frames that
+issued it, so an over-budget failure shows which SQL repeated and where
+it came from.
+"""
+import traceback
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+
+BUDGETS = {
+    'find_buddies': {'queries': 6, 'ms': 1000},
+    'my_trips': {'queries': 7, 'ms': 1000},
+    'chat:messages': {'queries': 4, 'ms': 1000},
+    'community': {'queries': 6, 'ms': 1000},
+    'my_connections': {'queries': 3, 'ms': 1000},
+    'notifications': {'queries': 6, 'ms': 1000},
+    'dashboard': {'queries': 3, 'ms': 1000},
+    'payments_history': {'queries': 4, 'ms': 1000},
+    'organized_trips': {'queries': 6, 'ms': 1000},
+    'safety:safety_center': {'queries': 10, 'ms': 1000},
+    'safety:sos_alerts': {'queries': 7, 'ms': 1000},
+    'safety:emergency_contacts': {'queries': 6, 'ms': 1000},
+}
+
+PROJECT_DIR = str(Path(settings.BASE_DIR).resolve())
+ORIGIN_DEPTH = 3  # Innermost project frames kept per query
+
+
+def _origin():
+    """The innermost project frames on the stack, as ``path:line in function``"""
+    frames = [
+        frame for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(PROJECT_DIR) and frame.filename != __file__
+        and 'site-packages' not in frame.filename
+    ]
+    return ' < '.join(
+        f'{Path(frame.filename).relative_to(PROJECT_DIR)}:{frame.lineno} in {frame.name}'
+        for frame in reversed(frames[-ORIGIN_DEPTH:])
+    ) or '(outside the project)'
+
+
+class QueryRecorder:
+    """Record ``(sql, origin)`` for every statement run on ``connection`` inside the block"""
+
+    def __init__(self, using=connection):
+        self.connection = using
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, _origin()))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def duplicates(self):
+        """``[(sql, count, {origin: count})]`` for statements run more than once, most repeated first"""
+        origins = defaultdict(Counter)
+        for sql, origin in self.queries:
+            origins[sql][origin] += 1
+        repeated = [(sql, sum(by_origin.values()), dict(by_origin)) for sql, by_origin in origins.items()]
+        return sorted(
+            [entry for entry in repeated if entry[1] > 1], key=lambda entry: entry[1], reverse=True
+        )
+
+    def report(self):
+        """Human-readable list of the repeated statements and where they were issued"""
+        lines = []
+        for sql, count, origins in self.duplicates():
+            lines.append(f'{count}x {sql}')
+            lines += [f'    {n}x from {origin}' for origin, n in origins.items()]
+        return '\n'.join(lines) or 'No statement ran more than once.'
@@ -0,0 +1,305 @@
+"""Synthetic production-scale data for load tests and benchmarks.
+
+``seed`` bulk-creates a self-consistent population: verified users with
+profiles, travel plans with destination tokens and interests, organized
+trips with participants and payments, connections, conversations with
+messages, notifications and SOS alerts. Everything goes through
+``bulk_create`` in batches, so signals do not run. The denormalized
+columns they would maintain are filled in directly instead: plan interest
+counters, trip seat counts, conversation summaries and unread counts.
+
+Generated usernames start with ``<prefix>_<run>_`` with a random run tag,
+so several runs can share a database; apart from that tag a fixed ``seed``
+reproduces the same data.
+"""
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db.models import Max
+from django.utils import timezone
+
+from chat.models import Conversation, ConversationParticipant, Message
+from safety.models import SOSAlert
+from trips.matching import normalize_destination
+from trips.models import (
+    OrganizedTrip, Payment, TravelPlan, TravelPlanDestinationToken, TravelPlanInterest, TripParticipant,
+)
+from trips.search import destination_tokens
+from users.models import Notification, UserConnection, UserProfile
+
+
+DESTINATIONS = [
+    "Cox's Bazar", 'Sylhet', 'Sreemangal', 'Bandarban', 'Sajek Valley', 'Rangamati', 'Sundarbans',
+    'Kuakata', "Saint Martin's Island", 'Khagrachari', 'Ratargul', 'Tanguar Haor', 'Paharpur',
+    'Mahasthangarh', 'Kathmandu', 'Pokhara', 'Darjeeling', 'Thimphu', 'Bangkok', 'Kuala Lumpur', 'Bali',
+]
+FIRST_NAMES = [
+    'Ayesha', 'Fatima', 'Nusrat', 'Tasnim', 'Farzana', 'Sadia', 'Mim', 'Riya', 'Lamia', 'Sumaiya',
+    'Nadia', 'Tahmina', 'Rumana', 'Sharmin', 'Jannat', 'Maliha', 'Priya', 'Anika', 'Raisa', 'Tania',
+]
+LAST_NAMES = ['Rahman', 'Hossain', 'Akter', 'Islam', 'Chowdhury', 'Begum', 'Khan', 'Ahmed', 'Sultana', 'Das']
+CITIES = ['Dhaka', 'Chattogram', 'Sylhet', 'Rajshahi', 'Khulna', 'Barishal', 'Rangpur', 'Mymensingh']
+TRAVEL_STYLES = ['adventure', 'relaxed', 'cultural', 'budget', 'luxury']
+INTERESTS = ['hiking', 'beaches', 'food', 'photography', 'history', 'culture', 'wildlife', 'shopping']
+LANGUAGES = ['Bangla', 'English', 'Hindi', 'Arabic']
+MESSAGES = [
+    'Hi! Are you still going on this trip?', 'Which hotel are you thinking of?',
+    'I can share the bus tickets.', 'Sounds great, count me in!', 'What time do we leave?',
+    'Sent you the itinerary.', 'Let us meet at the station.', 'Thanks, see you there!',
+]
+NOTIFICATION_TYPES = [choice for choice, _ in Notification.NOTIFICATION_TYPES]
+SOS_TYPES = [choice for choice, _ in SOSAlert.ALERT_TYPE_CHOICES]
+
+DEFAULTS = {
+    'users': 1000,
+    'plans': 2000,
+    'interests_per_plan': 3,
+    'trip_ratio': 0.2,
+    'connections_per_user': 5,
+    'conversations_per_user': 3,
+    'messages_per_conversation': 20,
+    'notifications_per_user': 10,
+    'sos_alerts': 50,
+}
+
+
+class _Seeder:
+
+    def __init__(self, rng, batch_size, prefix, password, log):
+        self.rng = rng
+        self.batch_size = batch_size
+        self.prefix = f'{prefix}_{uuid.uuid4().hex[:6]}_'
+        self.password = make_password(password)  # Hashed once and shared
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+        self.counts = {}
+
+    def _insert(self, model, objects, name=None, **kwargs):
+        started = time.perf_counter()
+        created = model.objects.bulk_create(objects, batch_size=self.batch_size, **kwargs)
+        name = name or model._meta.verbose_name_plural
+        self.counts[name] = self.counts.get(name, 0) + len(objects)
+        self.log(f'{len(objects)} {name} in {time.perf_counter() - started:.1f}s')
+        return created
+
+    def users(self, count):
+        rng = self.rng
+        users = []
+        for i in range(count):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            users.append(User(
+                username=f'{self.prefix}{i}', email=f'{self.prefix}{i}@example.com',
+                first_name=first, last_name=last, password=self.password,
+            ))
+        self._insert(User, users)
+        user_ids = list(
+            User.objects.filter(username__startswith=self.prefix).order_by('id').values_list('id', flat=True)
+        )
+        self._insert(UserProfile, [
+            UserProfile(
+                user_id=user_id, age=rng.randint(18, 60), phone=f'+8801{rng.randint(300000000, 999999999)}',
+                city=rng.choice(CITIES), country='Bangladesh', occupation='Traveller',
+                languages=', '.join(rng.sample(LANGUAGES, 2)), travel_style=rng.choice(TRAVEL_STYLES),
+                interests=', '.join(rng.sample(INTERESTS, 3)),
+                dream_destinations=', '.join(rng.sample(DESTINATIONS, 3)),
+                verification_status='verified', submitted_at=self.now, verified_at=self.now,
+            )
+            for user_id in user_ids
+        ])
+        return user_ids
+
+    def plans(self, user_ids, count, interests_per_plan, trip_ratio):
+        rng, today = self.rng, timezone.localdate()
+        plans = []
+        for _ in range(count):
+            destination = rng.choice(DESTINATIONS)
+            start = today + timedelta(days=rng.randint(-60, 180))
+            status = rng.choices(['open', 'closed', 'finalized', 'approved'], weights=[5, 2, 2, 1])[0]
+            plans.append(TravelPlan(
+                user_id=rng.choice(user_ids), destination=destination,
+                destination_key=normalize_destination(destination),
+                start_date=start, end_date=start + timedelta(days=rng.randint(1, 13)),
+                purpose=rng.choice(TravelPlan.PURPOSE_CHOICES)[0],
+                budget_range=rng.choice(TravelPlan.BUDGET_CHOICES)[0],
+                description=f'Looking for travel buddies for {destination}.',
+                max_participants=rng.randint(2, 5), status=status,
+                join_deadline=self.now + timedelta(minutes=rng.randint(-600, 600)),
+                payment_deadline=self.now + timedelta(days=2) if status == 'finalized' else None,
+                final_cost_per_person=Decimal(rng.randrange(5000, 40000, 500)),
+                platform_commission=Decimal(500),
+            ))
+        self._insert(TravelPlan, plans)
+        plans = list(TravelPlan.objects.filter(user__username__startswith=self.prefix).order_by('plan_id'))
+
+        self._insert(TravelPlanDestinationToken, [
+            TravelPlanDestinationToken(plan_id=plan.plan_id, token=token)
+            for plan in plans for token in destination_tokens(plan.destination)
+        ], name='destination tokens')
+
+        interests = []
+        for plan in plans:
+            fans = rng.sample(user_ids, min(len(user_ids), rng.randint(0, 2 * interests_per_plan)))
+            fans = [user_id for user_id in fans if user_id != plan.user_id]
+            agreed = fans[:rng.randint(0, len(fans))] if plan.status in ('finalized', 'approved') else []
+            plan.interest_count, plan.agreed_count = len(fans), len(agreed)
+            interests += [
+                TravelPlanInterest(plan_id=plan.plan_id, user_id=user_id, agreed=user_id in agreed,
+                                   agreed_at=self.now if user_id in agreed else None)
+                for user_id in fans
+            ]
+        self._insert(TravelPlanInterest, interests, name='interests')
+        TravelPlan.objects.bulk_update(plans, ['interest_count', 'agreed_count'], batch_size=self.batch_size)
+
+        candidates = [plan for plan in plans if plan.status in ('finalized', 'approved')]
+        self.trips(user_ids, rng.sample(candidates, int(len(candidates) * trip_ratio)))
+
+    def trips(self, user_ids, plans):
+        rng = self.rng
+        trips, riders = [], []
+        for plan in plans:
+            departure = timezone.make_aware(datetime.combine(plan.start_date, datetime.min.time())) + timedelta(hours=9)
+            seats = rng.sample(user_ids, min(len(user_ids), rng.randint(1, plan.max_participants)))
+            past = departure < self.now
+            trip = OrganizedTrip(
+                travel_plan=plan, trip_name=f"{plan.destination} - {plan.start_date:%b %d}",
+                destination=plan.destination, departure_time=departure,
+                return_time=departure + timedelta(days=(plan.end_date - plan.start_date).days, hours=9),
+                total_participants=len(seats), base_cost=plan.final_cost_per_person * len(seats),
+                profit_margin=10, trip_status='completed' if past else rng.choice(['open', 'confirmed']),
+            )
+            trip.apply_plan_details()
+            trips.append(trip)
+            riders.append(seats)
+        self._insert(OrganizedTrip, trips)
+        trips = dict(OrganizedTrip.objects.filter(
+            travel_plan__user__username__startswith=self.prefix
+        ).values_list('travel_plan_id', 'trip_id'))
+
+        participants, payments = [], []
+        for plan, seats in zip(plans, riders):
+            trip_id = trips[plan.plan_id]
+            for user_id in seats:
+                paid = rng.random() < 0.8
+                participants.append(TripParticipant(
+                    trip_id=trip_id, user_id=user_id, payment_status='paid' if paid else 'pending',
+                    amount_paid=plan.final_cost_per_person if paid else 0,
+                    commission_charged=plan.platform_commission,
+                    hold_expires_at=None if paid else self.now + timedelta(minutes=30),
+                ))
+                payments.append(Payment(
+                    trip_id=trip_id, user_id=user_id, total_amount=plan.final_cost_per_person,
+                    platform_commission=plan.platform_commission,
+                    payment_method=rng.choice(Payment.PAYMENT_METHOD_CHOICES)[0],
+                    payment_status='completed' if paid else rng.choice(['pending', 'failed']),
+                    transaction_id=f'SEED-{uuid.UUID(int=rng.getrandbits(128)).hex[:20].upper()}',
+                ))
+        self._insert(TripParticipant, participants, name='trip participants')
+        self._insert(Payment, payments)
+
+    def connections(self, user_ids, per_user):
+        rng, pairs = self.rng, set()
+        for user_id in user_ids:
+            for other in rng.sample(user_ids, min(len(user_ids), per_user)):
+                if other != user_id and (other, user_id) not in pairs:
+                    pairs.add((user_id, other))
+        self._insert(UserConnection, [
+            UserConnection(from_user_id=a, to_user_id=b, status=rng.choice(['connected', 'connected', 'pending']))
+            for a, b in pairs
+        ], name='connections')
+
+    def conversations(self, user_ids, per_user, messages_each):
+        rng = self.rng
+        pairs = [
+            (user_id, rng.choice(user_ids)) for user_id in user_ids for _ in range(per_user)
+        ]
+        pairs = [(a, b) for a, b in pairs if a != b]
+        conversations = self._insert(Conversation, [Conversation() for _ in pairs])
+        if conversations and conversations[0].pk is None:
+            # Backends that cannot return ids from bulk inserts
+            conversations = list(Conversation.objects.order_by('-id')[:len(pairs)])[::-1]
+
+        memberships, messages = {}, []
+        for conversation, (a, b) in zip(conversations, pairs):
+            memberships[conversation.pk, a] = ConversationParticipant(conversation=conversation, user_id=a)
+            memberships[conversation.pk, b] = ConversationParticipant(conversation=conversation, user_id=b)
+            for n in range(messages_each):
+                sender, recipient = (a, b) if rng.random() < 0.5 else (b, a)
+                is_read = n < messages_each - 3 or rng.random() < 0.5
+                if not is_read:
+                    memberships[conversation.pk, recipient].unread_count += 1
+                messages.append(Message(
+                    conversation=conversation, sender_id=sender, recipient_id=recipient,
+                    content=rng.choice(MESSAGES), is_read=is_read, seen_at=self.now if is_read else None,
+                ))
+        self._insert(ConversationParticipant, list(memberships.values()), name='conversation memberships')
+        self._insert(Message, messages)
+
+        # What the Message post_save signal would have recorded
+        if not conversations:
+            return
+        latest = list(
+            Message.objects.filter(conversation__gte=conversations[0].pk, conversation__lte=conversations[-1].pk)
+            .values('conversation').annotate(last=Max('id')).values_list('last', flat=True)
+        )
+        summaries = []
+        for start in range(0, len(latest), self.batch_size):
+            for message in Message.objects.filter(id__in=latest[start:start + self.batch_size]):
+                summaries.append(Conversation(
+                    pk=message.conversation_id, last_message_id=message.pk,
+                    last_message_snippet=(message.content or '')[:120], last_message_type=message.message_type,
+                    last_message_at=message.timestamp, last_message_sender_id=message.sender_id,
+                ))
+        Conversation.objects.bulk_update(summaries, [
+            'last_message', 'last_message_snippet', 'last_message_type', 'last_message_at', 'last_message_sender',
+        ], batch_size=self.batch_size)
+
+    def notifications(self, user_ids, per_user):
+        rng = self.rng
+        self._insert(Notification, [
+            Notification(
+                recipient_id=user_id, sender_id=rng.choice(user_ids), notification_type=rng.choice(NOTIFICATION_TYPES),
+                message='You have a new update on SheTrip.', is_read=rng.random() < 0.7,
+            )
+            for user_id in user_ids for _ in range(per_user)
+        ])
+
+    def sos_alerts(self, user_ids, count):
+        rng = self.rng
+        self._insert(SOSAlert, [
+            SOSAlert(
+                user_id=rng.choice(user_ids), alert_type=rng.choice(SOS_TYPES),
+                location_latitude=Decimal(f'{rng.uniform(20.7, 26.6):.6f}'),
+                location_longitude=Decimal(f'{rng.uniform(88.0, 92.7):.6f}'),
+                location_address=rng.choice(DESTINATIONS), description='Seeded alert',
+                status=rng.choice(['active', 'resolved', 'resolved', 'false_alarm']),
+            )
+            for _ in range(count)
+        ], name='SOS alerts')
+
+
+def seed(seed=0, batch_size=1000, prefix='seed', password=None, log=None, **sizes):
+    """
+    Generate one population; ``sizes`` override ``DEFAULTS``. Returns
+    ``{'prefix', 'user_ids', 'counts', 'seconds'}``.
+    """
+    sizes = {**DEFAULTS, **sizes}
+    started = time.perf_counter()
+    seeder = _Seeder(random.Random(seed), batch_size, prefix, password, log)
+
+    user_ids = seeder.users(sizes['users'])
+    seeder.plans(user_ids, sizes['plans'], sizes['interests_per_plan'], sizes['trip_ratio'])
+    seeder.connections(user_ids, sizes['connections_per_user'])
+    seeder.conversations(user_ids, sizes['conversations_per_user'], sizes['messages_per_conversation'])
+    seeder.notifications(user_ids, sizes['notifications_per_user'])
+    seeder.sos_alerts(user_ids, sizes['sos_alerts'])
+    return {
+        'prefix': seeder.prefix,
+        'user_ids': user_ids,
+        'counts': seeder.counts,
+        'seconds': time.perf_counter() - started,
+    }
@@ -98,6 +98,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shetrip.middleware.LazySessionRefreshMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -123,6 +124,8 @@ REST_FRAMEWORK = {
 SSLCOMMERZ_STORE_ID = 'testbox'  
 SSLCOMMERZ_STORE_PASSWORD = 'qwerty'  
 SSLCOMMERZ_IS_SANDBOX = True
+# Overrides the sandbox/live host, e.g. a local `manage.py run_fake_sslcommerz`
+SSLCOMMERZ_BASE_URL = os.environ.get('SSLCOMMERZ_BASE_URL', '')
 
 # JWT Settings - Secure & Auto-Refresh
 SIMPLE_JWT = {
@@ -240,6 +243,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'shetrip.wsgi.application'
+ASGI_APPLICATION = 'shetrip.asgi.application'
 
 
 # Database
@@ -320,23 +324,44 @@ EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'  # Gmail SMTP server
 EMAIL_PORT = 587  # Gmail SMTP port
 EMAIL_USE_TLS = True
+EMAIL_TIMEOUT = 10  # Seconds; without it a hung SMTP server blocks the sender indefinitely
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')  # Your Gmail address
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')  # Your app-specific password
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')  # Your default from email
 
 # Cache Settings - Prevent caching of authenticated pages
 CACHE_MIDDLEWARE_SECONDS = 0  # Don't cache anything
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Sidebar counters, verification state and cached sessions must be shared by
+# every web worker and the background processes that invalidate them, so
+# deployments point REDIS_URL at a shared Redis. Without it each process gets
+# its own local-memory cache, which is only correct for a single process
+# (development and tests).
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
     }
-}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
+    }
+
+# Chat real-time delivery (chat.realtime). The in-process broker only reaches
+# sockets in the same worker, so with REDIS_URL events go through Redis pub/sub.
+CHAT_REALTIME_BROKER = 'chat.realtime.RedisBroker' if REDIS_URL else 'chat.realtime.InProcessBroker'
 
 # Session Settings
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'  # Reads hit the cache, writes go to both
 SESSION_COOKIE_AGE = 1209600  # 2 weeks
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
-SESSION_SAVE_EVERY_REQUEST = True  # Update session on every request
+SESSION_SAVE_EVERY_REQUEST = False  # LazySessionRefreshMiddleware extends expiry instead
+SESSION_REFRESH_THRESHOLD = 60 * 60 * 24 * 7  # Re-save once less than a week remains
 SESSION_COOKIE_HTTPONLY = True  # Prevent JavaScript access to session cookie
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
 SESSION_COOKIE_SAMESITE = 'Lax'
@@ -0,0 +1,198 @@
+import re
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.models import ConversationParticipant, Message
+from trips import interests
+from trips.models import OrganizedTrip, Payment, TravelPlan, TripParticipant
+from users.models import Notification, UserConnection
+
+from . import benchmark, scale
+from .middleware import LazySessionRefreshMiddleware
+from .query_budgets import BUDGETS, QueryRecorder
+
+
+# (label, table, index expected to serve it, queryset as the app issues it)
+HOT_QUERIES = [
+    ('plans past their join window', 'trips_travelplan', 'trips_plan_join_due_idx',
+     lambda t: TravelPlan.objects.filter(status='open', join_deadline__lt=t.now)),
+    ('plans past their payment deadline', 'trips_travelplan', 'trips_plan_pay_due_idx',
+     lambda t: TravelPlan.objects.filter(status='finalized', payment_deadline__lt=t.now)),
+    ('upcoming active plans', 'trips_travelplan', 'trips_plan_active_start_idx',
+     lambda t: TravelPlan.objects.filter(is_active=True, start_date__gte=t.now.date()).order_by('start_date')),
+    ('unread message count', 'chat_message', 'chat_msg_unread_idx',
+     lambda t: Message.objects.filter(recipient=t.user, is_read=False).order_by()),
+    ('conversation history', 'chat_message', 'chat_msg_history_idx',
+     lambda t: Message.objects.filter(conversation_id=1).order_by('-timestamp', '-id')),
+    ('notification list', 'users_notification', 'users_notif_recent_idx',
+     lambda t: Notification.objects.filter(recipient=t.user)),
+    ('unread notification count', 'users_notification', 'users_notif_unread_idx',
+     lambda t: Notification.objects.filter(recipient=t.user, is_read=False).order_by()),
+    ('payment history', 'trips_payment', 'trips_pay_user_status_idx',
+     lambda t: Payment.objects.filter(user=t.user, payment_status='completed')),
+    ('paid participants of a trip', 'trips_tripparticipant', 'trips_part_trip_status_idx',
+     lambda t: TripParticipant.objects.filter(trip_id=1, payment_status='paid')),
+    ('connection requests received', 'users_userconnection', 'users_conn_incoming_idx',
+     lambda t: UserConnection.objects.filter(to_user=t.user, status='pending')),
+    ('login by email', 'auth_user', 'users_auth_user_email_idx',
+     lambda t: User.objects.filter(email='someone@example.com')),
+]
+
+FULL_SCAN = {
+    'sqlite': r'\bSCAN {table}\b',
+    'postgresql': r'\bSeq Scan on {table}\b',
+}
+
+
+def explain(queryset):
+    """The query plan, with sequential scans discouraged on Postgres so tiny test tables still show index use"""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN each hot query and fail if it falls back to scanning the whole table"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('planner')
+        cls.now = timezone.now()
+
+    def test_hot_queries_use_their_indexes(self):
+        if connection.vendor not in FULL_SCAN:
+            self.skipTest(f'No query plan rules for {connection.vendor}')
+        for label, table, index, build in HOT_QUERIES:
+            with self.subTest(label):
+                plan = explain(build(self))
+                self.assertIsNone(
+                    re.search(FULL_SCAN[connection.vendor].format(table=table), plan),
+                    f'{label} scans {table}:\n{plan}',
+                )
+                self.assertIn(index, plan, f'{label} does not use {index}:\n{plan}')
+
+
+class SeedScaleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.report = scale.seed(
+            users=15, plans=40, trip_ratio=0.5, connections_per_user=2, conversations_per_user=2,
+            messages_per_conversation=4, notifications_per_user=2, sos_alerts=3,
+        )
+
+    def test_denormalized_columns_match_the_rows(self):
+        self.assertEqual(interests.rebuild_counters(), 0)
+        for trip_id, seats in TripParticipant.objects.values_list('trip').annotate(seats=Count('pk')):
+            self.assertEqual(OrganizedTrip.objects.get(pk=trip_id).total_participants, seats)
+        memberships = ConversationParticipant.objects.annotate(unread=Count(
+            'conversation__messages', filter=Q(conversation__messages__recipient=F('user'), conversation__messages__is_read=False),
+        ))
+        for membership in memberships:
+            self.assertEqual(membership.unread_count, membership.unread)
+        self.assertFalse(Message.objects.filter(conversation__last_message__isnull=True).exists())
+
+    def test_benchmark_renders_every_view(self):
+        report = benchmark.run(benchmark.busiest_user(), repeat=2, warmup=1)
+
+        self.assertEqual(report['rows']['users'], 15)
+        for name, result in report['views'].items():
+            self.assertEqual(result['status'], 200, name)
+            self.assertGreater(result['queries'], 0, name)
+
+
+class QueryBudgetTests(TestCase):
+    """Render every budgeted view against seeded data and hold it to its budget"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # More rows per list than any query budget, so an N+1 cannot hide
+        scale.seed(
+            users=30, plans=60, trip_ratio=1, connections_per_user=6, conversations_per_user=4,
+            messages_per_conversation=3, notifications_per_user=12, sos_alerts=40,
+        )
+        cls.user = benchmark.busiest_user()
+
+    def test_views_stay_within_budget(self):
+        self.client.force_login(self.user)
+        for name, budget in BUDGETS.items():
+            with self.subTest(name):
+                url = reverse(name)
+                self.client.get(url)  # Warm the per-user caches
+                with QueryRecorder() as queries:
+                    started = time.perf_counter()
+                    response = self.client.get(url)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+
+                self.assertEqual(response.status_code, 200)
+                summary = (
+                    f'{name}: {len(queries)} queries (budget {budget["queries"]}), '
+                    f'{elapsed_ms:.0f} ms (budget {budget["ms"]})\n{queries.report()}'
+                )
+                self.assertLessEqual(len(queries), budget['queries'], summary)
+                self.assertLessEqual(elapsed_ms, budget['ms'], summary)
+
+    def test_report_points_at_the_repeating_line(self):
+        with QueryRecorder() as queries:
+            for user in User.objects.all()[:3]:
+                UserConnection.objects.filter(to_user=user).exists()
+
+        (sql, count, origins), = queries.duplicates()
+        self.assertEqual(count, 3)
+        self.assertIn('users_userconnection', sql)
+        self.assertIn('shetrip/tests.py', next(iter(origins)))
+        self.assertIn('test_report_points_at_the_repeating_line', queries.report())
+
+
+class LazySessionRefreshTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('sessioned', is_staff=True)
+        self.client.force_login(self.user)
+
+    def _refreshed_at(self):
+        return SessionStore(session_key=self.client.session.session_key).load()[LazySessionRefreshMiddleware.TIMESTAMP_KEY]
+
+    def _backdate(self, seconds):
+        session = self.client.session
+        session[LazySessionRefreshMiddleware.TIMESTAMP_KEY] = int(time.time()) - seconds
+        session.save()
+        return session[LazySessionRefreshMiddleware.TIMESTAMP_KEY]
+
+    def _session_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('dashboard'))
+        return [q['sql'] for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+    def test_fresh_session_is_not_written(self):
+        self.client.get(reverse('dashboard'))  # Settles anything the login left to save
+        stamped = self._refreshed_at()
+
+        self.assertEqual(self._session_writes(), [])
+        self.assertEqual(self._refreshed_at(), stamped)
+
+    def test_session_past_the_threshold_is_extended(self):
+        age = settings.SESSION_COOKIE_AGE - settings.SESSION_REFRESH_THRESHOLD + 60
+        stale = self._backdate(age)
+
+        self.assertTrue(self._session_writes())
+        self.assertGreater(self._refreshed_at(), stale)
+        self.assertEqual(self._session_writes(), [])  # Only once
+
+    def test_session_inside_the_threshold_is_left_alone(self):
+        age = settings.SESSION_COOKIE_AGE - settings.SESSION_REFRESH_THRESHOLD - 60
+        recent = self._backdate(age)
+
+        self.assertEqual(self._session_writes(), [])
+        self.assertEqual(self._refreshed_at(), recent)
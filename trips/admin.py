@@ -3,12 +3,13 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from .models import (
     TravelPlan, Driver, OrganizedTrip, TripParticipant,
-    TravelMatch, Payment, Revenue, TravelPlanInterest
+    TravelMatch, Payment, Revenue, TravelPlanInterest, TripWaitlistEntry
 )
+from .matching import expire_plan_matches, refresh_plan_matches
 
 @admin.register(TravelPlan)
 class TravelPlanAdmin(admin.ModelAdmin):
-    list_display = ['destination', 'user', 'start_date', 'end_date', 'status', 'is_active', 'join_deadline', 'admin_warning', 'get_combined_transport']
+    list_display = ['destination', 'user', 'start_date', 'end_date', 'status', 'is_active', 'interest_count', 'agreed_count', 'join_deadline', 'admin_warning', 'get_combined_transport']
     list_filter = ['purpose', 'budget_range', 'is_active', 'start_date', 'status']
     search_fields = ['destination', 'user__username', 'description']
     date_hierarchy = 'start_date'
@@ -46,6 +47,12 @@ class TravelPlanAdmin(admin.ModelAdmin):
     )
     
     actions = ['mark_as_finalized', 'reject_plan', 'close_plan']  
+
+    def save_model(self, request, obj, form, change):
+        """Keep the plan's matches in step with admin edits such as deactivation"""
+        super().save_model(request, obj, form, change)
+        refresh_plan_matches(obj)
+
     def close_plan(self, request, queryset):
         """Admin can manually close open plans"""
         updated = queryset.filter(status='open').update(status='closed')
@@ -54,7 +61,9 @@ class TravelPlanAdmin(admin.ModelAdmin):
 
     def reject_plan(self, request, queryset):
         """Admin can reject any plan at any time"""
+        plan_ids = list(queryset.values_list('plan_id', flat=True))
         updated = queryset.update(status='rejected')
+        expire_plan_matches(plan_ids)
         self.message_user(request, f'{updated} plans have been rejected.')
     reject_plan.short_description = "Reject selected plans"
 
@@ -136,6 +145,12 @@ class TripParticipantAdmin(admin.ModelAdmin):
     )
     readonly_fields = ['join_date']
 
+@admin.register(TripWaitlistEntry)
+class TripWaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ['trip', 'user', 'created_at']
+    search_fields = ['user__username', 'trip__trip_name']
+    raw_id_fields = ['trip', 'user']
+
 @admin.register(TravelMatch)
 class TravelMatchAdmin(admin.ModelAdmin):
     list_display = ['travel_plan_1', 'travel_plan_2', 'compatibility_score', 'match_status', 'created_at']
@@ -145,7 +160,7 @@ class TravelMatchAdmin(admin.ModelAdmin):
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ['transaction_id', 'user', 'trip', 'total_amount', 'payment_method', 'payment_status', 'payment_date']
-    list_filter = ['payment_method', 'payment_status', 'refund_status']
+    list_filter = ['payment_method', 'payment_status', 'refund_status', 'needs_refund']
     search_fields = ['transaction_id', 'user__username', 'trip__trip_name']
     date_hierarchy = 'payment_date'
 
@@ -0,0 +1,66 @@
+"""Interest in travel plans and the plan's denormalized interest counters.
+
+``TravelPlan.interest_count`` and ``agreed_count`` mirror the plan's
+TravelPlanInterest rows so list pages can show and sort by them without a
+COUNT per plan. They only change here, in the same transaction as the
+interest row and through ``F()`` increments, so concurrent requests never
+lose an update. ``rebuild_counters`` repairs any drift (e.g. interests
+deleted in the admin) from a single GROUP BY.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import TravelPlan, TravelPlanInterest
+
+
+def _bump(plan_id, interests=0, agreed=0):
+    TravelPlan.objects.filter(pk=plan_id).update(
+        interest_count=F('interest_count') + interests,
+        agreed_count=F('agreed_count') + agreed,
+    )
+
+
+def express(plan, user):
+    """Record ``user``'s interest in ``plan``; returns ``(interest, created)``"""
+    with transaction.atomic():
+        interest, created = TravelPlanInterest.objects.get_or_create(plan=plan, user=user)
+        if created:
+            _bump(plan.pk, interests=1)
+    return interest, created
+
+
+def withdraw(interest):
+    """Delete the interest; returns False if it was already gone"""
+    with transaction.atomic():
+        deleted, _ = TravelPlanInterest.objects.filter(pk=interest.pk).delete()
+        if deleted:
+            _bump(interest.plan_id, interests=-1, agreed=-1 if interest.agreed else 0)
+    return bool(deleted)
+
+
+def agree(interest):
+    """Mark the interest as agreed to the finalized plan, counting it once"""
+    now = timezone.now()
+    with transaction.atomic():
+        if TravelPlanInterest.objects.filter(pk=interest.pk, agreed=False).update(agreed=True, agreed_at=now):
+            _bump(interest.plan_id, agreed=1)
+    interest.agreed, interest.agreed_at = True, interest.agreed_at or now
+
+
+def rebuild_counters():
+    """Recount every plan's interests in one GROUP BY and fix the plans that drifted; returns how many"""
+    counts = {
+        row['plan_id']: (row['interests'], row['agreed'])
+        for row in TravelPlanInterest.objects.order_by().values('plan_id').annotate(
+            interests=Count('id'), agreed=Count('id', filter=Q(agreed=True)),
+        )
+    }
+    stale = []
+    for plan in TravelPlan.objects.order_by().only('plan_id', 'interest_count', 'agreed_count').iterator(2000):
+        expected = counts.get(plan.pk, (0, 0))
+        if (plan.interest_count, plan.agreed_count) != expected:
+            plan.interest_count, plan.agreed_count = expected
+            stale.append(plan)
+    TravelPlan.objects.bulk_update(stale, ['interest_count', 'agreed_count'], batch_size=1000)
+    return len(stale)
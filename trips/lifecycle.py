@@ -0,0 +1,169 @@
+"""Set-based TravelPlan / OrganizedTrip lifecycle transitions.
+
+Each step issues a fixed number of queries regardless of how many plans or
+trips it touches. ``plan_ids`` / ``trip_ids`` narrow a step to specific rows.
+"""
+import operator
+from collections import defaultdict
+from datetime import datetime, time
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from users import counters
+
+from .matching import expire_plan_matches
+from .models import TravelPlan, OrganizedTrip, TripParticipant, TravelPlanInterest, Payment, LifecycleDeadline
+
+
+MIN_PAID_PARTICIPANTS = 2
+
+# JobLease held by whichever of auto_update_trips and run_lifecycle_scheduler
+# is running, so the two never settle the same plans at once
+LEASE_NAME = 'trip_lifecycle'
+
+
+def _scoped(queryset, ids, field='pk'):
+    return queryset if ids is None else queryset.filter(**{f'{field}__in': ids})
+
+
+def close_expired_plans(now, plan_ids=None):
+    """Close open plans whose 5-minute join window has passed"""
+    plans = TravelPlan.objects.filter(status='open', join_deadline__lt=now)
+    return _scoped(plans, plan_ids).update(status='closed')
+
+
+def paid_users_by_plan(plans):
+    """Map plan_id -> user ids that agreed to the plan and paid after it was finalized.
+
+    A single query: agreed interests filtered by an EXISTS over completed payments.
+    """
+    completed_payments = Payment.objects.filter(
+        user_id=OuterRef('user_id'),
+        payment_status='completed',
+        payment_date__gte=OuterRef('plan__updated_at'),
+    )
+    rows = TravelPlanInterest.objects.filter(
+        plan__in=plans, agreed=True
+    ).filter(Exists(completed_payments)).values_list('plan_id', 'user_id')
+
+    paid = defaultdict(list)
+    for plan_id, user_id in rows:
+        paid[plan_id].append(user_id)
+    return paid
+
+
+def _trip_for_plan(plan, paid_count):
+    departure = timezone.make_aware(datetime.combine(plan.start_date, time(9, 0)))
+    return_time = timezone.make_aware(datetime.combine(plan.end_date, time(18, 0)))
+    trip = OrganizedTrip(
+        travel_plan=plan,
+        trip_name=f"{plan.destination} - {plan.start_date.strftime('%b %d')}",
+        destination=plan.destination,
+        departure_time=departure,
+        return_time=return_time,
+        total_participants=paid_count,
+        profit_margin=plan.profit_margin or 0,
+        trip_status='confirmed',
+        base_cost=(plan.final_cost_per_person or 0) * paid_count,
+    )
+    trip.apply_plan_details()
+    return trip
+
+
+def settle_finalized_plans(now, plan_ids=None):
+    """Reject or approve finalized plans based on how many participants paid.
+
+    Plans past their payment deadline with fewer than two payers are rejected.
+    Plans that filled up, or passed the deadline with at least two payers, get
+    an OrganizedTrip with paid participants and are approved.
+
+    Returns ``(rejected, trips_created, participants_created)``.
+    """
+    plans = list(_scoped(
+        TravelPlan.objects.filter(status='finalized', organized_trip__isnull=True), plan_ids
+    ))
+    if not plans:
+        return 0, 0, 0
+
+    paid = paid_users_by_plan(plans)
+
+    def past_deadline(plan):
+        return plan.payment_deadline is not None and plan.payment_deadline < now
+
+    rejected_ids = [
+        plan.plan_id for plan in plans
+        if past_deadline(plan) and len(paid[plan.plan_id]) < MIN_PAID_PARTICIPANTS
+    ]
+    ready = [
+        plan for plan in plans
+        if len(paid[plan.plan_id]) >= plan.max_participants
+        or (past_deadline(plan) and len(paid[plan.plan_id]) >= MIN_PAID_PARTICIPANTS)
+    ]
+
+    with transaction.atomic():
+        rejected = TravelPlan.objects.filter(pk__in=rejected_ids).update(status='rejected')
+
+        trips = OrganizedTrip.objects.bulk_create(
+            [_trip_for_plan(plan, len(paid[plan.plan_id])) for plan in ready]
+        )
+
+        # Payments made before the trips existed are linked to them now, in
+        # one UPDATE; a payment that fits several plans goes to the first
+        links = [
+            (Q(user_id__in=paid[plan.plan_id], payment_date__gte=plan.updated_at), trip.pk)
+            for plan, trip in zip(ready, trips)
+        ]
+        if links:
+            Payment.objects.filter(
+                reduce(operator.or_, (condition for condition, _ in links)),
+                payment_status='completed',
+                trip__isnull=True,
+            ).update(trip=Case(*(When(condition, then=Value(trip_id)) for condition, trip_id in links)))
+
+        participants = TripParticipant.objects.bulk_create(
+            [
+                TripParticipant(
+                    trip=trip,
+                    user_id=user_id,
+                    payment_status='paid',
+                    amount_paid=plan.final_cost_per_person or 0,
+                    commission_charged=plan.platform_commission or 0,
+                )
+                for plan, trip in zip(ready, trips)
+                for user_id in paid[plan.plan_id]
+            ],
+            ignore_conflicts=True,
+        )
+
+        # bulk_create skips the post_save counter signals
+        counters.invalidate([p.user_id for p in participants], 'total_trips_count')
+
+        TravelPlan.objects.filter(pk__in=[plan.plan_id for plan in ready]).update(status='approved')
+        expire_plan_matches(rejected_ids + [plan.plan_id for plan in ready])
+
+        # bulk_create skips post_save, so hand the new trips' dates to the scheduler here
+        LifecycleDeadline.record_upcoming(
+            (kind, trip.trip_id, due_at)
+            for trip in trips
+            for kind, due_at in (('departure', trip.departure_time), ('return', trip.return_time))
+        )
+
+    return rejected, len(trips), len(participants)
+
+
+def advance_trip_statuses(now, trip_ids=None):
+    """Move confirmed trips to ongoing, and confirmed or ongoing trips to completed, by their dates.
+
+    Returns ``(ongoing, completed)``.
+    """
+    trips = _scoped(OrganizedTrip.objects.all(), trip_ids)
+    completed = trips.filter(
+        trip_status__in=['confirmed', 'ongoing'], return_time__lte=now
+    ).update(trip_status='completed')
+    ongoing = trips.filter(
+        trip_status='confirmed', departure_time__lte=now, return_time__gt=now
+    ).update(trip_status='ongoing')
+    return ongoing, completed
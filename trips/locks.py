@@ -0,0 +1,60 @@
+"""Database-backed leases for background jobs.
+
+A lease is a JobLock row taken with a conditional UPDATE, so it works across
+processes and hosts on both SQLite and PostgreSQL. Expired leases can be
+taken over, which lets a crashed holder recover without manual cleanup.
+"""
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import JobLock
+
+
+class JobLease:
+    """Exclusive, renewable lease on a named job"""
+
+    def __init__(self, name, ttl=timedelta(minutes=5)):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+
+    def acquire(self):
+        now = timezone.now()
+        try:
+            JobLock.objects.get_or_create(name=self.name, defaults={'expires_at': now})
+        except IntegrityError:
+            pass  # Another process created the row first; the UPDATE below decides
+        taken = JobLock.objects.filter(
+            Q(expires_at__lte=now) | Q(owner=self.owner), name=self.name
+        ).update(owner=self.owner, expires_at=now + self.ttl)
+        self.held = taken == 1
+        return self.held
+
+    def renew(self):
+        """Extend the lease; returns False if it was lost to another holder"""
+        renewed = JobLock.objects.filter(name=self.name, owner=self.owner).update(
+            expires_at=timezone.now() + self.ttl
+        )
+        self.held = renewed == 1
+        return self.held
+
+    def release(self):
+        if self.held:
+            JobLock.objects.filter(name=self.name, owner=self.owner).update(
+                owner='', expires_at=timezone.now()
+            )
+            self.held = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -1,159 +1,68 @@
+import time
+
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from datetime import timedelta
 
-from trips.models import TravelPlan, OrganizedTrip, TripParticipant, TravelPlanInterest, Payment
+from trips.lifecycle import LEASE_NAME, close_expired_plans, settle_finalized_plans, advance_trip_statuses
+from trips.locks import JobLease
+from trips.models import LifecycleDeadline
+from trips.seats import release_expired_holds
 
 
 class Command(BaseCommand):
     help = "Auto-close TravelPlans after 5 minutes, approve when 2 paid, and update OrganizedTrip statuses."
 
     def handle(self, *args, **options):
+        lease = JobLease(LEASE_NAME)
+        if not lease.acquire():
+            self.stdout.write(self.style.WARNING(
+                'Another auto_update_trips run or the lifecycle scheduler holds the lease; skipping.'
+            ))
+            return
+
+        try:
+            self._run()
+        finally:
+            lease.release()
+
+    def _run(self):
         now = timezone.now()
-        
-        self.stdout.write(self.style.NOTICE(f'\n=== AUTO UPDATE STARTED at {now} ==='))
+        started = time.perf_counter()
+        self.stdout.write(self.style.NOTICE(f'=== AUTO UPDATE STARTED at {now} ==='))
 
         # 1. Close open plans past join_deadline (5-minute window)
-        self.stdout.write(self.style.NOTICE('\n[STEP 1] Checking for expired open plans...'))
-        
-        open_plans = TravelPlan.objects.filter(status='open', join_deadline__lt=now)
-        self.stdout.write(f'Found {open_plans.count()} plans past their join deadline')
-        
-        for plan in open_plans:
-            self.stdout.write(f'  - Plan {plan.plan_id} ({plan.destination}): join_deadline={plan.join_deadline}, now={now}')
-        
-        closed_count = open_plans.update(status='closed')
-        if closed_count > 0:
-            self.stdout.write(self.style.SUCCESS(f'✓ {closed_count} plans auto-closed after 5-minute join window'))
-        else:
-            self.stdout.write(self.style.WARNING('No plans to close'))
+        self._timed('STEP 1', 'plans closed after 5-minute join window', close_expired_plans, now)
+
+        # 2 + 3. Reject underpaid finalized plans, create OrganizedTrips for paid ones
+        rejected, trips_created, participants_created = self._timed(
+            'STEP 2-3', 'finalized plans settled', settle_finalized_plans, now,
+            count=lambda result: sum(result[:2]),
+        )
+        self.stdout.write(
+            f'  {rejected} rejected (insufficient payments), '
+            f'{trips_created} OrganizedTrips created with {participants_created} participants'
+        )
+
+        # 4. Move trips to ongoing/completed based on dates
+        ongoing, completed = self._timed(
+            'STEP 4', 'trips advanced', advance_trip_statuses, now, count=sum,
+        )
+        self.stdout.write(f'  {ongoing} moved to ongoing, {completed} moved to completed')
+
+        # 5. Free seats held by participants who never paid
+        self._timed('STEP 5', 'expired seat holds released', release_expired_holds, now)
 
-        # 2. Reject finalized plans where payment deadline passed with insufficient payments
-        self.stdout.write(self.style.NOTICE('\n[STEP 2] Checking finalized plans for rejection...'))
-        
-        for plan in TravelPlan.objects.filter(status='finalized', payment_deadline__lt=now, organized_trip__isnull=True):
-            # Count users who agreed AND paid
-            agreed_users = TravelPlanInterest.objects.filter(plan=plan, agreed=True)
-            paid_count = 0
-            
-            for interest in agreed_users:
-                # Check if payment exists and is completed (payments made after plan finalization)
-                payment_exists = Payment.objects.filter(
-                    user=interest.user,
-                    payment_status='completed',
-                    payment_date__gte=plan.updated_at  # Only count payments after finalization
-                ).exists()
-                
-                if payment_exists:
-                    paid_count += 1
-            
-            if paid_count < 2:  # Less than 2 paid participants
-                plan.status = 'rejected'
-                plan.save(update_fields=['status'])
-                self.stdout.write(self.style.WARNING(f'✗ Plan {plan.plan_id} rejected - insufficient payments ({paid_count} < 2)'))
+        # Deadlines the scheduler never consumed (e.g. it is not deployed) are dropped once past
+        LifecycleDeadline.objects.filter(due_at__lt=now).delete()
 
-        # 3. AUTO-CREATE OrganizedTrip when conditions are met
-        self.stdout.write(self.style.NOTICE('\n[STEP 3] Checking finalized plans for OrganizedTrip creation...'))
-        
-        for plan in TravelPlan.objects.filter(status='finalized', organized_trip__isnull=True):
-            # Count users who agreed AND paid
-            agreed_users = TravelPlanInterest.objects.filter(plan=plan, agreed=True)
-            paid_count = 0
-            paid_users = []
-            
-            self.stdout.write(f'  - Plan {plan.plan_id}: {agreed_users.count()} agreed users')
-            
-            for interest in agreed_users:
-                # Check if this user has a completed payment (no trip filter since OrganizedTrip doesn't exist yet)
-                payment_exists = Payment.objects.filter(
-                    user=interest.user,
-                    payment_status='completed',
-                    payment_date__gte=plan.updated_at  # Only count payments made after plan was finalized
-                ).exists()
-                
-                if payment_exists:
-                    paid_count += 1
-                    paid_users.append(interest)
-                    self.stdout.write(f'    ✓ {interest.user.username} has paid')
-                else:
-                    self.stdout.write(f'    ✗ {interest.user.username} has NOT paid')
-            
-            # Create trip when: max participants paid OR payment deadline passed with at least 2 paid
-            should_create = (
-                paid_count >= plan.max_participants or  
-                (plan.payment_deadline and now > plan.payment_deadline and paid_count >= 2)
-            )
-            
-            self.stdout.write(f'  - Should create trip: {should_create} (paid: {paid_count}, max: {plan.max_participants})')
-            
-            if should_create:
-                # Create OrganizedTrip
-                organized_trip = OrganizedTrip.objects.create(
-                    travel_plan=plan,
-                    trip_name=f"{plan.destination} - {plan.start_date.strftime('%b %d')}",
-                    destination=plan.destination,
-                    departure_time=plan.start_date,
-                    return_time=plan.end_date,
-                    total_participants=paid_count,
-                    platform_commission=plan.platform_commission or 0,
-                    final_cost_per_person=plan.final_cost_per_person or 0,
-                    profit_margin=plan.profit_margin or 0,
-                    transportation_details=plan.transportation_details or '',
-                    accommodation_details=plan.accommodation_details or '',
-                    meal_arrangements=plan.meal_arrangements or '',
-                    itinerary=plan.itinerary or '',
-                    driver=plan.assigned_driver,
-                    driver_payment=plan.driver_payment or 0,
-                    trip_status='confirmed',
-                    base_cost=plan.final_cost_per_person * paid_count,
-                )
-                
-                # Update existing payments to link to OrganizedTrip
-                Payment.objects.filter(
-                    user__in=[interest.user for interest in paid_users],
-                    payment_status='completed',
-                    trip__isnull=True,
-                    payment_date__gte=plan.updated_at
-                ).update(trip=organized_trip)
-                
-                # Create TripParticipant entries for all users who paid
-                for interest in paid_users:
-                    TripParticipant.objects.get_or_create(
-                        trip=organized_trip,
-                        user=interest.user,
-                        defaults={
-                            'payment_status': 'paid',
-                            'amount_paid': plan.final_cost_per_person,
-                            'commission_charged': plan.platform_commission or 0,
-                        }
-                    )
-                
-                plan.status = 'approved'
-                plan.save(update_fields=['status'])
-                self.stdout.write(self.style.SUCCESS(f'✓ OrganizedTrip {organized_trip.trip_id} created for plan {plan.plan_id} with {paid_count} participants'))
-        
-        # 4. Move confirmed trips to ongoing/completed based on dates
-        self.stdout.write(self.style.NOTICE('\n[STEP 4] Updating trip statuses based on dates...'))
-        
-        ongoing_count = 0
-        completed_count = 0
-        
-        for trip in OrganizedTrip.objects.filter(trip_status='confirmed'):
-            if trip.departure_time <= now < trip.return_time:
-                trip.trip_status = 'ongoing'
-                trip.save(update_fields=['trip_status'])
-                ongoing_count += 1
-                self.stdout.write(f'  ✓ Trip {trip.trip_id} moved to ongoing')
-            elif trip.return_time <= now:
-                trip.trip_status = 'completed'
-                trip.save(update_fields=['trip_status'])
-                completed_count += 1
-                self.stdout.write(f'  ✓ Trip {trip.trip_id} moved to completed')
-        
-        if ongoing_count > 0:
-            self.stdout.write(self.style.SUCCESS(f'✓ {ongoing_count} trips moved to ongoing status'))
-        
-        if completed_count > 0:
-            self.stdout.write(self.style.SUCCESS(f'✓ {completed_count} trips moved to completed status'))
+        total_ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(self.style.SUCCESS(f'=== AUTO UPDATE COMPLETED in {total_ms:.1f} ms ==='))
 
-        self.stdout.write(self.style.SUCCESS('\n=== AUTO UPDATE COMPLETED SUCCESSFULLY ===\n'))
\ No newline at end of file
+    def _timed(self, step, label, func, *args, count=None):
+        """Run one step and report its row count and duration"""
+        step_started = time.perf_counter()
+        result = func(*args)
+        elapsed_ms = (time.perf_counter() - step_started) * 1000
+        rows = count(result) if count else result
+        self.stdout.write(f'[{step}] {rows} {label} ({elapsed_ms:.1f} ms)')
+        return result
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trips.interests import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recount TravelPlan.interest_count and agreed_count from TravelPlanInterest rows."
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        repaired = rebuild_counters()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {repaired} plan{'s' if repaired != 1 else ''} repaired in {elapsed:.2f}s"
+        ))
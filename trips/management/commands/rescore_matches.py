@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trips.matching import MIN_MATCH_SCORE, rescore_all_matches
+
+
+class Command(BaseCommand):
+    help = "Rescore all active TravelPlans against each other and bulk-upsert TravelMatch rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-score',
+            type=int,
+            default=MIN_MATCH_SCORE,
+            help=f'Minimum compatibility score to store a match (default: {MIN_MATCH_SCORE})',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = rescore_all_matches(min_score=options['min_score'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"Scored {stats['pairs_scored']} pairs across {stats['plans']} plans in {elapsed:.2f}s"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {stats['matches']} matches upserted, {stats['expired']} stale matches expired"
+        ))
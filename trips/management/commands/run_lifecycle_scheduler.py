@@ -0,0 +1,48 @@
+import signal
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from trips.lifecycle import LEASE_NAME
+from trips.locks import JobLease
+from trips.scheduler import LifecycleScheduler
+
+
+class Command(BaseCommand):
+    help = "Long-running scheduler that fires TravelPlan/OrganizedTrip transitions at their deadlines."
+
+    LEASE_RETRY_SECONDS = 5
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between checks for newly recorded deadlines (default: 1)')
+        parser.add_argument('--sweep-interval', type=float, default=300,
+                            help='Seconds between full safety-net sweeps (default: 300)')
+
+    def handle(self, *args, **options):
+        stopping = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopping.append(True))
+
+        # The lease is shared with auto_update_trips, which releases it when its
+        # run ends, so wait for it rather than exiting
+        lease = JobLease(LEASE_NAME, ttl=timedelta(seconds=30))
+        if not lease.acquire():
+            self.stdout.write(self.style.WARNING('Another lifecycle run holds the lease; waiting for it.'))
+            while not lease.acquire():
+                if stopping:
+                    return
+                time.sleep(self.LEASE_RETRY_SECONDS)
+
+        scheduler = LifecycleScheduler(
+            poll_interval=options['poll_interval'],
+            sweep_interval=options['sweep_interval'],
+            log=lambda message: self.stdout.write(message),
+        )
+        self.stdout.write(self.style.SUCCESS('Lifecycle scheduler started'))
+        try:
+            scheduler.run_forever(lease, should_stop=lambda: bool(stopping))
+        finally:
+            lease.release()
+        self.stdout.write(self.style.SUCCESS('Lifecycle scheduler stopped'))
@@ -0,0 +1,293 @@
+"""Compatibility scoring between travel plans.
+
+Plans are loaded into columnar NumPy arrays and scored block by block, so a
+full rescoring never loops over plan pairs in Python.
+"""
+import re
+from collections import Counter
+
+import numpy as np
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import TravelPlan, TravelMatch
+
+
+ACTIVE_PLAN_STATUSES = ['open', 'closed', 'finalized']
+
+MIN_MATCH_SCORE = 50
+ROW_BLOCK_SIZE = 512
+COLUMN_BLOCK_SIZE = 8192
+UPSERT_BATCH_SIZE = 1000
+
+# Languages and interests are free text; only the most common tokens get a column
+MAX_TOKEN_VOCABULARY = 64
+
+# Points per criterion, summing to 100. Destination is a gate rather than a
+# weight: plans heading to different places are never matched.
+SCORE_WEIGHTS = {
+    'dates': 35,
+    'purpose': 15,
+    'budget': 15,
+    'travel_style': 12,
+    'languages': 10,
+    'interests': 13,
+}
+
+BUDGET_LEVELS = {'budget': 0, 'mid-range': 1, 'luxury': 2}
+
+PLAN_FIELDS = (
+    'plan_id',
+    'user_id',
+    'destination',
+    'start_date',
+    'end_date',
+    'purpose',
+    'budget_range',
+    'user__userprofile__travel_style',
+    'user__userprofile__languages',
+    'user__userprofile__interests',
+)
+
+_TOKEN_SPLIT = re.compile(r'[,;/]+')
+
+
+def normalize_destination(destination):
+    """Case- and whitespace-insensitive key for comparing destinations"""
+    return ' '.join((destination or '').casefold().split())
+
+
+def _tokens(value):
+    return {token.strip().casefold() for token in _TOKEN_SPLIT.split(value or '') if token.strip()}
+
+
+def _codes(values):
+    """Map each value to an integer code, with empty values coded as -1"""
+    uniques, codes = np.unique(np.array(values, dtype=object).astype(str), return_inverse=True)
+    codes = codes.astype(np.int32)
+    empty = np.nonzero(uniques == '')[0]
+    if empty.size:
+        codes[codes == empty[0]] = -1
+    return uniques, codes
+
+
+def _multi_hot(token_sets):
+    """One float32 column per vocabulary token, plus the row's token count"""
+    counts = Counter(token for tokens in token_sets for token in tokens)
+    vocabulary = {token: i for i, (token, _) in enumerate(counts.most_common(MAX_TOKEN_VOCABULARY))}
+    matrix = np.zeros((len(token_sets), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, tokens in enumerate(token_sets):
+        for token in tokens:
+            column = vocabulary.get(token)
+            if column is not None:
+                matrix[row, column] = 1.0
+    return matrix, matrix.sum(axis=1)
+
+
+def active_plans():
+    """Plans that can still be matched with other travelers"""
+    return TravelPlan.objects.filter(
+        is_active=True,
+        status__in=ACTIVE_PLAN_STATUSES,
+        start_date__gte=timezone.localdate(),
+    )
+
+
+def is_matchable(plan):
+    return (
+        plan.is_active
+        and plan.status in ACTIVE_PLAN_STATUSES
+        and plan.start_date >= timezone.localdate()
+    )
+
+
+def candidate_plans(plan):
+    """Active plans to the same destination whose dates overlap ``plan``"""
+    return active_plans().filter(
+        destination_key=normalize_destination(plan.destination),
+        start_date__lte=plan.end_date,
+        end_date__gte=plan.start_date,
+    ).exclude(user_id=plan.user_id)
+
+
+class PlanFrame:
+    """Columnar view of travel plans and their owners' profiles, sorted by start date"""
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: row[3])
+        columns = list(zip(*rows)) if rows else [()] * len(PLAN_FIELDS)
+        (plan_ids, user_ids, destinations, start_dates, end_dates, purposes,
+         budgets, styles, languages, interests) = columns
+
+        self.plan_ids = np.array(plan_ids, dtype=np.int64)
+        self.user_ids = np.array(user_ids, dtype=np.int64)
+        self.start = np.array([d.toordinal() for d in start_dates], dtype=np.int32)
+        self.end = np.array([d.toordinal() for d in end_dates], dtype=np.int32)
+        _, self.destination = _codes([normalize_destination(d) for d in destinations])
+        _, self.purpose = _codes(purposes)
+        self.budget = np.array([BUDGET_LEVELS.get(b, 1) for b in budgets], dtype=np.float32)
+
+        style_values, self.style = _codes([(s or '').strip().casefold() for s in styles])
+        mixed = np.nonzero(style_values == 'mixed')[0]
+        self.mixed_style = int(mixed[0]) if mixed.size else -2
+
+        self.languages, self.language_counts = _multi_hot([_tokens(v) for v in languages])
+        self.interests, self.interest_counts = _multi_hot([_tokens(v) for v in interests])
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        return cls(queryset.values_list(*PLAN_FIELDS))
+
+    def index_of(self, plan_id):
+        return int(np.nonzero(self.plan_ids == plan_id)[0][0])
+
+    def __len__(self):
+        return len(self.plan_ids)
+
+
+def _jaccard(matrix, counts, rows, cols):
+    shared = matrix[rows] @ matrix[cols].T
+    union = counts[rows][:, None] + counts[cols][None, :] - shared
+    return np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+
+
+def score_block(frame, rows, cols):
+    """Score every plan in ``rows`` against every plan in ``cols``.
+
+    Returns an int16 score matrix and a mask of pairs that may be matched at
+    all (same destination, overlapping dates, different owners).
+    """
+    start_r, start_c = frame.start[rows][:, None], frame.start[cols][None, :]
+    end_r, end_c = frame.end[rows][:, None], frame.end[cols][None, :]
+
+    overlap = np.minimum(end_r, end_c) - np.maximum(start_r, start_c) + 1
+    shortest = np.minimum(end_r - start_r, end_c - start_c) + 1
+    dates = np.clip(overlap / shortest, 0.0, 1.0)
+
+    destination = frame.destination[rows][:, None] == frame.destination[cols][None, :]
+    purpose = frame.purpose[rows][:, None] == frame.purpose[cols][None, :]
+    budget = 1.0 - np.abs(frame.budget[rows][:, None] - frame.budget[cols][None, :]) / 2.0
+
+    style_r, style_c = frame.style[rows][:, None], frame.style[cols][None, :]
+    same_style = (style_r == style_c) & (style_r >= 0)
+    either_mixed = (style_r == frame.mixed_style) | (style_c == frame.mixed_style)
+    travel_style = np.where(same_style, 1.0, np.where(either_mixed, 0.5, 0.0))
+
+    languages = _jaccard(frame.languages, frame.language_counts, rows, cols)
+    interests = _jaccard(frame.interests, frame.interest_counts, rows, cols)
+
+    score = (
+        SCORE_WEIGHTS['dates'] * dates
+        + SCORE_WEIGHTS['purpose'] * purpose
+        + SCORE_WEIGHTS['budget'] * budget
+        + SCORE_WEIGHTS['travel_style'] * travel_style
+        + SCORE_WEIGHTS['languages'] * languages
+        + SCORE_WEIGHTS['interests'] * interests
+    )
+    matchable = destination & (overlap > 0) & (frame.user_ids[rows][:, None] != frame.user_ids[cols][None, :])
+    return np.rint(score).astype(np.int16), matchable
+
+
+def upsert_matches(plan_ids_a, plan_ids_b, scores, scored_at):
+    """Insert or rescore matches in bulk; returns the number of rows written.
+
+    Pairs are stored with the lower plan id as ``travel_plan_1`` so each pair
+    has a single row. Accepted and declined matches keep their status.
+    """
+    first = np.minimum(plan_ids_a, plan_ids_b).tolist()
+    second = np.maximum(plan_ids_a, plan_ids_b).tolist()
+    matches = [
+        TravelMatch(
+            travel_plan_1_id=plan_1,
+            travel_plan_2_id=plan_2,
+            compatibility_score=int(score),
+            scored_at=scored_at,
+        )
+        for plan_1, plan_2, score in zip(first, second, scores.tolist())
+    ]
+    if not matches:
+        return 0
+    TravelMatch.objects.bulk_create(
+        matches,
+        batch_size=UPSERT_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['travel_plan_1', 'travel_plan_2'],
+        update_fields=['compatibility_score', 'scored_at'],
+    )
+    return len(matches)
+
+
+def rescore_all_matches(min_score=MIN_MATCH_SCORE):
+    """Rescore every active plan against every other and refresh TravelMatch.
+
+    Pending matches that were not reproduced by this run are expired.
+    """
+    scored_at = timezone.now()
+    frame = PlanFrame.from_queryset(active_plans())
+    pairs_scored = 0
+    written = 0
+
+    for row_start in range(0, len(frame), ROW_BLOCK_SIZE):
+        rows = np.arange(row_start, min(row_start + ROW_BLOCK_SIZE, len(frame)))
+        # Plans are sorted by start date, so nothing past this point overlaps the block
+        stop = int(np.searchsorted(frame.start, frame.end[rows].max(), side='right'))
+
+        for col_start in range(row_start, stop, COLUMN_BLOCK_SIZE):
+            cols = np.arange(col_start, min(col_start + COLUMN_BLOCK_SIZE, stop))
+            scores, matchable = score_block(frame, rows, cols)
+            keep = matchable & (cols[None, :] > rows[:, None]) & (scores >= min_score)
+            pairs_scored += rows.size * cols.size
+
+            r, c = np.nonzero(keep)
+            written += upsert_matches(
+                frame.plan_ids[rows[r]], frame.plan_ids[cols[c]], scores[r, c], scored_at
+            )
+
+    TravelMatch.objects.filter(scored_at=scored_at, match_status='expired').update(match_status='pending')
+    expired = TravelMatch.objects.filter(match_status='pending').exclude(scored_at=scored_at).update(
+        match_status='expired'
+    )
+    return {
+        'plans': len(frame),
+        'pairs_scored': pairs_scored,
+        'matches': written,
+        'expired': expired,
+    }
+
+
+def expire_plan_matches(plan_ids):
+    """Expire the pending matches of the given plans in one UPDATE"""
+    return TravelMatch.objects.filter(
+        Q(travel_plan_1_id__in=plan_ids) | Q(travel_plan_2_id__in=plan_ids),
+        match_status='pending',
+    ).update(match_status='expired')
+
+
+def refresh_plan_matches(plan, min_score=MIN_MATCH_SCORE):
+    """Rescore a single plan against its candidates after it was created or edited.
+
+    Only this plan's TravelMatch rows are touched: matches it still earns are
+    upserted and its other pending matches are expired.
+    """
+    if not is_matchable(plan):
+        return {'candidates': 0, 'matches': 0, 'expired': expire_plan_matches([plan.plan_id])}
+
+    scored_at = timezone.now()
+    rows = list(TravelPlan.objects.filter(pk=plan.pk).values_list(*PLAN_FIELDS))
+    rows += list(candidate_plans(plan).values_list(*PLAN_FIELDS))
+    frame = PlanFrame(rows)
+
+    index = frame.index_of(plan.plan_id)
+    cols = np.delete(np.arange(len(frame)), index)
+    written = 0
+    if cols.size:
+        scores, matchable = score_block(frame, np.array([index]), cols)
+        keep = (matchable & (scores >= min_score))[0]
+        written = upsert_matches(
+            np.full(int(keep.sum()), plan.plan_id), frame.plan_ids[cols[keep]], scores[0, keep], scored_at
+        )
+
+    plan_matches = TravelMatch.objects.filter(Q(travel_plan_1=plan) | Q(travel_plan_2=plan))
+    plan_matches.filter(scored_at=scored_at, match_status='expired').update(match_status='pending')
+    expired = plan_matches.filter(match_status='pending').exclude(scored_at=scored_at).update(match_status='expired')
+    return {'candidates': int(cols.size), 'matches': written, 'expired': expired}
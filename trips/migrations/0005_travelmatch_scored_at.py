@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0004_organizedtrip_driver_payment_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='travelmatch',
+            name='scored_at',
+            field=models.DateTimeField(blank=True, help_text='When the matching engine last scored this pair', null=True),
+        ),
+    ]
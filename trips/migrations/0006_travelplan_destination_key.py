@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def normalize_destination(destination):
+    # Frozen copy of trips.matching.normalize_destination as of this migration
+    return ' '.join((destination or '').casefold().split())
+
+
+def fill_destination_keys(apps, schema_editor):
+    TravelPlan = apps.get_model('trips', 'TravelPlan')
+    plans = list(TravelPlan.objects.only('plan_id', 'destination'))
+    for plan in plans:
+        plan.destination_key = normalize_destination(plan.destination)
+    TravelPlan.objects.bulk_update(plans, ['destination_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0005_travelmatch_scored_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='travelplan',
+            name='destination_key',
+            field=models.CharField(blank=True, editable=False, help_text='Normalized destination used for matching', max_length=200),
+        ),
+        migrations.RunPython(fill_destination_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='travelplan',
+            index=models.Index(fields=['destination_key', 'start_date'], name='trips_plan_dest_window_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0006_travelplan_destination_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobLock',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('owner', models.CharField(blank=True, max_length=100)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0007_joblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LifecycleDeadline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('join', 'Plan join deadline'), ('payment', 'Plan payment deadline'), ('departure', 'Trip departure'), ('return', 'Trip return')], max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('due_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0008_lifecycledeadline'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripparticipant',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, help_text='An unpaid seat is released after this time; cleared once paid', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='tripparticipant',
+            index=models.Index(fields=['payment_status', 'hold_expires_at'], name='trips_part_hold_idx'),
+        ),
+    ]
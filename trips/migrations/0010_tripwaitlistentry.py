@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0009_tripparticipant_hold_expires_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripWaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='trips.organizedtrip')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trip_waitlist_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['trip', 'id'], name='trips_waitlist_fifo_idx')],
+                'unique_together': {('trip', 'user')},
+            },
+        ),
+    ]
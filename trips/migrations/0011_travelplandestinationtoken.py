@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_destination_tokens(apps, schema_editor):
+    from trips.search import destination_tokens
+
+    TravelPlan = apps.get_model('trips', 'TravelPlan')
+    TravelPlanDestinationToken = apps.get_model('trips', 'TravelPlanDestinationToken')
+    TravelPlanDestinationToken.objects.bulk_create(
+        [
+            TravelPlanDestinationToken(plan_id=plan_id, token=token)
+            for plan_id, destination in TravelPlan.objects.values_list('plan_id', 'destination')
+            for token in destination_tokens(destination)
+        ],
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0010_tripwaitlistentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TravelPlanDestinationToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='travelplan',
+            index=models.Index(fields=['-created_at', '-plan_id'], name='trips_plan_recent_idx'),
+        ),
+        migrations.AddField(
+            model_name='travelplandestinationtoken',
+            name='plan',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='destination_tokens', to='trips.travelplan'),
+        ),
+        migrations.AddIndex(
+            model_name='travelplandestinationtoken',
+            index=models.Index(fields=['token', 'plan'], name='trips_dest_token_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='travelplandestinationtoken',
+            unique_together={('plan', 'token')},
+        ),
+        migrations.RunPython(fill_destination_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:42
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_interest_counters(apps, schema_editor):
+    TravelPlan = apps.get_model('trips', 'TravelPlan')
+    TravelPlanInterest = apps.get_model('trips', 'TravelPlanInterest')
+    plans = [
+        TravelPlan(plan_id=row['plan_id'], interest_count=row['interests'], agreed_count=row['agreed'])
+        for row in TravelPlanInterest.objects.order_by().values('plan_id').annotate(
+            interests=Count('id'), agreed=Count('id', filter=Q(agreed=True)),
+        )
+    ]
+    TravelPlan.objects.bulk_update(plans, ['interest_count', 'agreed_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0011_travelplandestinationtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='travelplan',
+            name='agreed_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='travelplan',
+            name='interest_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_interest_counters, migrations.RunPython.noop),
+    ]
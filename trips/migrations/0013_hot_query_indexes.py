@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0012_travelplan_interest_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', 'payment_status', '-payment_date'], name='trips_pay_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='travelplan',
+            index=models.Index(fields=['status', 'join_deadline'], name='trips_plan_join_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='travelplan',
+            index=models.Index(fields=['status', 'payment_deadline'], name='trips_plan_pay_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='travelplan',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['start_date'], name='trips_plan_active_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripparticipant',
+            index=models.Index(fields=['trip', 'payment_status'], name='trips_part_trip_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0013_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='needs_refund',
+            field=models.BooleanField(default=False),
+        ),
+    ]
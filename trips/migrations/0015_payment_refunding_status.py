@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0014_payment_needs_refund'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('refunding', 'Refunding'), ('refunded', 'Refunded')], default='pending', max_length=20),
+        ),
+    ]
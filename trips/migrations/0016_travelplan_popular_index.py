@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0015_payment_refunding_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='travelplan',
+            index=models.Index(fields=['-interest_count', 'plan_id'], name='trips_plan_popular_idx'),
+        ),
+    ]
@@ -6,7 +6,25 @@ from datetime import timedelta
 from decimal import Decimal
 
 
-class TravelPlan(models.Model):
+class LoadedValuesMixin:
+    """Remembers field values as loaded from the database, so signals can tell what a save changed"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def changed_since_load(self, *attnames):
+        """Whether any of ``attnames`` differs from the loaded (or last checked) value; new rows count as changed"""
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        current = {name: getattr(self, name) for name in attnames}
+        changed = any(name not in loaded or loaded[name] != value for name, value in current.items())
+        loaded.update(current)
+        return changed
+
+
+class TravelPlan(LoadedValuesMixin, models.Model):
     """User-created travel plans that can be matched with others
     
     This model supports a 5-minute join window and lifecycle statuses
@@ -34,6 +52,7 @@ class TravelPlan(models.Model):
     plan_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='travel_plans')
     destination = models.CharField(max_length=200)
+    destination_key = models.CharField(max_length=200, blank=True, editable=False, help_text="Normalized destination used for matching")
     start_date = models.DateField()
     end_date = models.DateField()
     purpose = models.CharField(max_length=50, choices=PURPOSE_CHOICES)
@@ -56,6 +75,11 @@ class TravelPlan(models.Model):
     ]
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
     join_deadline = models.DateTimeField(null=True, blank=True)
+
+    # Maintained by trips.interests; repaired by `manage.py rebuild_interest_counts`
+    interest_count = models.PositiveIntegerField(default=0, editable=False)
+    agreed_count = models.PositiveIntegerField(default=0, editable=False)
+    COUNTER_FIELDS = ('interest_count', 'agreed_count')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -83,6 +107,19 @@ class TravelPlan(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Candidate lookup for incremental matching: same destination, overlapping dates
+            models.Index(fields=['destination_key', 'start_date'], name='trips_plan_dest_window_idx'),
+            # Newest-first keyset pagination on find buddies
+            models.Index(fields=['-created_at', '-plan_id'], name='trips_plan_recent_idx'),
+            # Most-interest-first keyset pagination on find buddies
+            models.Index(fields=['-interest_count', 'plan_id'], name='trips_plan_popular_idx'),
+            # Lifecycle sweeps: open plans past their join window, finalized plans past payment
+            models.Index(fields=['status', 'join_deadline'], name='trips_plan_join_due_idx'),
+            models.Index(fields=['status', 'payment_deadline'], name='trips_plan_pay_due_idx'),
+            # Active future plans; partial, as a boolean filter is not an index column match on SQLite
+            models.Index(fields=['start_date'], condition=models.Q(is_active=True), name='trips_plan_active_start_idx'),
+        ]
 
     def __str__(self):
         return f"{self.destination} - {self.user.username} ({self.start_date})"
@@ -104,6 +141,7 @@ class TravelPlan(models.Model):
         """Override save to set join_deadline and auto-close expired plans"""
         from django.utils import timezone
         from django.core.exceptions import ValidationError
+        from .matching import normalize_destination
         
 
         try:
@@ -116,6 +154,8 @@ class TravelPlan(models.Model):
         is_new = self.pk is None
         if is_new and self.join_deadline is None:
             self.join_deadline = timezone.now() + timedelta(minutes=5)
+
+        self.destination_key = normalize_destination(self.destination)
     
         
         if self.accommodation_cost and self.food_cost and self.transportation_cost and self.driver_payment:
@@ -126,15 +166,20 @@ class TravelPlan(models.Model):
                 self.combined_transportation_cost +  
                 (self.other_costs or 0)
             )
+
+        # A full save of a plan loaded earlier must not write back stale
+        # interest counters over concurrent increments
+        if not is_new and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            skipped = set(self.COUNTER_FIELDS) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped and field.name not in skipped
+            ]
         super().save(*args, **kwargs)
 
-    @property
-    def interest_count(self) -> int:
-        return getattr(self, 'interests', None).count() if hasattr(self, 'interests') else 0
-    
     @property
     def interested_users_count(self):
-        return self.interests.count()
+        return self.interest_count
     
     @property
     def is_join_window_open(self) -> bool:
@@ -167,7 +212,7 @@ class Driver(models.Model):
         return f"{self.name} - {self.vehicle_details}"
 
 
-class OrganizedTrip(models.Model):
+class OrganizedTrip(LoadedValuesMixin, models.Model):
     """Fully organized trips by SheTrip admin"""
     STATUS_CHOICES = [
         ('planning', 'Planning'),
@@ -233,20 +278,37 @@ class OrganizedTrip(models.Model):
     def is_finalized(self) -> bool:
         return self.trip_status in ['confirmed', 'ongoing', 'completed']
      
-    def save(self, *args, **kwargs):
+    def apply_plan_details(self):
+        """Inherit logistics and costs from the TravelPlan (also used before bulk inserts)"""
         if self.travel_plan:
-        # Inherit all details from TravelPlan
             self.transportation_details = self.travel_plan.transportation_details or ''
             self.accommodation_details = self.travel_plan.accommodation_details or ''
             self.meal_arrangements = self.travel_plan.meal_arrangements or ''
             self.itinerary = self.travel_plan.itinerary or ''
-            self.driver = self.travel_plan.assigned_driver
+            self.driver_id = self.travel_plan.assigned_driver_id
             self.driver_payment = self.travel_plan.driver_payment or 0
             self.final_cost_per_person = self.travel_plan.final_cost_per_person or 0
             self.platform_commission = self.travel_plan.platform_commission or 0
-        
+
+    def save(self, *args, **kwargs):
+        self.apply_plan_details()
         super().save(*args, **kwargs)
 
+class TravelPlanDestinationToken(models.Model):
+    """Folded word of a plan's destination, indexed for prefix search (see trips.search)"""
+    plan = models.ForeignKey(TravelPlan, on_delete=models.CASCADE, related_name='destination_tokens')
+    token = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = ['plan', 'token']
+        indexes = [
+            models.Index(fields=['token', 'plan'], name='trips_dest_token_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> plan #{self.plan_id}"
+
+
 class TravelPlanInterest(models.Model):
     """Users expressing interest (pre-payment) in a TravelPlan during the 5-minute window"""
 
@@ -320,15 +382,50 @@ class TripParticipant(models.Model):
         null=True,
         help_text="Dietary restrictions, medical needs, or special requests"
     )
+    hold_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="An unpaid seat is released after this time; cleared once paid"
+    )
 
     class Meta:
         unique_together = ['trip', 'user']
         ordering = ['join_date']
+        indexes = [
+            models.Index(fields=['payment_status', 'hold_expires_at'], name='trips_part_hold_idx'),
+            # Paid participants of a trip
+            models.Index(fields=['trip', 'payment_status'], name='trips_part_trip_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.trip.trip_name}"
 
 
+class TripWaitlistEntry(models.Model):
+    """A user queued for a seat on a full organized trip, served first come, first served"""
+    trip = models.ForeignKey(
+        OrganizedTrip,
+        on_delete=models.CASCADE,
+        related_name='waitlist'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='trip_waitlist_entries'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['trip', 'user']
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['trip', 'id'], name='trips_waitlist_fifo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} waiting for {self.trip.trip_name}"
+
+
 class TravelMatch(models.Model):
     """Matches between compatible travel plans"""
     MATCH_STATUS_CHOICES = [
@@ -358,6 +455,7 @@ class TravelMatch(models.Model):
         default='pending'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    scored_at = models.DateTimeField(null=True, blank=True, help_text="When the matching engine last scored this pair")
 
     class Meta:
         unique_together = ['travel_plan_1', 'travel_plan_2']
@@ -383,6 +481,7 @@ class Payment(models.Model):
         ('processing', 'Processing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        ('refunding', 'Refunding'),  # Claimed by a refund request while the gateway is called
         ('refunded', 'Refunded'),
     ]
 
@@ -408,14 +507,63 @@ class Payment(models.Model):
     transaction_id = models.CharField(max_length=100, unique=True, blank=True, null=True)
     payment_date = models.DateTimeField(auto_now_add=True)
     refund_status = models.BooleanField(default=False)
+    # Completed after the seat was released and the trip filled up; staff refund it
+    needs_refund = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['-payment_date']
+        indexes = [
+            # A user's payment history, newest first, optionally by status
+            models.Index(fields=['user', 'payment_status', '-payment_date'], name='trips_pay_user_status_idx'),
+        ]
 
     def __str__(self):
         return f"Payment {self.transaction_id} - {self.user.username}"
 
 
+class JobLock(models.Model):
+    """Lease that lets only one instance of a background job run at a time"""
+    name = models.CharField(max_length=100, primary_key=True)
+    owner = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.owner or 'nobody'} until {self.expires_at}"
+
+
+class LifecycleDeadline(models.Model):
+    """Deadline recorded by model signals for the lifecycle scheduler to pick up"""
+    KIND_CHOICES = [
+        ('join', 'Plan join deadline'),
+        ('payment', 'Plan payment deadline'),
+        ('departure', 'Trip departure'),
+        ('return', 'Trip return'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    due_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for #{self.object_id} at {self.due_at}"
+
+    @classmethod
+    def record_upcoming(cls, deadlines):
+        """Bulk-insert ``(kind, object_id, due_at)`` tuples that are still in the future"""
+        now = timezone.now()
+        upcoming = [
+            cls(kind=kind, object_id=object_id, due_at=due_at)
+            for kind, object_id, due_at in deadlines
+            if due_at is not None and due_at > now
+        ]
+        if upcoming:
+            cls.objects.bulk_create(upcoming)
+
+
 class Revenue(models.Model):
     """Revenue tracking for each trip"""
     revenue_id = models.AutoField(primary_key=True)
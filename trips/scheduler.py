@@ -0,0 +1,178 @@
+"""In-memory deadline scheduler for the plan/trip lifecycle.
+
+Upcoming deadlines live in a heap keyed by due time. New deadlines reach a
+running scheduler through the LifecycleDeadline table: model signals append
+rows and the scheduler consumes whatever rows it reads, deleting exactly
+those, so rows that commit out of id order are picked up on a later pull.
+Firing a deadline runs the same set-based step as auto_update_trips, scoped
+to the affected rows; the steps re-check the real deadline, so stale or
+duplicate heap entries are harmless.
+
+An error in one iteration is logged and the loop carries on. Deadlines whose
+step failed are picked up by the next sweep, which covers every transition.
+"""
+import heapq
+import itertools
+import logging
+import time
+from collections import defaultdict
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .lifecycle import close_expired_plans, settle_finalized_plans, advance_trip_statuses
+from .models import TravelPlan, OrganizedTrip, LifecycleDeadline
+from .seats import release_expired_holds
+
+
+logger = logging.getLogger(__name__)
+
+ERROR_BACKOFF = 5  # Seconds to wait after a failed iteration
+
+
+def _fire_join(now, ids):
+    return close_expired_plans(now, plan_ids=ids)
+
+
+def _fire_payment(now, ids):
+    return sum(settle_finalized_plans(now, plan_ids=ids)[:2])
+
+
+def _fire_trip(now, ids):
+    return sum(advance_trip_statuses(now, trip_ids=ids))
+
+
+HANDLERS = {
+    'join': _fire_join,
+    'payment': _fire_payment,
+    'departure': _fire_trip,
+    'return': _fire_trip,
+}
+
+
+class LifecycleScheduler:
+    """Fires lifecycle transitions at their due time"""
+
+    def __init__(self, poll_interval=1.0, sweep_interval=300, log=None, error_backoff=ERROR_BACKOFF):
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.error_backoff = error_backoff
+        self.log = log or (lambda message: None)
+        self._heap = []
+        self._sequence = itertools.count()
+        self._last_sweep = 0.0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, kind, object_id, due_at):
+        heapq.heappush(self._heap, (due_at, next(self._sequence), kind, object_id))
+
+    def bootstrap(self):
+        """Load every pending deadline from the source tables.
+
+        LifecycleDeadline rows already committed are covered by this load, so
+        they are discarded. Their ids are read first: a row committed later
+        is left for ``pull_new_deadlines``.
+        """
+        queued = list(LifecycleDeadline.objects.values_list('id', flat=True))
+
+        for plan_id, due_at in TravelPlan.objects.filter(
+            status='open', join_deadline__isnull=False
+        ).values_list('plan_id', 'join_deadline'):
+            self.schedule('join', plan_id, due_at)
+
+        for plan_id, due_at in TravelPlan.objects.filter(
+            status='finalized', payment_deadline__isnull=False, organized_trip__isnull=True
+        ).values_list('plan_id', 'payment_deadline'):
+            self.schedule('payment', plan_id, due_at)
+
+        for trip_id, status, departure, return_time in OrganizedTrip.objects.filter(
+            trip_status__in=['confirmed', 'ongoing']
+        ).values_list('trip_id', 'trip_status', 'departure_time', 'return_time'):
+            if status == 'confirmed':
+                self.schedule('departure', trip_id, departure)
+            self.schedule('return', trip_id, return_time)
+
+        LifecycleDeadline.objects.filter(id__in=queued).delete()
+
+    def pull_new_deadlines(self):
+        """Move deadlines recorded by signals since the last pull into the heap"""
+        rows = list(LifecycleDeadline.objects.values_list('id', 'kind', 'object_id', 'due_at'))
+        for _, kind, object_id, due_at in rows:
+            self.schedule(kind, object_id, due_at)
+        if rows:
+            LifecycleDeadline.objects.filter(id__in=[row[0] for row in rows]).delete()
+        return len(rows)
+
+    def seconds_until_next(self, now):
+        if not self._heap:
+            return None
+        return max((self._heap[0][0] - now).total_seconds(), 0.0)
+
+    def run_due(self, now):
+        """Fire every deadline that has passed, one scoped step per kind"""
+        due = defaultdict(set)
+        while self._heap and self._heap[0][0] < now:
+            _, _, kind, object_id = heapq.heappop(self._heap)
+            due[kind].add(object_id)
+
+        fired = 0
+        for kind, ids in due.items():
+            try:
+                changed = HANDLERS[kind](now, sorted(ids))
+            except Exception:
+                logger.exception('Firing %d %s deadlines failed; the next sweep retries them', len(ids), kind)
+                self._last_sweep = 0.0
+                continue
+            fired += changed
+            self.log(f'{kind}: {len(ids)} due, {changed} rows transitioned')
+        return fired
+
+    def sweep(self, now):
+        """Unscoped pass catching anything no deadline covers, e.g. plans that filled up early"""
+        changed = close_expired_plans(now)
+        changed += sum(settle_finalized_plans(now)[:2])
+        changed += sum(advance_trip_statuses(now))
+        changed += release_expired_holds(now)
+        if changed:
+            self.log(f'sweep: {changed} rows transitioned')
+        return changed
+
+    def run_forever(self, lease, should_stop):
+        """Main loop; returns when ``should_stop()`` is true or the lease is lost"""
+        renew_every = lease.ttl.total_seconds() / 3
+        last_renewal = time.monotonic()
+        loaded = False
+
+        while not should_stop():
+            try:
+                if time.monotonic() - last_renewal >= renew_every:
+                    if not lease.renew():
+                        self.log('Scheduler lease lost; stopping')
+                        return
+                    last_renewal = time.monotonic()
+                if not loaded:
+                    self.bootstrap()
+                    loaded = True
+                    self.log(f'Loaded {len(self)} upcoming deadlines')
+                self.tick()
+            except Exception:
+                logger.exception('Lifecycle scheduler iteration failed; retrying in %ss', self.error_backoff)
+                close_old_connections()
+                time.sleep(self.error_backoff)
+                continue
+
+            wait = self.seconds_until_next(timezone.now())
+            time.sleep(self.poll_interval if wait is None else min(wait, self.poll_interval))
+
+    def tick(self):
+        """One iteration: pull new deadlines, sweep when due, and fire what has passed"""
+        close_old_connections()
+        self.pull_new_deadlines()
+
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep(timezone.now())
+            self._last_sweep = time.monotonic()
+
+        self.run_due(timezone.now())
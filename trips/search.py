@@ -0,0 +1,120 @@
+"""Destination search for the find-buddies page.
+
+Every plan's destination is split into folded tokens (case-folded, Latin
+accents stripped, so "Cox's Bazar" gives ``cox``, ``s``, ``bazar``) and
+stored in TravelPlanDestinationToken. A search term matches a plan when
+every word of the term is a prefix of one of its tokens. Each prefix is an
+index range scan (``token >= 'baz' AND token < 'bba'``) instead of the
+full-table scan ``icontains`` needs. Results are keyset-paginated, newest
+first on (created_at, plan_id) or most popular first on (interest_count,
+plan_id); an index covers each order.
+"""
+import unicodedata
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils.dateparse import parse_datetime
+
+from .models import TravelPlanDestinationToken
+
+
+PAGE_SIZE = 20
+MAX_TOKEN_LENGTH = 100
+
+# sort -> (cursor field, descending; plan_id order among equal values)
+SORTS = {
+    'recent': ('created_at', '-plan_id'),
+    'popular': ('interest_count', 'plan_id'),
+}
+DEFAULT_SORT = 'recent'
+
+
+def fold(text):
+    """Case-fold and strip accents from Latin letters (é -> e), leaving other scripts intact"""
+    folded = []
+    for char in (text or '').casefold():
+        stripped = ''.join(c for c in unicodedata.normalize('NFKD', char) if not unicodedata.combining(c))
+        folded.append(stripped if stripped and stripped.isascii() else char)
+    return ''.join(folded)
+
+
+def _words(text):
+    """
+    Runs of letters and digits. Combining marks stay inside a word: Bengali
+    writes its vowel signs with them, and a plain ``\\w+`` regex splits there.
+    """
+    word = []
+    for char in text:
+        if char.isalnum() or (word and unicodedata.category(char).startswith('M')):
+            word.append(char)
+        elif word:
+            yield ''.join(word)
+            word = []
+    if word:
+        yield ''.join(word)
+
+
+def destination_tokens(destination):
+    """Distinct folded words of a destination, in order"""
+    return list(dict.fromkeys(token[:MAX_TOKEN_LENGTH] for token in _words(fold(destination))))
+
+
+def _prefix_end(prefix):
+    """Smallest string greater than every string starting with ``prefix``"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def matching_destination(queryset, query):
+    """Plans in ``queryset`` with a destination token starting with each word of ``query``"""
+    for prefix in destination_tokens(query):
+        queryset = queryset.filter(Exists(TravelPlanDestinationToken.objects.filter(
+            plan_id=OuterRef('pk'), token__gte=prefix, token__lt=_prefix_end(prefix),
+        )))
+    return queryset
+
+
+def sync_tokens(plan):
+    """Bring the plan's stored tokens in line with its destination"""
+    wanted = set(destination_tokens(plan.destination))
+    stored = set(TravelPlanDestinationToken.objects.filter(plan=plan).values_list('token', flat=True))
+    if stored - wanted:
+        TravelPlanDestinationToken.objects.filter(plan=plan, token__in=stored - wanted).delete()
+    if wanted - stored:
+        TravelPlanDestinationToken.objects.bulk_create(
+            [TravelPlanDestinationToken(plan=plan, token=token) for token in wanted - stored],
+            ignore_conflicts=True,
+        )
+
+
+def parse_cursor(sort, before, before_id):
+    """The (before, before_id) cursor for ``sort`` from query string values, or (None, None)"""
+    if sort == 'popular':
+        before = int(before) if before.isdigit() else None
+    else:
+        before = parse_datetime(before)
+    if before is None or not before_id.isdigit():
+        return None, None
+    return before, int(before_id)
+
+
+def keyset_page(queryset, before=None, before_id=None, size=PAGE_SIZE, sort=DEFAULT_SORT):
+    """
+    One page of ``queryset`` in ``sort`` order, starting after the (before,
+    before_id) cursor. Returns ``(plans, next_cursor)``; next_cursor is None
+    on the last page.
+    """
+    field, tie = SORTS[sort]
+    queryset = queryset.order_by(f'-{field}', tie)
+    if before is not None and before_id is not None:
+        tie_lookup = 'plan_id__lt' if tie.startswith('-') else 'plan_id__gt'
+        queryset = queryset.filter(Q(**{f'{field}__lt': before}) | Q(**{field: before, tie_lookup: before_id}))
+
+    plans = list(queryset[:size + 1])
+    next_cursor = None
+    if len(plans) > size:
+        plans = plans[:size]
+        last = getattr(plans[-1], field)
+        next_cursor = {
+            'before': last.isoformat() if sort == 'recent' else last,
+            'before_id': plans[-1].plan_id,
+        }
+    return plans, next_cursor
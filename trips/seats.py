@@ -0,0 +1,238 @@
+"""Seat inventory for organized trips.
+
+``OrganizedTrip.total_participants`` counts taken seats and the trip's
+travel plan caps them at ``max_participants``. Seats are taken and given
+back with single conditional UPDATEs of that column, so concurrent joins
+can never oversell a trip and no request rewrites the whole trip row.
+
+Joining holds a seat until ``hold_expires_at``; starting a payment extends
+the hold, and completing it clears the hold. ``release_expired_holds``
+frees seats whose hold ran out unpaid and with no payment still open. The
+lifecycle sweep calls it, and a join that finds the trip full calls it for
+that trip first. A payment that completes after its hold was released
+anyway gets a seat back through ``seat_paid`` if one is free. A refund
+deletes the participant like ``leave``; rows left 'refunded' by older
+refunds hold no seat and are replaced when the user takes a seat again.
+
+Users who find a trip full can join its FIFO waitlist. Whenever a seat is
+freed (leave, refund, expired hold) ``promote`` hands it to the head of
+the queue: the entry is locked with SKIP LOCKED so concurrent promoters
+take different entries, the seat is taken with the same conditional
+UPDATE, and the promoted users are notified in bulk.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Subquery, Value, When
+from django.urls import reverse
+from django.utils import timezone
+
+from users import counters, outbox
+from users.models import Notification
+
+from .models import OrganizedTrip, Payment, TravelPlan, TripParticipant, TripWaitlistEntry
+
+
+SEAT_HOLD = timedelta(minutes=getattr(settings, 'SEAT_HOLD_MINUTES', 30))
+JOINABLE_STATUSES = ('open', 'confirmed', 'planning')
+
+
+def _take_seat(trip_id):
+    """Take one seat if any is left; returns True on success"""
+    capacity = TravelPlan.objects.filter(pk=OuterRef('travel_plan_id')).values('max_participants')[:1]
+    return OrganizedTrip.objects.filter(
+        pk=trip_id, total_participants__lt=Subquery(capacity)
+    ).update(total_participants=F('total_participants') + 1) == 1
+
+
+def _give_back(trip_id, seats=1):
+    OrganizedTrip.objects.filter(pk=trip_id, total_participants__gte=seats).update(
+        total_participants=F('total_participants') - seats
+    )
+
+
+def _drop_refunded(trip_id, user_id):
+    TripParticipant.objects.filter(trip_id=trip_id, user_id=user_id, payment_status='refunded').delete()
+
+
+def reserve(trip, user, **fields):
+    """
+    Add ``user`` to ``trip`` holding a seat for ``SEAT_HOLD``; returns the
+    TripParticipant, or None when the trip is full. Raises IntegrityError if
+    the user has already joined.
+    """
+    for attempt in range(2):
+        with transaction.atomic():
+            if _take_seat(trip.pk):
+                _drop_refunded(trip.pk, user.pk)
+                participant = TripParticipant.objects.create(
+                    trip=trip,
+                    user=user,
+                    payment_status='pending',
+                    hold_expires_at=timezone.now() + SEAT_HOLD,
+                    **fields,
+                )
+                TripWaitlistEntry.objects.filter(trip=trip, user=user).delete()
+                return participant
+        if attempt == 0 and not release_expired_holds(timezone.now(), trip_ids=[trip.pk]):
+            break
+    return None
+
+
+def extend_hold(participant):
+    """Restart the hold while the participant is at the payment gateway"""
+    TripParticipant.objects.filter(pk=participant.pk, hold_expires_at__isnull=False).update(
+        hold_expires_at=timezone.now() + SEAT_HOLD
+    )
+
+
+def leave(participant):
+    """Remove the participant and free their seat"""
+    with transaction.atomic():
+        deleted, _ = TripParticipant.objects.filter(pk=participant.pk).delete()
+        if deleted:
+            _give_back(participant.trip_id)
+    if deleted:
+        promote([participant.trip_id])
+
+
+def give_back_seat(trip_id):
+    """Free a seat whose participant row is kept, e.g. after a refund"""
+    _give_back(trip_id)
+    promote([trip_id])
+
+
+def seat_paid(trip_id, user_id, amount_paid):
+    """
+    Seat a participant whose payment completed after their hold was released.
+    Returns the paid TripParticipant, or None when the trip has no seat left.
+    Call with the trip row locked, so no join for the same user can interleave.
+    """
+    if not _take_seat(trip_id):
+        return None
+    _drop_refunded(trip_id, user_id)
+    participant = TripParticipant.objects.create(
+        trip_id=trip_id, user_id=user_id, payment_status='paid', amount_paid=amount_paid,
+    )
+    TripWaitlistEntry.objects.filter(trip_id=trip_id, user_id=user_id).delete()
+    return participant
+
+
+def release_expired_holds(now, trip_ids=None):
+    """Drop unpaid participants whose hold has expired and free their seats; returns how many"""
+    # A payment still pending or processing may yet complete. Abandoned ones
+    # are failed by reconcile_payments, and the hold is released after that.
+    paying = Payment.objects.filter(
+        trip_id=OuterRef('trip_id'), user_id=OuterRef('user_id'), payment_status__in=('pending', 'processing')
+    )
+    expired = TripParticipant.objects.filter(
+        payment_status='pending', hold_expires_at__lt=now
+    ).exclude(Exists(paying))
+    if trip_ids is not None:
+        expired = expired.filter(trip_id__in=trip_ids)
+
+    with transaction.atomic():
+        rows = list(expired.select_for_update().values_list('pk', 'trip_id'))
+        if not rows:
+            return 0
+        TripParticipant.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+
+        freed = {}
+        for _, trip_id in rows:
+            freed[trip_id] = freed.get(trip_id, 0) + 1
+        OrganizedTrip.objects.filter(pk__in=freed).update(total_participants=Case(
+            *[When(pk=trip_id, then=F('total_participants') - Value(count)) for trip_id, count in freed.items()],
+            output_field=IntegerField(),
+        ))
+    promote(freed)
+    return len(rows)
+
+
+def join_waitlist(trip, user):
+    """Queue ``user`` for a seat on ``trip``; returns their 1-based position"""
+    entry, _ = TripWaitlistEntry.objects.get_or_create(trip=trip, user=user)
+    return waitlist_position(entry)
+
+
+def waitlist_position(entry):
+    return TripWaitlistEntry.objects.filter(trip_id=entry.trip_id, id__lte=entry.id).count()
+
+
+def leave_waitlist(trip, user):
+    TripWaitlistEntry.objects.filter(trip=trip, user=user).delete()
+
+
+def _promote_next(trip_id):
+    """Give a free seat on the trip to the head of its waitlist; returns the participant or None"""
+    with transaction.atomic():
+        entry = (
+            TripWaitlistEntry.objects.select_for_update(skip_locked=True)
+            .filter(trip_id=trip_id).order_by('id').first()
+        )
+        if entry is None or not _take_seat(trip_id):
+            return None
+        entry.delete()
+        _drop_refunded(trip_id, entry.user_id)
+        try:
+            with transaction.atomic():
+                return TripParticipant.objects.create(
+                    trip_id=trip_id,
+                    user_id=entry.user_id,
+                    payment_status='pending',
+                    hold_expires_at=timezone.now() + SEAT_HOLD,
+                )
+        except IntegrityError:
+            # Already joined some other way; the seat goes to the next in line
+            _give_back(trip_id)
+            return False
+
+
+def promote(trip_ids):
+    """Fill free seats on ``trip_ids`` from their waitlists; returns the promoted participants"""
+    trip_ids = list(
+        OrganizedTrip.objects.filter(pk__in=trip_ids, trip_status__in=JOINABLE_STATUSES)
+        .filter(Exists(TripWaitlistEntry.objects.filter(trip_id=OuterRef('pk'))))
+        .values_list('pk', flat=True)
+    )
+    promoted = []
+    for trip_id in trip_ids:
+        while (participant := _promote_next(trip_id)) is not None:
+            if participant:
+                promoted.append(participant)
+    if promoted:
+        _notify_promoted(promoted)
+    return promoted
+
+
+def _notify_promoted(participants):
+    """One INSERT of in-app notifications and one of queued emails for everyone promoted"""
+    participants = list(
+        TripParticipant.objects.filter(pk__in=[p.pk for p in participants]).select_related('trip', 'user')
+    )
+    hold_minutes = int(SEAT_HOLD.total_seconds() // 60)
+    notifications, emails = [], []
+    for participant in participants:
+        trip, user = participant.trip, participant.user
+        message = (
+            f"A seat opened up on {trip.trip_name} and it's yours! "
+            f"Complete your payment within {hold_minutes} minutes to keep it."
+        )
+        notifications.append(Notification(
+            recipient=user,
+            notification_type='waitlist_promoted',
+            message=message,
+            link=reverse('trip_payment', args=[trip.trip_id]),
+        ))
+        if user.email:
+            emails.append((
+                f'A seat is available on {trip.trip_name}',
+                f"Hi {user.first_name or user.username},\n\n{message}\n\n"
+                f"{settings.SITE_URL}{reverse('trip_payment', args=[trip.trip_id])}\n\nSheTrip Team",
+                [user.email],
+                f'waitlist-promoted:{participant.pk}',
+            ))
+    Notification.objects.bulk_create(notifications)
+    # bulk_create skips the post_save counter signal
+    counters.invalidate([p.user_id for p in participants], 'unread_notifications_count')
+    outbox.enqueue_many(emails)
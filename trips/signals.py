@@ -0,0 +1,62 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from users import counters
+
+from . import search
+from .models import TravelPlan, OrganizedTrip, TripParticipant, Payment, LifecycleDeadline
+
+
+COUNTED_MODELS = {
+    TravelPlan: 'user_plans_count',
+    TripParticipant: 'total_trips_count',
+    Payment: 'user_payments_count',
+}
+
+
+@receiver(post_save, sender=TravelPlan)
+def record_plan_deadlines(sender, instance, **kwargs):
+    """Hand new or moved plan deadlines to the lifecycle scheduler; saves that keep them add nothing"""
+    if not instance.changed_since_load('status', 'join_deadline', 'payment_deadline'):
+        return
+    if instance.status == 'open':
+        LifecycleDeadline.record_upcoming([('join', instance.plan_id, instance.join_deadline)])
+    elif instance.status == 'finalized':
+        LifecycleDeadline.record_upcoming([('payment', instance.plan_id, instance.payment_deadline)])
+
+
+@receiver(post_save, sender=TravelPlan)
+def index_plan_destination(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the destination search tokens in step with the plan"""
+    if created or update_fields is None or 'destination' in update_fields:
+        search.sync_tokens(instance)
+
+
+@receiver(post_save, sender=OrganizedTrip)
+def record_trip_deadlines(sender, instance, **kwargs):
+    """Hand trip departure/return times to the lifecycle scheduler; saves that keep them add nothing"""
+    if not instance.changed_since_load('trip_status', 'departure_time', 'return_time'):
+        return
+    if instance.trip_status == 'confirmed':
+        LifecycleDeadline.record_upcoming([
+            ('departure', instance.trip_id, instance.departure_time),
+            ('return', instance.trip_id, instance.return_time),
+        ])
+    elif instance.trip_status == 'ongoing':
+        LifecycleDeadline.record_upcoming([('return', instance.trip_id, instance.return_time)])
+
+
+@receiver(post_save, sender=TravelPlan)
+@receiver(post_save, sender=TripParticipant)
+@receiver(post_save, sender=Payment)
+def count_created(sender, instance, created, **kwargs):
+    """Keep the cached sidebar counters in step with new rows"""
+    if created:
+        counters.adjust(instance.user_id, COUNTED_MODELS[sender], 1)
+
+
+@receiver(post_delete, sender=TravelPlan)
+@receiver(post_delete, sender=TripParticipant)
+@receiver(post_delete, sender=Payment)
+def count_deleted(sender, instance, **kwargs):
+    counters.adjust(instance.user_id, COUNTED_MODELS[sender], -1)
@@ -1,3 +1,847 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import date, datetime, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import interests, lifecycle, matching, scheduler, search, seats, views
+from payments import completion, reconcile
+from users.models import Notification, OutboxEmail
+
+from .models import (
+    Driver, LifecycleDeadline, OrganizedTrip, Payment, TravelMatch, TravelPlan, TravelPlanInterest, TripParticipant,
+    TripWaitlistEntry,
+)
+from .locks import JobLease
+from .scheduler import LifecycleScheduler
+
+
+def _trip(capacity):
+    owner = User.objects.create_user(f'owner{capacity}')
+    plan = TravelPlan.objects.create(
+        user=owner, destination="Cox's Bazar", start_date=date(2030, 1, 10), end_date=date(2030, 1, 12),
+        purpose='leisure', budget_range='mid-range', max_participants=capacity, status='approved',
+    )
+    return OrganizedTrip.objects.create(
+        travel_plan=plan, trip_name="Cox's Bazar", base_cost=1000, platform_commission=0,
+        final_cost_per_person=1000, transportation_details='Bus', accommodation_details='Hotel',
+        meal_arrangements='Included', profit_margin=0, destination="Cox's Bazar",
+        departure_time=timezone.now() + timedelta(days=7), return_time=timezone.now() + timedelta(days=9),
+    )
+
+
+def _retrying(func, *args):
+    """Call ``func`` until SQLite stops reporting lock contention"""
+    while True:
+        try:
+            return func(*args)
+        except OperationalError:
+            # SQLite's shared in-memory test database reports lock contention
+            # instead of waiting; the transaction rolled back, so try again
+            time.sleep(0.01)
+
+
+def _run_concurrently(func, args_list):
+    barrier = threading.Barrier(len(args_list))
+    results = []
+
+    def run(args):
+        try:
+            barrier.wait()
+            results.append(_retrying(func, *args))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(args,)) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class SeatReservationStressTests(TransactionTestCase):
+
+    def test_concurrent_joins_never_oversell(self):
+        capacity, joiners = 5, 16
+        trip = _trip(capacity)
+        users = [User.objects.create_user(f'joiner{i}') for i in range(joiners)]
+
+        results = _run_concurrently(lambda user: seats.reserve(trip, user) is not None, [(u,) for u in users])
+
+        trip.refresh_from_db()
+        self.assertEqual(results.count(True), capacity)
+        self.assertEqual(trip.total_participants, capacity)
+        self.assertEqual(TripParticipant.objects.filter(trip=trip).count(), capacity)
+
+    def test_concurrent_leaves_promote_the_waitlist_in_order(self):
+        trip = _trip(capacity=3)
+        leavers = [seats.reserve(trip, User.objects.create_user(f'leaver{i}')) for i in range(3)]
+        waiting = [User.objects.create_user(f'waiting{i}') for i in range(5)]
+        for user in waiting:
+            seats.join_waitlist(trip, user)
+
+        _run_concurrently(seats.leave, [(participant,) for participant in leavers])
+
+        trip.refresh_from_db()
+        self.assertEqual(trip.total_participants, 3)
+        self.assertEqual(
+            set(TripParticipant.objects.filter(trip=trip).values_list('user__username', flat=True)),
+            {'waiting0', 'waiting1', 'waiting2'},
+        )
+        self.assertEqual(
+            list(TripWaitlistEntry.objects.filter(trip=trip).values_list('user__username', flat=True)),
+            ['waiting3', 'waiting4'],
+        )
+
+
+class SeatHoldTests(TestCase):
+
+    def setUp(self):
+        self.trip = _trip(capacity=1)
+        self.first = User.objects.create_user('first')
+        self.second = User.objects.create_user('second')
+
+    def _expire(self, participant):
+        TripParticipant.objects.filter(pk=participant.pk).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+
+    def test_full_trip_rejects_join_while_hold_is_live(self):
+        self.assertIsNotNone(seats.reserve(self.trip, self.first))
+        self.assertIsNone(seats.reserve(self.trip, self.second))
+
+    def test_expired_hold_frees_the_seat_for_the_next_join(self):
+        self._expire(seats.reserve(self.trip, self.first))
+
+        participant = seats.reserve(self.trip, self.second)
+
+        self.assertEqual(participant.user, self.second)
+        self.assertFalse(TripParticipant.objects.filter(user=self.first).exists())
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.total_participants, 1)
+
+    def _payment(self, status):
+        return Payment.objects.create(
+            trip=self.trip, user=self.first, total_amount=1000, platform_commission=0,
+            payment_method='sslcommerz', payment_status=status, transaction_id='TXN-HOLD',
+        )
+
+    def test_hold_with_payment_in_flight_is_kept(self):
+        self._expire(seats.reserve(self.trip, self.first))
+        payment = self._payment('processing')
+
+        for status in ('processing', 'pending'):
+            with self.subTest(status):
+                Payment.objects.filter(pk=payment.pk).update(payment_status=status)
+                self.assertEqual(seats.release_expired_holds(timezone.now()), 0)
+                self.assertIsNone(seats.reserve(self.trip, self.second))
+
+    def _paid_after_release(self):
+        """A failed payment lets the expired hold go, then the gateway reports it paid after all"""
+        self._expire(seats.reserve(self.trip, self.first))
+        payment = self._payment('failed')
+        self.assertEqual(seats.release_expired_holds(timezone.now()), 1)
+        return payment
+
+    def test_payment_completed_after_the_hold_was_released_gets_a_free_seat(self):
+        payment = self._paid_after_release()
+
+        self.assertTrue(completion.mark_completed(payment, 'visa'))
+
+        participant = TripParticipant.objects.get(trip=self.trip)
+        self.assertEqual((participant.user, participant.payment_status), (self.first, 'paid'))
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.total_participants, 1)
+        self.assertFalse(Payment.objects.get(pk=payment.pk).needs_refund)
+
+    def test_payment_completed_after_the_trip_filled_is_flagged_for_refund(self):
+        payment = self._paid_after_release()
+        seats.reserve(self.trip, self.second)
+
+        with self.assertLogs('payments.completion', 'ERROR'):
+            self.assertFalse(completion.mark_completed(payment, 'visa'))
+
+        payment.refresh_from_db()
+        self.assertEqual((payment.payment_status, payment.needs_refund), ('completed', True))
+        self.assertEqual(TripParticipant.objects.get(trip=self.trip).user, self.second)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.total_participants, 1)
+
+    def test_payment_after_a_refund_needs_the_seat_back(self):
+        TripParticipant.objects.create(trip=self.trip, user=self.first, payment_status='refunded')
+        seats.reserve(self.trip, self.second)
+        payment = self._payment('processing')
+
+        with self.assertLogs('payments.completion', 'ERROR'):
+            self.assertFalse(completion.mark_completed(payment, 'visa'))
+
+        self.assertEqual(TripParticipant.objects.get(user=self.first).payment_status, 'refunded')
+        self.assertTrue(Payment.objects.get(pk=payment.pk).needs_refund)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.total_participants, 1)
+
+    def test_reseated_payment_confirming_the_trip_keeps_the_seat_count(self):
+        trip = _trip(capacity=2)
+        seats.reserve(trip, self.second)
+        TripParticipant.objects.filter(trip=trip).update(payment_status='paid')
+        payment = Payment.objects.create(
+            trip=trip, user=self.first, total_amount=1000, platform_commission=0,
+            payment_method='sslcommerz', payment_status='processing', transaction_id='TXN-LATE',
+        )
+
+        self.assertTrue(completion.mark_completed(payment, 'visa'))
+
+        trip.refresh_from_db()
+        self.assertEqual((trip.trip_status, trip.total_participants), ('confirmed', 2))
+
+    def test_reconciled_payment_without_a_seat_is_flagged_for_refund(self):
+        payment = self._paid_after_release()
+        Payment.objects.filter(pk=payment.pk).update(payment_status='pending')
+        seats.reserve(self.trip, self.second)
+
+        with self.assertLogs('payments.completion', 'ERROR'):
+            self.assertEqual(reconcile.apply([(payment, 'visa')], []), (1, 0, 0))
+
+        payment.refresh_from_db()
+        self.assertEqual((payment.payment_status, payment.needs_refund), ('completed', True))
+
+    def test_leaving_gives_the_seat_back(self):
+        seats.leave(seats.reserve(self.trip, self.first))
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.total_participants, 0)
+        self.assertIsNotNone(seats.reserve(self.trip, self.second))
+
+
+class WaitlistTests(TestCase):
+
+    def setUp(self):
+        self.trip = _trip(capacity=1)
+        self.holder = seats.reserve(self.trip, User.objects.create_user('holder'))
+        self.first = User.objects.create_user('first', email='first@example.com')
+        self.second = User.objects.create_user('second')
+
+    def test_positions_are_first_come_first_served(self):
+        self.assertEqual(seats.join_waitlist(self.trip, self.first), 1)
+        self.assertEqual(seats.join_waitlist(self.trip, self.second), 2)
+        self.assertEqual(seats.join_waitlist(self.trip, self.first), 1)  # Joining again keeps the place
+
+    def test_leaving_promotes_the_head_and_notifies_them(self):
+        seats.join_waitlist(self.trip, self.first)
+        seats.join_waitlist(self.trip, self.second)
+
+        seats.leave(self.holder)
+
+        promoted = TripParticipant.objects.get(trip=self.trip)
+        self.assertEqual((promoted.user, promoted.payment_status), (self.first, 'pending'))
+        self.assertIsNotNone(promoted.hold_expires_at)
+        self.assertEqual(
+            list(TripWaitlistEntry.objects.values_list('user__username', flat=True)), ['second']
+        )
+        notification = Notification.objects.get(recipient=self.first)
+        self.assertEqual(notification.notification_type, 'waitlist_promoted')
+        self.assertEqual(OutboxEmail.objects.get().recipients, ['first@example.com'])
+
+    def test_expired_hold_goes_to_the_waitlist_before_a_new_join(self):
+        seats.join_waitlist(self.trip, self.first)
+        TripParticipant.objects.filter(pk=self.holder.pk).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertIsNone(seats.reserve(self.trip, self.second))
+        self.assertEqual(TripParticipant.objects.get(trip=self.trip).user, self.first)
+
+    def test_joining_the_waitlist_of_a_trip_with_a_free_seat_takes_the_seat(self):
+        seats.leave(self.holder)
+        self.client.force_login(self.first)
+
+        response = self.client.post(reverse('join_trip_waitlist', args=[self.trip.pk]))
+
+        self.assertRedirects(response, reverse('trip_payment', args=[self.trip.pk]), fetch_redirect_response=False)
+        self.assertEqual(TripParticipant.objects.get(trip=self.trip).user, self.first)
+        self.assertFalse(TripWaitlistEntry.objects.exists())
+
+    def test_joining_the_waitlist_of_a_full_trip_queues(self):
+        self.client.force_login(self.first)
+
+        self.client.post(reverse('join_trip_waitlist', args=[self.trip.pk]))
+
+        self.assertEqual(TripWaitlistEntry.objects.get().user, self.first)
+        self.assertEqual(TripParticipant.objects.get(trip=self.trip), self.holder)
+
+
+class DestinationSearchTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('planner', is_staff=True)
+
+    def _plan(self, destination):
+        return TravelPlan.objects.create(
+            user=self.owner, destination=destination, start_date=date(2030, 1, 10), end_date=date(2030, 1, 12),
+            purpose='leisure', budget_range='mid-range',
+        )
+
+    def _search(self, query):
+        return set(search.matching_destination(TravelPlan.objects.all(), query).values_list('destination', flat=True))
+
+    def test_tokens_are_case_and_accent_folded(self):
+        self.assertEqual(search.destination_tokens("Cox's BAZAR, Montréal"), ['cox', 's', 'bazar', 'montreal'])
+        self.assertEqual(search.destination_tokens('কক্সবাজার'), ['কক্সবাজার'])
+
+    def test_every_query_word_must_prefix_a_token(self):
+        self._plan("Cox's Bazar")
+        self._plan('Bandarban')
+        self._plan('Montréal')
+
+        self.assertEqual(self._search('ba'), {"Cox's Bazar", 'Bandarban'})
+        self.assertEqual(self._search('BAZ cox'), {"Cox's Bazar"})
+        self.assertEqual(self._search('montre'), {'Montréal'})
+        self.assertEqual(self._search('azar'), set())
+
+    def test_tokens_follow_destination_changes(self):
+        plan = self._plan('Sylhet')
+        plan.destination = 'Sreemangal'
+        plan.save(update_fields=['destination'])
+
+        self.assertEqual(self._search('syl'), set())
+        self.assertEqual(self._search('sree'), {'Sreemangal'})
+
+    def test_keyset_pages_cover_every_plan_once(self):
+        plans = [self._plan(f'Sajek {i}') for i in range(5)]
+        TravelPlan.objects.update(created_at=timezone.now())  # Ties are broken by plan_id
+
+        seen, cursor = [], {'before': None, 'before_id': None}
+        while cursor:
+            before = cursor['before'] and datetime.fromisoformat(cursor['before'])
+            page, cursor = search.keyset_page(TravelPlan.objects.all(), before, cursor['before_id'], size=2)
+            seen += [plan.plan_id for plan in page]
+
+        self.assertEqual(seen, sorted((plan.plan_id for plan in plans), reverse=True))
+
+    def test_popular_pages_cover_every_plan_once(self):
+        plans = [self._plan(f'Sajek {i}') for i in range(5)]
+        for plan, count in zip(plans, (1, 3, 1, 0, 3)):
+            TravelPlan.objects.filter(pk=plan.pk).update(interest_count=count)
+
+        seen, cursor = [], {'before': None, 'before_id': None}
+        while cursor:
+            page, cursor = search.keyset_page(
+                TravelPlan.objects.all(), cursor['before'], cursor['before_id'], size=2, sort='popular'
+            )
+            seen += [plan.plan_id for plan in page]
+
+        self.assertEqual(seen, [plans[i].plan_id for i in (1, 4, 0, 2, 3)])
+
+    def test_find_buddies_sorts_by_interest_across_pages(self):
+        for i in range(search.PAGE_SIZE + 1):
+            self._plan(f'Bandarban {i}')
+        TravelPlan.objects.filter(destination='Bandarban 7').update(interest_count=4)
+        self.client.force_login(self.owner)
+
+        response = self.client.get(reverse('find_buddies'), {'sort': 'popular'})
+        self.assertEqual(response.context['travel_plans'][0].destination, 'Bandarban 7')
+        self.assertContains(response, '?sort=popular&before=0&')
+
+        response = self.client.get(reverse('find_buddies'), {'sort': 'popular', **response.context['next_cursor']})
+        self.assertEqual([plan.destination for plan in response.context['travel_plans']], ['Bandarban 20'])
+
+    def test_find_buddies_pages_keep_the_search(self):
+        for i in range(search.PAGE_SIZE + 1):
+            self._plan(f'Bandarban {i}')
+        self._plan('Sylhet')
+        self.client.force_login(self.owner)
+
+        response = self.client.get(reverse('find_buddies'), {'destination': 'bandar'})
+        cursor = response.context['next_cursor']
+        self.assertEqual(len(response.context['travel_plans']), search.PAGE_SIZE)
+        self.assertContains(response, '?destination=bandar&before=')
+
+        response = self.client.get(reverse('find_buddies'), {'destination': 'bandar', **cursor})
+        self.assertEqual([plan.destination for plan in response.context['travel_plans']], ['Bandarban 0'])
+        self.assertIsNone(response.context['next_cursor'])
+
+
+class MyTripsViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('traveller', is_staff=True)
+        self.client.force_login(self.user)
+
+    def _add_trips(self, count, departed):
+        offset = timedelta(days=-10 if departed else 10)
+        for i in range(count):
+            trip = _trip(capacity=10 + OrganizedTrip.objects.count())
+            OrganizedTrip.objects.filter(pk=trip.pk).update(
+                departure_time=timezone.now() + offset, return_time=timezone.now() + offset + timedelta(days=2),
+                destination=f'Place {i}', total_participants=3,
+            )
+            TripParticipant.objects.create(trip=trip, user=self.user, payment_status='paid')
+            TravelPlan.objects.create(
+                user=self.user, destination=f'Place {i}', start_date=date(2030, 2, 1), end_date=date(2030, 2, 3),
+                purpose='leisure', budget_range='mid-range',
+            )
+
+    def _get(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('my_trips'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_trips(self):
+        self._add_trips(1, departed=True)
+        self._get()  # Warms the sidebar counters and saves the session
+        _, few = self._get()
+
+        self._add_trips(4, departed=False)
+        self._add_trips(2, departed=True)
+        response, many = self._get()
+
+        self.assertEqual(many, few)
+        self.assertEqual(response.context['completed_trips_count'], 3)
+        self.assertEqual(response.context['places_visited'], 2)  # 'Place 0' twice and 'Place 1'
+        self.assertEqual(response.context['travel_buddies_met'], 6)
+        self.assertEqual(response.context['total_co_travelers'], 14)
+        self.assertEqual(len(response.context['past_trips']), 3)
+
+
+class InterestCounterTests(TestCase):
+
+    def setUp(self):
+        self.plan = _trip(capacity=5).travel_plan
+        self.users = [User.objects.create_user(f'fan{i}') for i in range(3)]
+
+    def _counts(self):
+        self.plan.refresh_from_db()
+        return self.plan.interest_count, self.plan.agreed_count
+
+    def test_counters_follow_express_agree_and_withdraw(self):
+        for user in self.users:
+            interests.express(self.plan, user)
+        interest, created = interests.express(self.plan, self.users[0])
+        self.assertFalse(created)
+        interests.agree(interest)
+        interests.agree(interest)
+        self.assertEqual(self._counts(), (3, 1))
+
+        interests.withdraw(interest)
+        interests.withdraw(interest)
+        self.assertEqual(self._counts(), (2, 0))
+
+    def test_full_save_of_a_stale_plan_keeps_the_counters(self):
+        stale = TravelPlan.objects.get(pk=self.plan.pk)
+        interests.express(self.plan, self.users[0])
+
+        stale.description = 'Beach week'
+        stale.save()
+
+        self.assertEqual(self._counts(), (1, 0))
+        self.assertEqual(self.plan.description, 'Beach week')
+
+    def test_rebuild_repairs_drifted_counters(self):
+        for user in self.users:
+            interests.express(self.plan, user)
+        TravelPlanInterest.objects.filter(user=self.users[0]).update(agreed=True)
+        TravelPlanInterest.objects.filter(user=self.users[1]).delete()  # e.g. removed in the admin
+
+        self.assertEqual(interests.rebuild_counters(), 1)
+        self.assertEqual(self._counts(), (2, 1))
+        self.assertEqual(interests.rebuild_counters(), 0)
+
+
+def _plan_score(a, b):
+    """Per-pair reference for ``matching.score_block``: the score, or None if the pair cannot match"""
+    overlap = (min(a.end_date, b.end_date) - max(a.start_date, b.start_date)).days + 1
+    if a.destination_key != b.destination_key or overlap <= 0 or a.user_id == b.user_id:
+        return None
+    shortest = min((a.end_date - a.start_date).days, (b.end_date - b.start_date).days) + 1
+    profile_a, profile_b = a.user.userprofile, b.user.userprofile
+    style_a, style_b = profile_a.travel_style.strip().casefold(), profile_b.travel_style.strip().casefold()
+    if style_a and style_a == style_b:
+        style = 1.0
+    elif 'mixed' in (style_a, style_b):
+        style = 0.5
+    else:
+        style = 0.0
+
+    def jaccard(x, y):
+        x, y = matching._tokens(x), matching._tokens(y)
+        return len(x & y) / len(x | y) if x | y else 0.0
+
+    weights = matching.SCORE_WEIGHTS
+    score = (
+        weights['dates'] * min(overlap / shortest, 1.0)
+        + weights['purpose'] * (a.purpose == b.purpose)
+        + weights['budget'] * (1 - abs(matching.BUDGET_LEVELS[a.budget_range] - matching.BUDGET_LEVELS[b.budget_range]) / 2)
+        + weights['travel_style'] * style
+        + weights['languages'] * jaccard(profile_a.languages, profile_b.languages)
+        + weights['interests'] * jaccard(profile_a.interests, profile_b.interests)
+    )
+    return round(score)
+
+
+class MatchingFixture:
+    """Plans to a few destinations whose owners have differing profiles"""
+
+    PROFILES = [
+        ('adventure', 'Bangla, English', 'hiking, food'),
+        ('Adventure', 'bangla', 'Hiking; photography'),
+        ('mixed', 'English', ''),
+        ('relaxed', '', 'food, beaches, history'),
+        ('', 'Hindi, English', 'beaches'),
+    ]
+    PLANS = [  # (owner, destination, start day, nights, purpose, budget)
+        (0, "Cox's Bazar", 1, 3, 'leisure', 'budget'),
+        (1, "  cox's   BAZAR", 2, 1, 'leisure', 'mid-range'),
+        (2, "Cox's Bazar", 3, 6, 'adventure', 'luxury'),
+        (3, "Cox's Bazar", 40, 2, 'leisure', 'budget'),
+        (4, "Cox's Bazar", 41, 4, 'cultural', 'budget'),
+        (0, 'Sylhet', 2, 3, 'leisure', 'budget'),
+        (3, 'Sylhet', 1, 5, 'leisure', 'luxury'),
+        (3, 'Sylhet', 3, 1, 'leisure', 'luxury'),  # Same owner as the plan above
+        (4, 'Bandarban', 90, 2, 'adventure', 'mid-range'),
+    ]
+
+    def setUp(self):
+        self.users = []
+        for i, (style, languages, hobbies) in enumerate(self.PROFILES):
+            user = User.objects.create_user(f'matcher{i}')
+            user.userprofile.travel_style, user.userprofile.languages, user.userprofile.interests = style, languages, hobbies
+            user.userprofile.save()
+            self.users.append(user)
+        self.plans = [
+            TravelPlan.objects.create(
+                user=self.users[owner], destination=destination,
+                start_date=date(2030, 1, 1) + timedelta(days=start),
+                end_date=date(2030, 1, 1) + timedelta(days=start + nights),
+                purpose=purpose, budget_range=budget,
+            )
+            for owner, destination, start, nights, purpose, budget in self.PLANS
+        ]
+
+    def _expected(self):
+        plans = list(TravelPlan.objects.select_related('user__userprofile').order_by('plan_id'))
+        expected = {}
+        for i, a in enumerate(plans):
+            for b in plans[i + 1:]:
+                score = _plan_score(a, b)
+                if score is not None:
+                    expected[(a.plan_id, b.plan_id)] = score
+        return expected
+
+    def _stored(self, **filters):
+        return {
+            (match.travel_plan_1_id, match.travel_plan_2_id): match.compatibility_score
+            for match in TravelMatch.objects.filter(**filters)
+        }
+
+
+class MatchingEngineTests(MatchingFixture, TestCase):
+
+    def test_block_scores_match_the_per_pair_reference(self):
+        with mock.patch.object(matching, 'ROW_BLOCK_SIZE', 2), mock.patch.object(matching, 'COLUMN_BLOCK_SIZE', 3):
+            stats = matching.rescore_all_matches(min_score=0)
+
+        expected = self._expected()
+        self.assertEqual(self._stored(), expected)
+        self.assertEqual(stats['matches'], len(expected))
+        # Blocks stop at the last plan that can overlap them instead of scanning every pair
+        self.assertLess(stats['pairs_scored'], len(self.plans) ** 2 // 2)
+
+    def test_min_score_filters_pairs(self):
+        matching.rescore_all_matches(min_score=60)
+
+        expected = {pair: score for pair, score in self._expected().items() if score >= 60}
+        self.assertTrue(expected)
+        self.assertEqual(self._stored(), expected)
+
+    def test_rescoring_upserts_keeps_decisions_and_expires_lost_pairs(self):
+        matching.rescore_all_matches(min_score=0)
+        first, second, third = self.plans[:3]
+        TravelMatch.objects.filter(travel_plan_1=first, travel_plan_2=second).update(
+            match_status='accepted', compatibility_score=1,
+        )
+        TravelPlan.objects.filter(pk=third.pk).update(destination='Sajek', destination_key='sajek')
+
+        stats = matching.rescore_all_matches(min_score=0)
+
+        accepted = TravelMatch.objects.get(travel_plan_1=first, travel_plan_2=second)
+        self.assertEqual(accepted.match_status, 'accepted')
+        self.assertEqual(accepted.compatibility_score, self._expected()[(first.pk, second.pk)])
+        self.assertEqual(TravelMatch.objects.count(), len(self._expected()) + 2)
+        self.assertEqual(stats['expired'], 2)
+        self.assertEqual(
+            set(self._stored(match_status='expired')),
+            {(first.pk, third.pk), (second.pk, third.pk)},
+        )
+
+
+class PlanMatchRefreshTests(MatchingFixture, TestCase):
+
+    def _plan_pairs(self, plan):
+        return {pair: score for pair, score in self._expected().items() if plan.pk in pair}
+
+    def test_refresh_scores_only_the_plans_candidates(self):
+        plan = self.plans[0]
+
+        stats = matching.refresh_plan_matches(plan, min_score=0)
+
+        self.assertEqual(self._stored(), self._plan_pairs(plan))
+        self.assertEqual(stats['candidates'], 2)  # The other overlapping Cox's Bazar plans
+
+    def test_refresh_after_an_edit_expires_pairs_the_plan_lost(self):
+        plan, other = self.plans[0], self.plans[5]
+        matching.refresh_plan_matches(plan, min_score=0)
+        matching.refresh_plan_matches(other, min_score=0)
+
+        plan.destination = 'Sylhet'
+        plan.save()
+        stats = matching.refresh_plan_matches(plan, min_score=0)
+
+        self.assertEqual(stats['expired'], 2)
+        self.assertEqual(set(self._stored(match_status='pending')), set(self._plan_pairs(plan)) | set(self._plan_pairs(other)))
+        self.assertEqual(set(self._stored(match_status='expired')), {(plan.pk, self.plans[1].pk), (plan.pk, self.plans[2].pk)})
+
+    def test_unmatchable_plan_expires_only_its_pending_matches(self):
+        plan = self.plans[0]
+        matching.rescore_all_matches(min_score=0)
+        TravelMatch.objects.filter(travel_plan_1=plan, travel_plan_2=self.plans[1]).update(match_status='accepted')
+        plan.is_active = False
+        plan.save()
+
+        stats = matching.refresh_plan_matches(plan)
+
+        self.assertEqual(stats, {'candidates': 0, 'matches': 0, 'expired': 1})
+        self.assertEqual(set(self._stored(match_status='expired')), {(plan.pk, self.plans[2].pk)})
+
+        sylhet = TravelMatch.objects.filter(travel_plan_1__destination_key='sylhet', match_status='pending')
+        self.assertEqual(sylhet.count(), 2)
+        self.assertEqual(matching.expire_plan_matches([self.plans[5].pk]), 2)
+        self.assertFalse(sylhet.exists())
+
+    def test_database_error_while_refreshing_keeps_the_edit(self):
+        self.users[0].userprofile.verification_status = 'verified'
+        self.users[0].userprofile.save()
+        self.client.force_login(self.users[0])
+        plan = self.plans[0]
+
+        with mock.patch('trips.views.refresh_plan_matches', side_effect=DatabaseError('boom')), \
+                self.assertLogs('trips.views', 'ERROR'):
+            response = self.client.post(reverse('edit_travel_plan', args=[plan.pk]), {
+                'destination': 'Sylhet', 'start_date': plan.start_date, 'end_date': plan.end_date,
+                'purpose': plan.purpose, 'budget_range': plan.budget_range, 'max_participants': 3,
+            })
+
+        self.assertRedirects(response, reverse('my_trips'), fetch_redirect_response=False)
+        plan.refresh_from_db()
+        self.assertEqual(plan.destination, 'Sylhet')
+
+    def test_other_errors_while_refreshing_propagate(self):
+        with mock.patch('trips.views.refresh_plan_matches', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                views._refresh_matches(self.plans[0])
+
+
+class LifecycleTests(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.owner = User.objects.create_user('organizer')
+        self.paid_trip = _trip(capacity=50)  # Payment.trip is required, so payments need some trip
+
+    def _plan(self, status='finalized', payers=0, agreed=0, overdue=False, **fields):
+        """A plan with ``payers`` agreed and paid users and ``agreed`` more who agreed but never paid"""
+        count = TravelPlan.objects.count()
+        plan = TravelPlan.objects.create(
+            user=self.owner, destination=f'Sylhet {count}', start_date=date(2030, 3, 1), end_date=date(2030, 3, 4),
+            purpose='leisure', budget_range='mid-range', max_participants=3, status=status,
+            payment_deadline=self.now + timedelta(hours=-1 if overdue else 1), final_cost_per_person=5000,
+            platform_commission=500, **fields,
+        )
+        for i in range(payers + agreed):
+            user = User.objects.create_user(f'payer{count}_{i}')
+            TravelPlanInterest.objects.create(plan=plan, user=user, agreed=True)
+            if i < payers:
+                Payment.objects.create(
+                    trip=self.paid_trip, user=user, total_amount=5000, platform_commission=500,
+                    payment_method='sslcommerz', payment_status='completed', transaction_id=f'TXN-{count}-{i}',
+                )
+        return plan
+
+    def _status(self, plan):
+        plan.refresh_from_db()
+        return plan.status
+
+    def test_close_expired_plans_closes_only_past_join_windows(self):
+        expired = self._plan(status='open', join_deadline=self.now - timedelta(minutes=1))
+        running = self._plan(status='open', join_deadline=self.now + timedelta(minutes=1))
+
+        self.assertEqual(lifecycle.close_expired_plans(self.now), 1)
+        self.assertEqual((self._status(expired), self._status(running)), ('closed', 'open'))
+
+    def test_overdue_plans_without_two_payers_are_rejected(self):
+        overdue = self._plan(payers=1, agreed=2, overdue=True)
+        waiting = self._plan(payers=1)
+
+        self.assertEqual(lifecycle.settle_finalized_plans(self.now), (1, 0, 0))
+        self.assertEqual((self._status(overdue), self._status(waiting)), ('rejected', 'finalized'))
+
+    def test_full_or_overdue_plans_become_trips_with_their_payers(self):
+        driver = Driver.objects.create(
+            name='Rina', phone_number='01700000000', license_number='DL-1', vehicle_details='Hiace',
+            payment_rate=3000, emergency_contact='01800000000',
+        )
+        full = self._plan(payers=3, transportation_details='AC bus', itinerary='Tea gardens', assigned_driver=driver)
+        overdue = self._plan(payers=2, agreed=1, overdue=True)
+        waiting = self._plan(payers=2)
+
+        self.assertEqual(lifecycle.settle_finalized_plans(self.now), (0, 2, 5))
+
+        self.assertEqual(
+            [self._status(full), self._status(overdue), self._status(waiting)], ['approved', 'approved', 'finalized'],
+        )
+        trip = OrganizedTrip.objects.get(travel_plan=full)
+        self.assertEqual((trip.trip_status, trip.total_participants, trip.base_cost), ('confirmed', 3, 15000))
+        self.assertEqual((trip.transportation_details, trip.itinerary, trip.driver), ('AC bus', 'Tea gardens', driver))
+        self.assertEqual((trip.final_cost_per_person, trip.platform_commission), (5000, 500))
+        departure, return_time = timezone.localtime(trip.departure_time), timezone.localtime(trip.return_time)
+        self.assertEqual((departure.date(), departure.hour), (date(2030, 3, 1), 9))
+        self.assertEqual((return_time.date(), return_time.hour), (date(2030, 3, 4), 18))
+        self.assertEqual(TripParticipant.objects.filter(trip=trip, payment_status='paid').count(), 3)
+        self.assertEqual(TripParticipant.objects.filter(trip__travel_plan=overdue).count(), 2)
+        self.assertEqual(
+            set(LifecycleDeadline.objects.filter(object_id=trip.pk).values_list('kind', flat=True)),
+            {'departure', 'return'},
+        )
+
+    def test_settling_takes_the_same_queries_for_any_number_of_plans(self):
+        def settle():
+            with CaptureQueriesContext(connection) as queries:
+                lifecycle.settle_finalized_plans(self.now)
+            return len(queries)
+
+        self._plan(payers=3)
+        self._plan(payers=1, overdue=True)
+        few = settle()
+        for _ in range(3):
+            self._plan(payers=3)
+            self._plan(payers=2, overdue=True)
+            self._plan(payers=0, overdue=True)
+
+        self.assertEqual(settle(), few)
+        self.assertEqual(OrganizedTrip.objects.exclude(pk=self.paid_trip.pk).count(), 7)
+
+    def test_trips_advance_by_their_dates(self):
+        hour = timedelta(hours=1)
+        cases = [  # (status before, departs, returns, status after)
+            ('confirmed', self.now + hour, self.now + 2 * hour, 'confirmed'),
+            ('confirmed', self.now - hour, self.now + hour, 'ongoing'),
+            ('confirmed', self.now - 2 * hour, self.now - hour, 'completed'),
+            ('ongoing', self.now - 2 * hour, self.now - hour, 'completed'),
+            ('cancelled', self.now - 2 * hour, self.now - hour, 'cancelled'),
+        ]
+        trips = []
+        for i, (status, departs, returns, _) in enumerate(cases):
+            trip = _trip(capacity=2 + i)
+            OrganizedTrip.objects.filter(pk=trip.pk).update(trip_status=status, departure_time=departs, return_time=returns)
+            trips.append(trip)
+
+        self.assertEqual(lifecycle.advance_trip_statuses(self.now), (1, 2))
+        self.assertEqual(
+            [OrganizedTrip.objects.get(pk=trip.pk).trip_status for trip in trips], [after for *_, after in cases],
+        )
+
+
+class LifecycleSchedulerTests(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.scheduler = LifecycleScheduler(poll_interval=0, error_backoff=0)
+
+    def _deadline(self, kind='join', object_id=1, **fields):
+        return LifecycleDeadline.objects.create(kind=kind, object_id=object_id, due_at=self.now + timedelta(hours=1), **fields)
+
+    def test_rows_committed_out_of_id_order_are_still_pulled(self):
+        self._deadline(id=10)
+        self.assertEqual(self.scheduler.pull_new_deadlines(), 1)
+
+        self._deadline(id=5, object_id=2)  # An older transaction committing after the pull
+
+        self.assertEqual(self.scheduler.pull_new_deadlines(), 1)
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertFalse(LifecycleDeadline.objects.exists())
+
+    def test_failing_handler_does_not_stop_the_others(self):
+        self.scheduler._last_sweep = time.monotonic()
+        self.scheduler.schedule('join', 1, self.now - timedelta(minutes=1))
+        self.scheduler.schedule('payment', 2, self.now - timedelta(minutes=1))
+        fired = []
+        handlers = {'join': mock.Mock(side_effect=DatabaseError), 'payment': lambda now, ids: fired.append(ids) or 1}
+
+        with mock.patch.dict(scheduler.HANDLERS, handlers), self.assertLogs('trips.scheduler', 'ERROR'):
+            self.assertEqual(self.scheduler.run_due(self.now), 1)
+
+        self.assertEqual(fired, [[2]])
+        self.assertEqual(self.scheduler._last_sweep, 0.0)  # The next tick sweeps up the failed join
+
+    def test_loop_survives_failing_iterations(self):
+        lease = mock.Mock(ttl=timedelta(seconds=30))
+        ticks = iter([DatabaseError('connection lost'), IntegrityError('duplicate trip'), None, None])
+
+        def tick():
+            error = next(ticks)
+            if error:
+                raise error
+
+        with mock.patch.object(self.scheduler, 'tick', side_effect=tick) as ticked, \
+                mock.patch.object(self.scheduler, 'bootstrap') as bootstrap, \
+                self.assertLogs('trips.scheduler', 'ERROR') as logs:
+            self.scheduler.run_forever(lease, should_stop=lambda: ticked.call_count >= 4)
+
+        self.assertEqual(ticked.call_count, 4)
+        self.assertEqual(bootstrap.call_count, 1)
+        self.assertEqual(len(logs.records), 2)
+
+    def test_scheduler_and_cron_share_one_lease(self):
+        plan = TravelPlan.objects.create(
+            user=User.objects.create_user('planner'), destination='Sylhet', start_date=date(2030, 1, 10),
+            end_date=date(2030, 1, 12), purpose='leisure', budget_range='mid-range',
+            join_deadline=self.now - timedelta(minutes=1),
+        )
+        held = JobLease(lifecycle.LEASE_NAME)
+        self.assertTrue(held.acquire())
+
+        out = StringIO()
+        call_command('auto_update_trips', stdout=out)
+
+        self.assertIn('holds the lease; skipping', out.getvalue())
+        plan.refresh_from_db()
+        self.assertEqual(plan.status, 'open')
+
+        held.release()
+        call_command('auto_update_trips', stdout=StringIO())
+        plan.refresh_from_db()
+        self.assertEqual(plan.status, 'closed')
+
+    def test_saves_that_keep_the_deadline_record_nothing(self):
+        plan = TravelPlan.objects.create(
+            user=User.objects.create_user('planner'), destination='Sylhet', start_date=date(2030, 1, 10),
+            end_date=date(2030, 1, 12), purpose='leisure', budget_range='mid-range',
+        )
+        self.assertEqual(LifecycleDeadline.objects.count(), 1)
+
+        plan.description = 'Tea gardens'
+        plan.save()
+        reloaded = TravelPlan.objects.get(pk=plan.pk)
+        reloaded.save()
+        self.assertEqual(LifecycleDeadline.objects.count(), 1)
+
+        reloaded.join_deadline += timedelta(minutes=10)
+        reloaded.save()
+        reloaded.status, reloaded.payment_deadline = 'finalized', self.now + timedelta(days=1)
+        reloaded.save()
+        self.assertEqual(list(LifecycleDeadline.objects.values_list('kind', flat=True)), ['join', 'join', 'payment'])
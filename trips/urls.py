@@ -22,6 +22,8 @@ urlpatterns = [
     path('organized/<int:trip_id>/', views.organized_trip_detail_view, name='organized_trip_detail'),
     path('organized/<int:trip_id>/join/', views.join_organized_trip_view, name='join_organized_trip'),
     path('organized/<int:trip_id>/leave/', views.leave_organized_trip_view, name='leave_organized_trip'),
+    path('organized/<int:trip_id>/waitlist/', views.join_trip_waitlist_view, name='join_trip_waitlist'),
+    path('organized/<int:trip_id>/waitlist/leave/', views.leave_trip_waitlist_view, name='leave_trip_waitlist'),
      # Payment routes now handled by payments app
     path('organized/<int:trip_id>/pay/', views.initiate_payment_view, name='pay_organized_trip'),
     path('organized/<int:trip_id>/cancel-payment/', views.cancel_payment_view, name='cancel_payment'),
@@ -1,13 +1,33 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
-from .models import TravelPlan, OrganizedTrip, TripParticipant, TravelMatch, TravelPlanInterest
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from .models import TravelPlan, OrganizedTrip, TripParticipant, TravelMatch, TravelPlanInterest, TripWaitlistEntry
 from .forms import TravelPlanForm, TripSearchForm, JoinTripForm
 from datetime import date, date, timedelta, datetime
 from users.models import UserProfile
 from users.decorators import verification_required
 from django.utils import timezone
+from .matching import refresh_plan_matches
+from . import interests, search, seats
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _refresh_matches(travel_plan):
+    """Rescore a saved plan's matches; a database error rolls back only the rescoring.
+
+    The plan itself is already saved and the next full ``rescore_matches`` run
+    scores it again, so the request still succeeds.
+    """
+    try:
+        with transaction.atomic():
+            refresh_plan_matches(travel_plan)
+    except DatabaseError:
+        logger.exception("Failed to refresh matches for plan %s", travel_plan.plan_id)
 
 
 @login_required
@@ -23,73 +43,53 @@ def my_trips_view(request):
     
     now = timezone.now()
     today = timezone.localdate()  
-    
-    user_plans = TravelPlan.objects.filter(user=request.user)
-    
-    
-    participations = TripParticipant.objects.filter(user=request.user).select_related('trip')
 
-    total_co_travelers = sum(
-        p.trip.total_participants - 1  
-        for p in participations 
-        if p.trip
+    # A fixed handful of queries however many plans and trips the user has:
+    # plans (interest counts are columns), participations with their trips, one
+    # aggregate for the trip statistics and one count of matched buddies
+    user_plans = list(TravelPlan.objects.filter(user=request.user))
+    participations = list(
+        TripParticipant.objects.filter(user=request.user).select_related('trip', 'trip__driver')
     )
-    
-    active_participations = participations.filter(
-        trip__departure_time__lte=now,
-        trip__return_time__gte=now
-    ) 
-    
-    user_plan_ids = user_plans.values_list('plan_id', flat=True)
+
+    finished = Q(trip__return_time__lt=now)
+    stats = TripParticipant.objects.filter(user=request.user).aggregate(
+        total_co_travelers=Coalesce(Sum(F('trip__total_participants') - 1), 0),
+        completed_trips_count=Count('pk', filter=finished),
+        places_visited=Count('trip__destination', filter=finished, distinct=True),
+        travel_buddies_met=Coalesce(Sum(F('trip__total_participants') - 1, filter=finished), 0),
+    )
+
+    user_plan_ids = [plan.plan_id for plan in user_plans]
     matched_buddies = TravelMatch.objects.filter(
         Q(travel_plan_1_id__in=user_plan_ids) | Q(travel_plan_2_id__in=user_plan_ids),
         match_status='accepted'
-    ).count()
-    
-    
-    next_trip = user_plans.filter(
-        start_date__gte=today,
-        is_active=True
-    ).order_by('start_date').first()
+    ).count() if user_plan_ids else 0
 
-    
-    next_organized_trip = participations.filter(
-        trip__departure_time__gte=now,
-        payment_status='paid'  
-    ).order_by('trip__departure_time').first()
-    
-    
-    past_trips = participations.filter(
-        trip__return_time__lt=now
+    next_trip = min(
+        (plan for plan in user_plans if plan.is_active and plan.start_date >= today),
+        key=lambda plan: plan.start_date,
+        default=None,
     )
-
-    
-    completed_trips_count = past_trips.count()
-    places_visited = past_trips.values('trip__destination').distinct().count()
-    
-
-    travel_buddies_met = sum(
-        p.trip.total_participants - 1
-        for p in past_trips
-        if p.trip
+    next_organized_trip = min(
+        (p for p in participations if p.payment_status == 'paid' and p.trip.departure_time >= now),
+        key=lambda p: p.trip.departure_time,
+        default=None,
     )
-
+    active_participations = [
+        p for p in participations if p.trip.departure_time <= now <= p.trip.return_time
+    ]
+    past_trips = [p for p in participations if p.trip.return_time < now]
 
     context = {
         'user_plans': user_plans,
         'participations': participations,
-        'total_co_travelers': total_co_travelers,
         'matched_buddies': matched_buddies,
         'next_trip': next_trip,
         'next_organized_trip': next_organized_trip,  
         'past_trips': past_trips,
-        'completed_trips_count': completed_trips_count,
-        'places_visited': places_visited,
-        'travel_buddies_met': travel_buddies_met,
-        'plan_interest_counts': {
-            plan.plan_id: TravelPlanInterest.objects.filter(plan=plan).count()
-            for plan in user_plans
-        },
+        **stats,
+        'plan_interest_counts': {plan.plan_id: plan.interest_count for plan in user_plans},
         'profile': profile, 
         'active_participations': active_participations,
         'user': request.user,
@@ -115,6 +115,7 @@ def create_travel_plan_view(request):
             travel_plan = form.save(commit=False)
             travel_plan.user = request.user
             travel_plan.save()
+            _refresh_matches(travel_plan)
             messages.success(request, 'Travel plan created successfully! We will match you with compatible travelers.')
             return redirect('my_trips')
         else:
@@ -148,7 +149,8 @@ def edit_travel_plan_view(request, plan_id):
     if request.method == 'POST':
         form = TravelPlanForm(request.POST, instance=travel_plan)
         if form.is_valid():
-            form.save()
+            travel_plan = form.save()
+            _refresh_matches(travel_plan)
             messages.success(request, 'Travel plan updated successfully!')
             return redirect('my_trips')
         else:
@@ -217,7 +219,7 @@ def find_travel_buddies_view(request):
         purpose = form.cleaned_data.get('purpose')
         
         if destination:
-            travel_plans = travel_plans.filter(destination__icontains=destination)
+            travel_plans = search.matching_destination(travel_plans, destination)
         if start_date:
             travel_plans = travel_plans.filter(start_date__gte=start_date)
         if budget_range:
@@ -226,13 +228,27 @@ def find_travel_buddies_view(request):
             travel_plans = travel_plans.filter(purpose=purpose)
     
     # Only show future trips
-    travel_plans = travel_plans.filter(start_date__gte=date.today()).select_related('user', 'user__userprofile').order_by('-created_at')
-    
-    
-    
+    travel_plans = travel_plans.filter(start_date__gte=date.today()).select_related(
+        'user', 'user__userprofile'
+    ).prefetch_related('interests__user')
+
+    # Keyset pagination in the chosen order: ?sort=<recent|popular>&before=<value>&before_id=<id>
+    sort = request.GET.get('sort')
+    if sort not in search.SORTS:
+        sort = search.DEFAULT_SORT
+    before, before_id = search.parse_cursor(sort, request.GET.get('before', ''), request.GET.get('before_id', ''))
+    travel_plans, next_cursor = search.keyset_page(travel_plans, before, before_id, sort=sort)
+
+    filters = request.GET.copy()
+    for key in ('before', 'before_id'):
+        filters.pop(key, None)
+
     context = {
         'form': form,
         'travel_plans': travel_plans,
+        'next_cursor': next_cursor,
+        'filters': filters.urlencode(),
+        'sort': sort,
         'profile': profile,
         'user': request.user,
     }
@@ -283,7 +299,7 @@ def travel_plan_detail_view(request, plan_id):
         'travel_plan': travel_plan,
         'is_owner': travel_plan.user == request.user,
         'user_interested': user_interested,
-        'interest_count': interested_users.count(),
+        'interest_count': travel_plan.interest_count,
         'interested_users': interested_users,
         'profile': profile,
         'user': request.user,
@@ -306,7 +322,7 @@ def express_interest_view(request, plan_id):
         messages.error(request, 'This plan is closed for new interests.')
         return redirect('travel_plan_detail', plan_id=plan_id)
 
-    TravelPlanInterest.objects.get_or_create(plan=plan, user=request.user)
+    interests.express(plan, request.user)
     messages.success(request, 'Interest recorded! You will see updates here.')
     return redirect('travel_plan_detail', plan_id=plan_id)
 
@@ -320,7 +336,7 @@ def withdraw_interest_view(request, plan_id):
     if not interest:
         messages.info(request, 'You have not joined this plan.')
         return redirect('travel_plan_detail', plan_id=plan_id)
-    interest.delete()
+    interests.withdraw(interest)
     messages.success(request, 'You have withdrawn your interest.')
     return redirect('travel_plan_detail', plan_id=plan_id)
 
@@ -338,7 +354,7 @@ def organized_trips_view(request):
     # Get only trips the user has joined
     user_participations = TripParticipant.objects.filter(
         user=request.user
-    ).select_related('trip', 'trip__driver').order_by('trip__departure_time')
+    ).select_related('trip', 'trip__driver', 'trip__travel_plan').order_by('trip__departure_time')
     
     # Extract trips from participations
     organized_trips = [p.trip for p in user_participations]
@@ -400,11 +416,16 @@ def organized_trip_detail_view(request, trip_id):
             refund_deadline = latest_payment.payment_date + timedelta(minutes=5)
             can_refund = timezone.now() < refund_deadline
 
+    waitlist_entry = None
+    if not user_participation:
+        waitlist_entry = TripWaitlistEntry.objects.filter(trip=trip, user=request.user).first()
+
     context = {
         'trip': trip,
         'user_participation': user_participation,
         'participants': participants,
         'available_slots': trip.available_slots(),
+        'waitlist_position': seats.waitlist_position(waitlist_entry) if waitlist_entry else None,
         'profile': profile,
         'user': request.user,
         'can_refund': can_refund,
@@ -431,8 +452,8 @@ def join_organized_trip_view(request, trip_id):
 
     trip = get_object_or_404(OrganizedTrip, trip_id=trip_id)
     
-    # Check if already joined
-    if TripParticipant.objects.filter(trip=trip, user=request.user).exists():
+    # Check if already joined; a refunded place can be taken again
+    if TripParticipant.objects.filter(trip=trip, user=request.user).exclude(payment_status='refunded').exists():
         messages.warning(request, 'You have already joined this trip.')
         return redirect('organized_trip_detail', trip_id=trip_id)
     
@@ -442,7 +463,11 @@ def join_organized_trip_view(request, trip_id):
         return redirect('organized_trip_detail', trip_id=trip_id)
     
     if trip.available_slots() <= 0:
-        messages.error(request, 'This trip is full.')
+        # Seats held past their expiry go to the waitlist first
+        seats.release_expired_holds(timezone.now(), trip_ids=[trip.pk])
+        trip.refresh_from_db(fields=['total_participants'])
+    if trip.available_slots() <= 0:
+        messages.error(request, 'This trip is full. Join the waitlist to get the next free seat.')
         return redirect('organized_trip_detail', trip_id=trip_id)
     
     if request.method == 'POST':
@@ -456,22 +481,23 @@ def join_organized_trip_view(request, trip_id):
         
         if form.is_valid():
             print("Creating participant...")
-            # CREATE PARTICIPANT with pending payment status
-            participant = TripParticipant.objects.create(
-                trip=trip,
-                user=request.user,
-                emergency_contact=form.cleaned_data.get('emergency_contact'),
-                special_requirements=form.cleaned_data.get('special_requirements'),
-                amount_paid=0,
-                payment_status='pending'
-            )
+            # CREATE PARTICIPANT with pending payment status, holding a seat until paid
+            try:
+                participant = seats.reserve(
+                    trip,
+                    request.user,
+                    emergency_contact=form.cleaned_data.get('emergency_contact'),
+                    special_requirements=form.cleaned_data.get('special_requirements'),
+                    amount_paid=0,
+                )
+            except IntegrityError:
+                messages.warning(request, 'You have already joined this trip.')
+                return redirect('organized_trip_detail', trip_id=trip_id)
+            if participant is None:
+                messages.error(request, 'Sorry, the last seat on this trip was just taken. Join the waitlist to get the next one.')
+                return redirect('organized_trip_detail', trip_id=trip_id)
             print(f"Participant created: {participant.participant_id}")
             
-            # Update total participants
-            trip.total_participants += 1
-            trip.save()
-            print(f"Trip participants updated to: {trip.total_participants}")
-            
             messages.success(request, 'Registration complete! Please proceed to payment.')
             
             print(f"Redirecting to trip_payment with trip_id={trip_id}")
@@ -510,10 +536,8 @@ def leave_organized_trip_view(request, trip_id):
             messages.error(request, 'Cannot leave - trip is already underway.')
             return redirect('organized_trip_detail', trip_id=trip_id)
         
-        # Delete participant
-        participant.delete()
-        trip.total_participants -= 1
-        trip.save()
+        # Delete participant and free the seat
+        seats.leave(participant)
         
         messages.success(request, 'You have left the trip.')
         return redirect('organized_trips')
@@ -529,6 +553,40 @@ def leave_organized_trip_view(request, trip_id):
     
 
 
+@login_required
+def join_trip_waitlist_view(request, trip_id):
+    """Queue for the next free seat on a full trip"""
+    trip = get_object_or_404(OrganizedTrip, trip_id=trip_id)
+
+    if request.method == 'POST':
+        if TripParticipant.objects.filter(trip=trip, user=request.user).exclude(payment_status='refunded').exists():
+            messages.warning(request, 'You have already joined this trip.')
+        elif trip.trip_status not in seats.JOINABLE_STATUSES:
+            messages.error(request, 'This trip is not open for registration.')
+        else:
+            seats.join_waitlist(trip, request.user)
+            # A seat may have been free or freed since the page loaded; hand it out now
+            if any(participant.user_id == request.user.pk for participant in seats.promote([trip.pk])):
+                messages.success(request, "A seat is free and it's yours! Complete your payment to keep it.")
+                return redirect('trip_payment', trip_id=trip_id)
+            position = seats.join_waitlist(trip, request.user)  # Still queued; rejoining keeps the place
+            messages.success(request, f"You're #{position} on the waitlist. We'll notify you when a seat opens up.")
+
+    return redirect('organized_trip_detail', trip_id=trip_id)
+
+
+@login_required
+def leave_trip_waitlist_view(request, trip_id):
+    """Give up a place on a trip's waitlist"""
+    trip = get_object_or_404(OrganizedTrip, trip_id=trip_id)
+
+    if request.method == 'POST':
+        seats.leave_waitlist(trip, request.user)
+        messages.success(request, 'You have left the waitlist.')
+
+    return redirect('organized_trip_detail', trip_id=trip_id)
+
+
 @login_required
 
 def trip_matches_view(request):
@@ -597,15 +655,10 @@ def agree_plan_details_view(request, plan_id):
             messages.error(request, 'You must express interest in the plan first.')
             return redirect('travel_plan_detail', plan_id=plan_id)
     else:
-        interest, created = TravelPlanInterest.objects.get_or_create(
-            plan=plan,
-            user=request.user
-        )
+        interest, created = interests.express(plan, request.user)
     
     
-    interest.agreed = True
-    interest.agreed_at = timezone.now()
-    interest.save()
+    interests.agree(interest)
     
    
     plan.payment_deadline = timezone.now() + timedelta(minutes=5)
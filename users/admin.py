@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 from django.utils.html import format_html
-from .models import UserProfile, UserConnection, Notification, SupportTicket
+from .models import UserProfile, UserConnection, Notification, SupportTicket, OutboxEmail
+from . import verification
 
 admin.site.unregister(User)
 
@@ -58,12 +59,17 @@ class UserProfileAdmin(admin.ModelAdmin):
 
     def approve_verification(self, request, queryset):
         from django.utils import timezone
+        # Read the users first: a changelist filtered by status no longer matches them after the update
+        user_ids = list(queryset.values_list('user_id', flat=True))
         count = queryset.update(verification_status='verified', verified_at=timezone.now())
+        verification.invalidate(user_ids)
         self.message_user(request, f"{count} user(s) verified successfully.")
     approve_verification.short_description = "Approve selected verifications"
 
     def reject_verification(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         count = queryset.update(verification_status='rejected')
+        verification.invalidate(user_ids)
         self.message_user(request, f"{count} verification(s) rejected.")
     reject_verification.short_description = "Reject selected verifications"
 
@@ -146,3 +152,17 @@ class SupportTicketAdmin(admin.ModelAdmin):
         ('Issue Details', {'fields': ('subject', 'category', 'priority', 'message')}),
         ('Admin Response', {'fields': ('admin_response',)}),
     )
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'dedup_key', 'last_error']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        from django.utils import timezone
+        count = queryset.exclude(status='sent').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f"{count} email(s) queued for another attempt.")
+    retry_now.short_description = "Retry selected emails now"
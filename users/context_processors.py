@@ -1,20 +1,17 @@
 from .models import Notification
+from . import counters
 
 
 def notifications(request):
     """Add unread notifications count to all templates"""
     if request.user.is_authenticated:
-        unread_count = Notification.objects.filter(
-            recipient=request.user,
-            is_read=False
-        ).count()
-
+        # Lazy queryset: only hits the database if a template iterates it
         recent_notifications = Notification.objects.filter(
             recipient=request.user
         )[:5]
 
         return {
-            'unread_notifications_count': unread_count,
+            'unread_notifications_count': counters.for_request(request)['unread_notifications_count'],
             'recent_notifications': recent_notifications,
         }
     return {
@@ -0,0 +1,73 @@
+"""Per-user badge counters shown on every page, kept in the cache.
+
+Model signals adjust the cached values in place. Writes that bypass signals
+(queryset ``update()``, ``bulk_create``) call ``invalidate`` instead, and a
+missing key is recounted from the database on the next read.
+
+Adjustments and invalidations come from every web worker and from the
+background processes (lifecycle scheduler, cron commands), so the counters
+are only right with a cache all of them share: Redis via ``REDIS_URL`` in
+deployments. The per-process fallback cache is for single-process use.
+"""
+from django.apps import apps
+from django.core.cache import cache
+
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _counter(model_label, user_field, **filters):
+    def count(user_id):
+        model = apps.get_model(model_label)
+        return model.objects.filter(**{user_field: user_id}, **filters).count()
+    return count
+
+
+COUNTERS = {
+    'user_plans_count': _counter('trips.TravelPlan', 'user_id'),
+    'total_trips_count': _counter('trips.TripParticipant', 'user_id'),
+    'user_payments_count': _counter('trips.Payment', 'user_id'),
+    'unread_notifications_count': _counter('users.Notification', 'recipient_id', is_read=False),
+    'unread_messages_count': _counter('chat.Message', 'recipient_id', is_read=False),
+}
+
+
+def _key(user_id, name):
+    return f'counters:{user_id}:{name}'
+
+
+def get_counters(user_id):
+    """All counters for a user in one cache round trip, recounting any that are missing"""
+    keys = {_key(user_id, name): name for name in COUNTERS}
+    values = {keys[key]: value for key, value in cache.get_many(keys).items()}
+
+    missing = {name: count(user_id) for name, count in COUNTERS.items() if name not in values}
+    if missing:
+        cache.set_many({_key(user_id, name): value for name, value in missing.items()}, CACHE_TIMEOUT)
+        values.update(missing)
+    return values
+
+
+def for_request(request):
+    """Counters for the logged-in user, fetched at most once per request"""
+    if not hasattr(request, '_user_counters'):
+        request._user_counters = get_counters(request.user.pk)
+    return request._user_counters
+
+
+def adjust(user_id, name, delta):
+    """Atomically add ``delta`` to a cached counter; a no-op if it is not cached"""
+    key = _key(user_id, name)
+    try:
+        value = cache.incr(key, delta) if delta >= 0 else cache.decr(key, -delta)
+    except ValueError:
+        return  # Not cached: the next read recounts
+    if value < 0:
+        cache.delete(key)
+
+
+def invalidate(user_ids, *names):
+    """Drop cached counters so the next read recounts them"""
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+    cache.delete_many([_key(user_id, name) for user_id in user_ids for name in (names or COUNTERS)])
@@ -0,0 +1,43 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+
+from shetrip import benchmark
+
+
+class Command(BaseCommand):
+    help = "Time the key pages (query counts, p50/p95 latency) and write the results to a JSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to browse as (default: the verified user with the most trips)')
+        parser.add_argument('--views', nargs='+', default=benchmark.VIEWS, help='URL names to benchmark')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per view (default: 20)')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per view first (default: 2)')
+        parser.add_argument('--label', default='', help='Release or branch name stored with the results')
+        parser.add_argument('--output', default='benchmark.json', help='Results file (default: benchmark.json)')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = benchmark.busiest_user()
+        if user is None:
+            raise CommandError('No user to benchmark as; run seed_scale first or pass --user')
+
+        setup_test_environment()  # Lets the test client through ALLOWED_HOSTS
+        report = benchmark.run(
+            user, views=options['views'], repeat=options['repeat'], warmup=options['warmup'],
+            label=options['label'],
+        )
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+
+        for name, result in report['views'].items():
+            style = self.style.SUCCESS if result['status'] == 200 else self.style.WARNING
+            self.stdout.write(style(
+                f"{name:<22} {result['status']}  {result['queries']:>3} queries  "
+                f"p50 {result['p50_ms']:>8.1f} ms  p95 {result['p95_ms']:>8.1f} ms"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"✓ Results written to {options['output']}"))
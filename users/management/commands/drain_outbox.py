@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users import outbox
+
+
+PURGE_INTERVAL = 3600  # Seconds between purges of old sent emails in --loop mode
+
+
+class Command(BaseCommand):
+    help = ("Deliver queued transactional emails from the outbox in batches over one SMTP connection, "
+            "and delete sent ones older than the retention window.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE,
+                            help=f'Emails per batch and connection (default: {outbox.BATCH_SIZE})')
+        parser.add_argument('--max-attempts', type=int, default=outbox.MAX_ATTEMPTS,
+                            help=f'Attempts before an email is dead-lettered (default: {outbox.MAX_ATTEMPTS})')
+        parser.add_argument('--loop', action='store_true', help='Keep draining instead of exiting when empty')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait when the outbox is empty in --loop mode (default: 2)')
+
+    def handle(self, *args, **options):
+        total_sent = total_retried = total_dead = total_purged = 0
+        last_purge = None
+        try:
+            while True:
+                # Sent bodies hold password-reset links; don't keep them around
+                if last_purge is None or time.monotonic() - last_purge >= PURGE_INTERVAL:
+                    total_purged += outbox.purge_sent(timezone.now())
+                    last_purge = time.monotonic()
+
+                started = time.perf_counter()
+                sent, retried, dead = outbox.drain(options['batch_size'], options['max_attempts'])
+                total_sent += sent
+                total_retried += retried
+                total_dead += dead
+
+                if sent or retried or dead:
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    self.stdout.write(
+                        f'Batch: {sent} sent, {retried} to retry, {dead} dead-lettered ({elapsed_ms:.0f} ms)'
+                    )
+                    continue  # More may be due right away
+
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Outbox drained: {total_sent} sent, {total_retried} to retry, {total_dead} dead-lettered, '
+            f'{total_purged} old sent emails deleted'
+        ))
@@ -1,7 +1,7 @@
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.contrib import messages
-from users.models import UserProfile
+from users import verification
 
 class VerificationMiddleware:
     """
@@ -63,33 +63,32 @@ class VerificationMiddleware:
         
         # Only check verification for protected URLs
         if current_url in self.PROTECTED_URLS:
-            try:
-                profile = request.user.userprofile
-                is_social = hasattr(request.user, 'socialaccount_set') and request.user.socialaccount_set.exists()
-                
-                # Handle different verification statuses
-                if profile.verification_status == 'not_submitted':
-                    if is_social:
-                        messages.warning(request, 'Please complete identity verification to continue.')
-                    else:
-                        messages.warning(request, 'Identity verification required to access features.')
-                    return redirect('verification')
-                    
-                elif profile.verification_status == 'pending':
-                    messages.info(request, 'Your verification is under review. Please wait for admin approval.')
-                    return redirect('verification')
-                    
-                elif profile.verification_status == 'rejected':
-                    messages.error(request, 'Your verification was rejected. Please submit valid documents.')
-                    return redirect('verification')
-                    
-                elif profile.verification_status != 'verified':
-                    messages.error(request, 'Invalid verification status. Please contact support.')
-                    return redirect('verification')
-                    
-            except UserProfile.DoesNotExist:
+            state = verification.for_request(request)
+            status = state['status']
+
+            # Handle different verification statuses
+            if status == verification.NO_PROFILE:
                 messages.warning(request, 'Please complete your profile verification.')
                 return redirect('verification')
 
+            elif status == 'not_submitted':
+                if state['is_social']:
+                    messages.warning(request, 'Please complete identity verification to continue.')
+                else:
+                    messages.warning(request, 'Identity verification required to access features.')
+                return redirect('verification')
+
+            elif status == 'pending':
+                messages.info(request, 'Your verification is under review. Please wait for admin approval.')
+                return redirect('verification')
+
+            elif status == 'rejected':
+                messages.error(request, 'Your verification was rejected. Please submit valid documents.')
+                return redirect('verification')
+
+            elif status != 'verified':
+                messages.error(request, 'Invalid verification status. Please contact support.')
+                return redirect('verification')
+
         # Allow access to non-protected URLs without verification
         return self.get_response(request)
\ No newline at end of file
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('connection_request', 'Connection Request'), ('connection_accepted', 'Connection Accepted'), ('connection_rejected', 'Connection Rejected'), ('trip_invitation', 'Trip Invitation'), ('message', 'New Message'), ('waitlist_promoted', 'Waitlist Seat Available')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_alter_notification_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-created_at'], name='users_notif_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient'], name='users_notif_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userconnection',
+            index=models.Index(fields=['to_user', 'status'], name='users_conn_incoming_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """login_view and signup look users up by email, which auth_user does not index"""
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS users_auth_user_email_idx ON auth_user (email)',
+            'DROP INDEX IF EXISTS users_auth_user_email_idx',
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='userprofile')
@@ -84,6 +85,10 @@ class UserConnection(models.Model):
     class Meta:
         unique_together = ('from_user', 'to_user')
         ordering = ['-created_at']
+        indexes = [
+            # Connections and requests received by a user
+            models.Index(fields=['to_user', 'status'], name='users_conn_incoming_idx'),
+        ]
 
     def __str__(self):
         return f"{self.from_user.username} -> {self.to_user.username} ({self.status})"
@@ -110,6 +115,7 @@ class Notification(models.Model):
         ('connection_rejected', 'Connection Rejected'),
         ('trip_invitation', 'Trip Invitation'),
         ('message', 'New Message'),
+        ('waitlist_promoted', 'Waitlist Seat Available'),
     ]
 
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -122,6 +128,13 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The newest-first notification list
+            models.Index(fields=['recipient', '-created_at'], name='users_notif_recent_idx'),
+            # Unread badge count and mark-all-read. Partial, because is_read=False
+            # compiles to NOT is_read, which SQLite cannot match to an index column
+            models.Index(fields=['recipient'], condition=models.Q(is_read=False), name='users_notif_unread_idx'),
+        ]
 
     def __str__(self):
         return f"{self.notification_type} for {self.recipient.username}"
@@ -169,4 +182,36 @@ class SupportTicket(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"Ticket {self.ticket_id} - {self.subject} ({self.status})"
\ No newline at end of file
+        return f"Ticket {self.ticket_id} - {self.subject} ({self.status})"
+
+class OutboxEmail(models.Model):
+    """Transactional email queued by views and delivered by the drain_outbox command"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead letter'),
+    ]
+
+    # Enqueuing the same key twice yields one email
+    dedup_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When a pending email is due, or when a claimed one may be reclaimed
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='users_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
@@ -0,0 +1,170 @@
+"""Database-backed outbox for transactional email.
+
+Views call ``enqueue`` instead of ``send_mail``; the ``drain_outbox``
+command delivers queued rows in batches over one SMTP connection. Failed
+sends are retried with exponential backoff and moved to the ``dead``
+state after ``MAX_ATTEMPTS``. Several drainers can run at once: a batch is
+claimed with a conditional UPDATE, and a claim that is never settled (a
+crashed drainer) expires after ``CLAIM_TIMEOUT`` and counts as an attempt,
+so an email that crashes every drainer is dead-lettered too. Sent emails,
+password-reset links among them, are deleted after ``SENT_RETENTION``.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveSmallIntegerField, Q, When
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+CLAIM_TIMEOUT = timedelta(minutes=10)
+SENT_RETENTION = timedelta(days=7)
+
+
+def enqueue(subject, body, recipients, from_email=None, dedup_key=None):
+    """Queue an email; returns the OutboxEmail (the existing one for a repeated ``dedup_key``)"""
+    fields = {
+        'subject': subject,
+        'body': body,
+        'recipients': list(recipients),
+        'from_email': from_email or settings.DEFAULT_FROM_EMAIL,
+    }
+    if dedup_key is None:
+        return OutboxEmail.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            return OutboxEmail.objects.create(dedup_key=dedup_key, **fields)
+    except IntegrityError:
+        return OutboxEmail.objects.get(dedup_key=dedup_key)
+
+
+def enqueue_many(emails, from_email=None):
+    """Queue ``(subject, body, recipients, dedup_key)`` tuples in one INSERT; repeated keys are skipped"""
+    from_email = from_email or settings.DEFAULT_FROM_EMAIL
+    OutboxEmail.objects.bulk_create(
+        [
+            OutboxEmail(
+                subject=subject, body=body, recipients=list(recipients),
+                from_email=from_email, dedup_key=dedup_key,
+            )
+            for subject, body, recipients, dedup_key in emails
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * (2 ** (attempts - 1)), BACKOFF_MAX)
+
+
+def bury_abandoned(now, max_attempts=MAX_ATTEMPTS):
+    """Dead-letter abandoned claims with no attempts left; returns how many"""
+    buried = OutboxEmail.objects.filter(
+        status='sending', next_attempt_at__lte=now, attempts__gte=max_attempts - 1,
+    ).update(
+        status='dead', attempts=F('attempts') + 1, next_attempt_at=now,
+        last_error='Claimed by a drainer that never settled it',
+    )
+    if buried:
+        logger.error('%s outbox emails dead after their last claim was abandoned', buried)
+    return buried
+
+
+def claim_batch(now, batch_size=BATCH_SIZE):
+    """Claim up to ``batch_size`` due emails for this drainer and return them"""
+    due = Q(status='pending') | Q(status='sending')  # 'sending' rows here are abandoned claims
+    ids = list(
+        OutboxEmail.objects.filter(due, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    claimed_until = now + CLAIM_TIMEOUT
+    OutboxEmail.objects.filter(due, id__in=ids, next_attempt_at__lte=now).update(
+        status='sending', next_attempt_at=claimed_until,
+        # The abandoned claim was an attempt too, maybe one that crashed its drainer
+        attempts=Case(
+            When(status='sending', then=F('attempts') + 1), default=F('attempts'),
+            output_field=PositiveSmallIntegerField(),
+        ),
+    )
+    # Rows another drainer took first carry its claim time, not ours
+    return list(OutboxEmail.objects.filter(id__in=ids, status='sending', next_attempt_at=claimed_until))
+
+
+def _send(connection, email):
+    message = EmailMessage(
+        email.subject, email.body, email.from_email, email.recipients, connection=connection
+    )
+    return message.send() > 0
+
+
+def drain(batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+    """Deliver one batch over a single SMTP connection; returns ``(sent, retried, dead)``"""
+    now = timezone.now()
+    buried = bury_abandoned(now, max_attempts)
+    batch = claim_batch(now, batch_size)
+    if not batch:
+        return 0, 0, buried
+
+    sent_ids, failures = [], []
+    connection = get_connection(fail_silently=False)
+    is_open = False
+    try:
+        for email in batch:
+            try:
+                if not is_open:
+                    connection.open()
+                    is_open = True
+                if _send(connection, email):
+                    sent_ids.append(email.pk)
+                else:
+                    failures.append((email, 'Rejected by the mail server'))
+            except Exception as exc:
+                failures.append((email, str(exc) or exc.__class__.__name__))
+                # The connection may be broken; reconnect for the rest of the batch
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                is_open = False
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    settled_at = timezone.now()
+    OutboxEmail.objects.filter(pk__in=sent_ids).update(status='sent', sent_at=settled_at, last_error='')
+
+    retried, dead = 0, buried
+    for email, error in failures:
+        attempts = email.attempts + 1
+        if attempts >= max_attempts:
+            status, next_attempt_at = 'dead', settled_at
+            dead += 1
+            logger.error('Outbox email %s dead after %s attempts: %s', email.pk, attempts, error)
+        else:
+            status, next_attempt_at = 'pending', settled_at + backoff(attempts)
+            retried += 1
+        OutboxEmail.objects.filter(pk=email.pk).update(
+            status=status, attempts=attempts, next_attempt_at=next_attempt_at, last_error=error[:2000]
+        )
+
+    return len(sent_ids), retried, dead
+
+
+def purge_sent(now, retention=SENT_RETENTION):
+    """Delete emails sent more than ``retention`` ago; returns how many"""
+    deleted, _ = OutboxEmail.objects.filter(status='sent', sent_at__lt=now - retention).delete()
+    return deleted
@@ -1,9 +1,10 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from allauth.socialaccount.models import SocialAccount
 from allauth.account.signals import user_logged_in
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Notification
+from . import counters, verification
 from rest_framework_simplejwt.tokens import RefreshToken
 import logging
 
@@ -16,6 +17,9 @@ def create_incomplete_profile_for_social_user(sender, instance, created, **kwarg
     if not created:
         return
 
+    # The cached verification state records whether the user is a social user
+    verification.invalidate(instance.user_id)
+
     user = instance.user
     if hasattr(user, 'userprofile'):
         return
@@ -64,4 +68,24 @@ def set_jwt_on_social_login(sender, request, user, **kwargs):
     if request:
         refresh = RefreshToken.for_user(user)
         request.session['jwt_access'] = str(refresh.access_token)
-        request.session['jwt_refresh'] = str(refresh)
\ No newline at end of file
+        request.session['jwt_refresh'] = str(refresh)
+
+@receiver(post_save, sender=Notification)
+def count_unread_notification(sender, instance, created, **kwargs):
+    """Keep the cached unread notification badge in step"""
+    if created and not instance.is_read:
+        counters.adjust(instance.recipient_id, 'unread_notifications_count', 1)
+    elif not created:
+        counters.invalidate(instance.recipient_id, 'unread_notifications_count')
+
+
+@receiver(post_delete, sender=Notification)
+def uncount_notification(sender, instance, **kwargs):
+    counters.invalidate(instance.recipient_id, 'unread_notifications_count')
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def reset_verification_state(sender, instance, **kwargs):
+    """Drop the cached verification state whenever the profile changes"""
+    verification.invalidate(instance.user_id)
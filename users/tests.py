@@ -1,3 +1,306 @@
-from django.test import TestCase
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import counters, outbox, verification
+from .models import Notification, OutboxEmail, UserProfile
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Minimal local SMTP stand-in that records connections and delivered messages"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, delay=0.0, reject=()):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.delay = delay
+        self.reject = set(reject)
+        self.connections = 0
+        self.messages = []
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 fake-smtp ready')
+        recipients, data = [], None
+        for raw in self.rfile:
+            line = raw.decode().rstrip('\r\n')
+            if data is not None:
+                if line == '.':
+                    time.sleep(server.delay)
+                    server.messages.append((recipients, '\n'.join(data)))
+                    recipients, data = [], None
+                    self.reply('250 queued')
+                else:
+                    data.append(line)
+                continue
+
+            command = line[:4].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 fake-smtp')
+            elif command == 'RCPT':
+                address = line.split(':', 1)[1].strip(' <>')
+                if address in server.reject:
+                    self.reply('550 mailbox unavailable')
+                else:
+                    recipients.append(address)
+                    self.reply('250 ok')
+            elif command == 'DATA':
+                data = []
+                self.reply('354 end with .')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:  # MAIL, RSET, NOOP
+                self.reply('250 ok')
+
+
+def smtp_settings(server):
+    return override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1',
+        EMAIL_PORT=server.port,
+        EMAIL_USE_TLS=False,
+        EMAIL_HOST_USER='support@shetrip.test',
+        EMAIL_HOST_PASSWORD='',
+        DEFAULT_FROM_EMAIL='noreply@shetrip.test',
+    )
+
+
+class OutboxTests(TestCase):
+
+    def test_support_ticket_request_only_enqueues(self):
+        user = User.objects.create_user('ticketuser', password='x')
+        self.client.force_login(user)
+
+        with FakeSMTPServer(delay=1.0) as server, smtp_settings(server):
+            started = time.perf_counter()
+            response = self.client.post(reverse('submit_support_ticket'), {
+                'name': 'Ticket User', 'email': 'ticket@example.com', 'subject': 'Refund',
+                'category': 'payment', 'priority': 'high', 'message': 'Please help',
+            })
+            elapsed = time.perf_counter() - started
+
+            self.assertEqual(response.status_code, 302)
+            # The request never touched SMTP, so a slow server cannot delay it
+            self.assertEqual(server.connections, 0)
+            self.assertLess(elapsed, server.delay)
+            self.assertEqual(OutboxEmail.objects.filter(status='pending').count(), 2)
+
+            self.assertEqual(outbox.drain(), (2, 0, 0))
+            self.assertEqual(server.connections, 1)
+
+    def test_drain_delivers_batch_over_one_connection(self):
+        for i in range(5):
+            outbox.enqueue(f'Subject {i}', 'Body', [f'user{i}@example.com'])
+
+        with FakeSMTPServer() as server, smtp_settings(server):
+            self.assertEqual(outbox.drain(), (5, 0, 0))
+
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(sorted(r for recipients, _ in server.messages for r in recipients),
+                         [f'user{i}@example.com' for i in range(5)])
+        self.assertFalse(OutboxEmail.objects.exclude(status='sent').exists())
+
+    def test_dedup_key_enqueues_once(self):
+        first = outbox.enqueue('Reset', 'Body', ['a@example.com'], dedup_key='password-reset:1:abc')
+        second = outbox.enqueue('Reset', 'Body', ['a@example.com'], dedup_key='password-reset:1:abc')
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_rejected_email_backs_off_then_dead_letters(self):
+        bad = outbox.enqueue('Hello', 'Body', ['bounce@example.com'])
+        good = outbox.enqueue('Hello', 'Body', ['ok@example.com'])
+
+        with FakeSMTPServer(reject=['bounce@example.com']) as server, smtp_settings(server):
+            self.assertEqual(outbox.drain(max_attempts=2), (1, 1, 0))
+
+            bad.refresh_from_db()
+            self.assertEqual((bad.status, bad.attempts), ('pending', 1))
+            self.assertGreater(bad.next_attempt_at, timezone.now())
+            self.assertEqual(outbox.drain(max_attempts=2), (0, 0, 0))  # Not due yet
+
+            OutboxEmail.objects.filter(pk=bad.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(outbox.drain(max_attempts=2), (0, 0, 1))
+
+        bad.refresh_from_db()
+        good.refresh_from_db()
+        self.assertEqual(bad.status, 'dead')
+        self.assertIn('550', bad.last_error)
+        self.assertEqual(good.status, 'sent')
+
+    def test_abandoned_claim_is_reclaimed(self):
+        email = outbox.enqueue('Hello', 'Body', ['a@example.com'])
+        OutboxEmail.objects.filter(pk=email.pk).update(
+            status='sending', next_attempt_at=timezone.now() - outbox.CLAIM_TIMEOUT
+        )
+
+        with FakeSMTPServer() as server, smtp_settings(server):
+            self.assertEqual(outbox.drain(), (1, 0, 0))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 1))
+
+    def test_email_whose_claims_keep_being_abandoned_is_dead_lettered(self):
+        email = outbox.enqueue('Hello', 'Body', ['a@example.com'])
+        OutboxEmail.objects.filter(pk=email.pk).update(
+            status='sending', attempts=outbox.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now() - outbox.CLAIM_TIMEOUT
+        )
+
+        with FakeSMTPServer() as server, smtp_settings(server), self.assertLogs('users.outbox', 'ERROR'):
+            self.assertEqual(outbox.drain(), (0, 0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('dead', outbox.MAX_ATTEMPTS))
+        self.assertEqual(server.connections, 0)
+
+    def test_drain_command_deletes_old_sent_emails(self):
+        now = timezone.now()
+        old = outbox.enqueue('Reset', 'Link', ['a@example.com'])
+        recent = outbox.enqueue('Reset', 'Link', ['b@example.com'])
+        dead = outbox.enqueue('Reset', 'Link', ['c@example.com'])
+        OutboxEmail.objects.filter(pk=old.pk).update(status='sent', sent_at=now - outbox.SENT_RETENTION - timedelta(seconds=1))
+        OutboxEmail.objects.filter(pk=recent.pk).update(status='sent', sent_at=now - outbox.SENT_RETENTION / 2)
+        OutboxEmail.objects.filter(pk=dead.pk).update(status='dead', sent_at=None)
+
+        call_command('drain_outbox', stdout=StringIO())
+
+        self.assertCountEqual(OutboxEmail.objects.values_list('pk', flat=True), [recent.pk, dead.pk])
+
+
+class CounterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('counted')
+        self.sender = User.objects.create_user('sender')
+
+    def _notify(self, **fields):
+        return Notification.objects.create(
+            recipient=self.user, sender=self.sender, notification_type='message', message='Hi', **fields,
+        )
+
+    def test_counts_are_read_from_the_database_once(self):
+        self._notify()
+        self._notify(is_read=True)
+
+        with self.assertNumQueries(len(counters.COUNTERS)):
+            values = counters.get_counters(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.get_counters(self.user.pk), values)
+        self.assertEqual(values['unread_notifications_count'], 1)
+        self.assertEqual(values['user_plans_count'], 0)
+
+    def test_signals_adjust_cached_counts_in_place(self):
+        counters.get_counters(self.user.pk)
+        self._notify()
+        self._notify()
+        self._notify(is_read=True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.get_counters(self.user.pk)['unread_notifications_count'], 2)
+
+    def test_writes_that_skip_signals_are_recounted_after_invalidate(self):
+        self._notify()
+        counters.get_counters(self.user.pk)
+        Notification.objects.filter(recipient=self.user).update(is_read=True)
+        self.assertEqual(counters.get_counters(self.user.pk)['unread_notifications_count'], 1)  # Still stale
+
+        counters.invalidate([self.user.pk], 'unread_notifications_count')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(counters.get_counters(self.user.pk)['unread_notifications_count'], 0)
+
+    def test_adjust_never_creates_or_drives_a_counter_negative(self):
+        counters.adjust(self.user.pk, 'unread_notifications_count', 1)
+        self.assertIsNone(cache.get(counters._key(self.user.pk, 'unread_notifications_count')))
+
+        counters.get_counters(self.user.pk)
+        counters.adjust(self.user.pk, 'unread_notifications_count', -1)
+
+        self.assertIsNone(cache.get(counters._key(self.user.pk, 'unread_notifications_count')))
+        self.assertEqual(counters.get_counters(self.user.pk)['unread_notifications_count'], 0)
+
+    def test_cache_is_shared_when_redis_is_configured(self):
+        env = {**os.environ, 'REDIS_URL': 'redis://cache.internal:6379/0'}
+        script = 'from django.conf import settings; print(settings.CACHES["default"]["BACKEND"])'
+        result = subprocess.run(
+            [sys.executable, '-c', f'import django; django.setup(); {script}'],
+            env={**env, 'DJANGO_SETTINGS_MODULE': 'shetrip.settings'}, capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(result.stdout.strip(), 'django.core.cache.backends.redis.RedisCache')
+
+
+class VerificationStateTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('moderator', 'moderator@example.com', 'x')
+        self.traveller = User.objects.create_user('traveller')
+        UserProfile.objects.filter(user=self.traveller).update(verification_status='verified')
+
+    def _decide(self, action, **filters):
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            reverse('admin:users_userprofile_changelist') + (f'?{urlencode(filters)}' if filters else ''),
+            {'action': action, '_selected_action': [self.traveller.userprofile.pk]},
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def _my_trips(self):
+        self.client.force_login(self.traveller)
+        return self.client.get(reverse('my_trips'))
+
+    def test_rejection_revokes_access(self):
+        self.assertEqual(self._my_trips().status_code, 200)  # Caches the verified state
+
+        self._decide('reject_verification')
+
+        self.assertRedirects(self._my_trips(), reverse('verification'), fetch_redirect_response=False)
+
+    def test_approval_from_a_filtered_changelist_grants_access(self):
+        UserProfile.objects.filter(user=self.traveller).update(verification_status='pending')
+        self.assertRedirects(self._my_trips(), reverse('verification'), fetch_redirect_response=False)
+
+        self._decide('approve_verification', verification_status__exact='pending')
+
+        self.assertEqual(self._my_trips().status_code, 200)
+
+    def test_state_is_cached_between_requests(self):
+        verification.get_state(self.traveller)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(verification.get_state(self.traveller), {'status': 'verified', 'is_social': False})
@@ -0,0 +1,54 @@
+"""Cached verification state used to gate trip features.
+
+The middleware, ``verification_required`` and the dashboard all need a
+user's verification status and whether they signed up through a social
+account. Both are cached per user so a gated page view costs no queries;
+profile saves, social account links and the admin approve/reject actions
+invalidate the entry.
+
+An invalidation has to reach every web worker, so this relies on the shared
+cache (``REDIS_URL``). The short timeout bounds the one race invalidation
+cannot close: a request that read the old status just before an admin
+decision and caches it just after.
+"""
+from django.core.cache import cache
+
+from .models import UserProfile
+
+
+CACHE_TIMEOUT = 60 * 5
+
+# Stored in place of a status when the user has no UserProfile row
+NO_PROFILE = 'no_profile'
+
+
+def _key(user_id):
+    return f'verification:{user_id}'
+
+
+def get_state(user):
+    """Return ``{'status': ..., 'is_social': ...}`` for ``user``, loading it on a cache miss"""
+    state = cache.get(_key(user.pk))
+    if state is None:
+        status = UserProfile.objects.filter(user_id=user.pk).values_list(
+            'verification_status', flat=True
+        ).first()
+        state = {
+            'status': status or NO_PROFILE,
+            'is_social': user.socialaccount_set.exists(),
+        }
+        cache.set(_key(user.pk), state, CACHE_TIMEOUT)
+    return state
+
+
+def for_request(request):
+    """Verification state for the logged-in user, looked up at most once per request"""
+    if not hasattr(request, '_verification_state'):
+        request._verification_state = get_state(request.user)
+    return request._verification_state
+
+
+def invalidate(user_ids):
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+    cache.delete_many([_key(user_id) for user_id in user_ids])
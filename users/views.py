@@ -19,9 +19,9 @@ from django.conf import settings
 from .models import UserConnection, Notification
 from django.db.models import Q
 
-from django.core.mail import send_mail
 from django.conf import settings
 from .models import SupportTicket
+from . import counters, outbox, verification
 from django.views.decorators.http import require_http_methods
 
 
@@ -209,7 +209,7 @@ def dashboard_view(request):
     context = {
         'profile': profile,
         'verification_required': not profile.is_verified,
-        'is_social_user': hasattr(request.user, 'socialaccount_set') and request.user.socialaccount_set.exists()
+        'is_social_user': verification.for_request(request)['is_social'],
     }
 
     return render(request, 'users/dashboard.html', context)
@@ -282,7 +282,6 @@ class CustomPasswordResetView(PasswordResetView):
         from django.contrib.auth.tokens import default_token_generator
         from django.utils.http import urlsafe_base64_encode
         from django.utils.encoding import force_bytes
-        from django.core.mail import send_mail
         from django.template.loader import render_to_string
         from django.contrib import messages
 
@@ -321,27 +320,13 @@ class CustomPasswordResetView(PasswordResetView):
             subject = ''.join(subject.splitlines())  # Remove newlines
             body = render_to_string(self.email_template_name, context)
 
-            # Send email
-            try:
-                send_mail(
-                    subject=subject,
-                    message=body,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[user.email],
-                    fail_silently=False,
-                )
-                print(f"✅ Password reset email sent to {user.email}")
-            except Exception as e:
-                # Log error but don't expose to user
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"Password reset email failed: {e}")
-                messages.error(
-                    self.request,
-                    '❌ Failed to send email. Please try again later.'
-                )
-                return redirect('password_reset')
-                # Still redirect to success page (security)
+            # Queue email; drain_outbox delivers it (same token = same email)
+            outbox.enqueue(
+                subject,
+                body,
+                [user.email],
+                dedup_key=f'password-reset:{user.pk}:{token}',
+            )
 
         # Store email for success page
         if email:
@@ -427,21 +412,15 @@ def community_view(request):
     my_connections = UserConnection.objects.filter(
         Q(from_user=current_user, status='connected') |
         Q(to_user=current_user, status='connected'),
-    )
+    ).values_list('from_user_id', 'to_user_id')
 
     connected_user_ids = set()
-    for conn in my_connections:
-        # Add only the OTHER user (not current user)
-        if conn.from_user == current_user:
-            connected_user_ids.add(conn.to_user_id)
+    for from_user_id, to_user_id in my_connections:
+        # Add only the OTHER user (not current user); compared by id so no user rows are fetched
+        if from_user_id == current_user.pk:
+            connected_user_ids.add(to_user_id)
         else:
-            connected_user_ids.add(conn.from_user_id)
-
-    # Get pending requests
-    pending_requests = UserConnection.objects.filter(
-        to_user=current_user,
-        status='pending'
-    ).values_list('from_user_id', flat=True)
+            connected_user_ids.add(from_user_id)
 
     # Get pending connection requests received
     pending_received = UserConnection.objects.filter(
@@ -449,6 +428,9 @@ def community_view(request):
         status='pending'
     ).select_related('from_user', 'from_user__userprofile')
 
+    # Senders of pending requests, from the same rows the template lists
+    pending_requests = {conn.from_user_id for conn in pending_received}
+
     # Get pending requests sent
     pending_sent = UserConnection.objects.filter(
         from_user=current_user,
@@ -593,6 +575,7 @@ def notifications_view(request):
         recipient=user,
         is_read=False
     ).update(is_read=True)
+    counters.invalidate(user.pk, 'unread_notifications_count')
 
     context = {
         'notifications': notifications,
@@ -639,7 +622,7 @@ def my_connections(request):
 
     for conn in my_connections_obj:
         # Determine which user is the OTHER person (not current user)
-        if conn.from_user == current_user:
+        if conn.from_user_id == current_user.pk:
             connected_user = conn.to_user
         else:
             connected_user = conn.from_user
@@ -725,10 +708,10 @@ def submit_support_ticket(request):
                 status='open'
             )
             
-            # Send confirmation email to user
-            send_mail(
+            # Queue confirmation email to user
+            outbox.enqueue(
                 subject=f'Support Ticket #{ticket.ticket_id} Created',
-                message=f'''
+                body=f'''
                 Hello {ticket.name},
                 
                 We received your support request. Your ticket number is: {ticket.ticket_id}
@@ -741,15 +724,14 @@ def submit_support_ticket(request):
                 Best regards,
                 SheTrip Support Team
                 ''',
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[ticket.email],
-                fail_silently=False,
+                recipients=[ticket.email],
+                dedup_key=f'support-ticket:{ticket.ticket_id}:user',
             )
             
-            # Send notification email to admin
-            send_mail(
+            # Queue notification email to admin
+            outbox.enqueue(
                 subject=f'New Support Ticket #{ticket.ticket_id} - {ticket.subject}',
-                message=f'''
+                body=f'''
                 New support ticket submitted:
                 
                 Ticket ID: {ticket.ticket_id}
@@ -764,9 +746,8 @@ def submit_support_ticket(request):
                 
                 Admin Panel: /admin/users/supportticket/{ticket.ticket_id}/change/
                 ''',
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[settings.EMAIL_HOST_USER],  # Your admin email
-                fail_silently=False,
+                recipients=[settings.EMAIL_HOST_USER],  # Your admin email
+                dedup_key=f'support-ticket:{ticket.ticket_id}:admin',
             )
             
             messages.success(request, 'Your support ticket has been created. We will contact you soon!')